@@ -0,0 +1,205 @@
+import os
+import argparse
+import torch
+from utils import load
+from holccg import load_holccg
+from encoder_cache import EncoderCache
+from span_parser import SpanParser, format_parse
+from supertagging import convert_bracket, load_pos, select_supertags, format_supertags
+from typing import Dict, Iterator, List
+
+TASKS = ['stag', 'parse']
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path_to_sentence', type=str, help='path to sentence to be analyzed')
+    parser.add_argument('--path_to_model', type=str, help='path to model used for analysis')
+    parser.add_argument('--path_to_pos', type=str, default=None, help='path to pos tagged file')
+    parser.add_argument('--path_to_dataset', type=str, default='../dataset/', help='path to dataset')
+    parser.add_argument(
+        '--output',
+        type=str,
+        nargs='+',
+        default=TASKS,
+        choices=TASKS,
+        help='outputs to be produced from a single encoder pass, by default both supertags and parses')
+    parser.add_argument(
+        '--path_to_stag_output',
+        type=str,
+        default=None,
+        help='path to write supertags, by default the path to sentence with .stag')
+    parser.add_argument(
+        '--path_to_parse_output',
+        type=str,
+        default=None,
+        help='path to write parses in auto format, by default the path to sentence with .auto')
+    parser.add_argument(
+        '--stag_threshold', type=float, default=0.1, help='threshold for supertagging, which is shared with parsing')
+    parser.add_argument('--phrase_threshold', type=float, default=0.01, help='threshold for phrase')
+    parser.add_argument('--span_threshold', type=float, default=0.01, help='threshold for span')
+    parser.add_argument('--min_freq', type=int, default=1, help='minimum frequency of combinatory rule to be used')
+    parser.add_argument('--print_probability', action='store_true', help='print probability of supertags')
+    parser.add_argument('--skimmer', action='store_true', help='use skimmer')
+    parser.add_argument('--spectral', action='store_true', help='compose vectors in Fourier domain')
+    parser.add_argument(
+        '--num_encoder_layers',
+        type=int,
+        default=None,
+        help='number of encoder layers to use from the bottom')
+    parser.add_argument(
+        '--early_exit_threshold',
+        type=float,
+        default=None,
+        help='stop encoding at the layer where the word classifier is confident for all words')
+    parser.add_argument(
+        '--window_size',
+        type=int,
+        default=None,
+        help='number of tokens in each window to encode sentences longer than it by overlapping windows')
+    parser.add_argument(
+        '--window_stride',
+        type=int,
+        default=None,
+        help='number of subwords between the starts of adjacent windows, by default the half of window')
+    parser.add_argument('--batch_size', type=int, default=1, help='number of sentences encoded at once')
+    parser.add_argument(
+        '--pack_size',
+        type=int,
+        default=None,
+        help='number of tokens in each encoder sequence into which the sentences of a batch are packed')
+    parser.add_argument(
+        '--path_to_encoder_cache',
+        type=str,
+        default=None,
+        help='directory to cache word vectors of sentences, which are reused by later runs with the same model')
+    parser.add_argument(
+        '--quantize',
+        type=str,
+        default='none',
+        choices=['none', 'int8'],
+        help='apply dynamic quantization to linear layers (int8 is available only on cpu)')
+    parser.add_argument(
+        '--device',
+        type=torch.device,
+        default=torch.device('cuda:0'),
+        help='device to use for analysis')
+    args = parser.parse_args()
+    return args
+
+
+def analyze(
+        parser: SpanParser,
+        sentence_list: List[str],
+        pos_list: List[List[str]],
+        tasks: List[str] = TASKS,
+        batch_size: int = 1,
+        print_probability: bool = False,
+        skimmer: bool = False) -> Iterator[Dict[str, List[str]]]:
+    """supertag and parse sentences, encoding each batch of sentences only once
+
+    The word vectors and the top categories predicted for supertagging are reused
+    as the initial cells of CKY chart, so that both outputs agree with the same
+    threshold of supertagging.
+
+    Parameters
+    ----------
+    parser : SpanParser
+        span parser whose stag_threshold is used for supertagging as well
+    sentence_list : List[str]
+        sentences to be analyzed
+    pos_list : List[List[str]]
+        POS tags of each sentence, which are printed with supertags
+    tasks : List[str], optional
+        outputs to be produced from 'stag' and 'parse', by default both
+    batch_size : int, optional
+        number of sentences encoded at once, by default 1
+    print_probability : bool, optional
+        whether to print probability of supertags, by default False
+    skimmer : bool, optional
+        whether to output successfully parsed subspans when parsing is failed, by default False
+
+    Yields
+    ------
+    Iterator[Dict[str, List[str]]]
+        output lines of each task for each sentence
+    """
+    sentence_id = 0
+    for batch_start in range(0, len(sentence_list), batch_size):
+        batch_sentence_list = [sentence.rstrip() for sentence in sentence_list[batch_start:batch_start + batch_size]]
+        word_prediction_list = parser.predict_word(batch_sentence_list)
+        for sentence, pos_tags, word_prediction in zip(
+                batch_sentence_list, pos_list[batch_start:batch_start + batch_size], word_prediction_list):
+            sentence_id += 1
+            output = {}
+            if 'stag' in tasks:
+                _, word_cat_ll, predict_cat_id = word_prediction
+                super_tags = select_supertags(
+                    word_cat_ll, predict_cat_id, parser.word_category_vocab, parser.stag_threshold)
+                words = [convert_bracket(content) for content in sentence.split()]
+                output['stag'] = [format_supertags(words, pos_tags, super_tags, print_probability)]
+            if 'parse' in tasks:
+                chart = parser.parse(sentence, word_prediction)
+                output['parse'] = format_parse(parser, chart, sentence, sentence_id, skimmer)
+            yield output
+
+
+def main():
+    args = arg_parse()
+
+    word_category_vocab = load(os.path.join(args.path_to_dataset, 'grammar/word_category_vocab.pickle'))
+    phrase_category_vocab = load(os.path.join(args.path_to_dataset, 'grammar/phrase_category_vocab.pickle'))
+    head_info = load(os.path.join(args.path_to_dataset, 'grammar/head_info.pickle'))
+    rule_counter = load(os.path.join(args.path_to_dataset, 'grammar/rule_counter.pickle'))
+
+    with open(args.path_to_sentence, 'r') as f:
+        sentence_list = f.readlines()
+    pos_list = load_pos(args.path_to_pos, sentence_list)
+
+    holccg = load_holccg(args.path_to_model, args.device, args.quantize)
+    if args.num_encoder_layers is not None:
+        holccg.num_encoder_layers = args.num_encoder_layers
+    holccg.early_exit_threshold = args.early_exit_threshold
+    holccg.window_size = args.window_size
+    holccg.window_stride = args.window_stride
+    holccg.pack_size = args.pack_size
+    holccg.spectral = args.spectral
+    if args.path_to_encoder_cache is not None:
+        holccg.encoder_cache = EncoderCache(args.path_to_encoder_cache)
+
+    parser = SpanParser(
+        word_category_vocab=word_category_vocab,
+        phrase_category_vocab=phrase_category_vocab,
+        head_info=head_info,
+        rule_counter=rule_counter,
+        holccg=holccg,
+        stag_threshold=args.stag_threshold,
+        phrase_threshold=args.phrase_threshold,
+        span_threshold=args.span_threshold,
+        min_freq=args.min_freq)
+
+    path_to_output = {
+        'stag': args.path_to_stag_output or os.path.splitext(args.path_to_sentence)[0] + '.stag',
+        'parse': args.path_to_parse_output or os.path.splitext(args.path_to_sentence)[0] + '.auto'}
+    output_file = {task: open(path_to_output[task], 'w') for task in args.output}
+    try:
+        for output in analyze(
+                parser,
+                sentence_list,
+                pos_list,
+                tasks=args.output,
+                batch_size=args.batch_size,
+                print_probability=args.print_probability,
+                skimmer=args.skimmer):
+            for task, lines in output.items():
+                for line in lines:
+                    output_file[task].write(line + '\n')
+    finally:
+        for f in output_file.values():
+            f.close()
+    if holccg.encoder_cache is not None:
+        holccg.encoder_cache.flush()
+
+
+if __name__ == "__main__":
+    main()
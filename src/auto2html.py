@@ -27,79 +27,67 @@ def main():
 
     tree_list = TreeList(args.path_to_autos.replace('.auto', '.converted'), 'train')
 
-    with tqdm(total=len(tree_list.tree_list), unit="tree") as pbar:
-        pbar.set_description("Setting node information...")
-        for tree in tree_list.tree_list:
-            tree.root_node = tree.node_list[-1]
-            tree.root_node.parent_node = None
-            for node in reversed(tree.node_list):
-                if not node.is_leaf:
-                    if node.num_child == 1:
-                        node.child = tree.node_list[node.child_node_id]
-                    elif node.num_child == 2:
-                        node.left_child = tree.node_list[node.left_child_node_id]
-                        node.right_child = tree.node_list[node.right_child_node_id]
-            pbar.update(1)
-
     mathml_list = []
     num_sentence = 0
     with tqdm(total=len(tree_list.tree_list), unit="tree") as pbar:
         pbar.set_description("Converting to html format...")
         for tree in tree_list.tree_list:
             num_sentence += 1
-            tree.root_node.mathml = []
-            waiting_nodes = [tree.root_node]
+            # mathml of each node is kept in a side table by node id
+            mathml = {node.self_id: [] for node in tree.node_list}
+            root_node = tree.node_list[-1]
+            waiting_nodes = [root_node]
             while len(waiting_nodes) > 0:
                 node = waiting_nodes.pop(0)
                 if node.is_leaf:
-                    node.mathml += ['<mfrac><mtext>',
-                                    node.content[0],
-                                    '</mtext><mtext>',
-                                    node.category,
-                                    '</mtext></mfrac>']
+                    mathml[node.self_id] += ['<mfrac><mtext>',
+                                             node.content[0],
+                                             '</mtext><mtext>',
+                                             node.category,
+                                             '</mtext></mfrac>']
                 else:
                     if node.num_child == 1:
-                        node.child.mathml = []
-                        node.mathml += ['<mfrac>',
-                                        node.child.mathml,
-                                        '<mtext>',
-                                        node.category,
-                                        '</mtext></mfrac>']
-                        if node.child.is_leaf:
-                            node.child.mathml += ['<mfrac><mtext>',
-                                                  node.child.content[0],
-                                                  '</mtext><mtext>',
-                                                  node.child.category,
-                                                  '</mtext></mfrac>']
+                        child_node = tree.node_list[node.child_node_id]
+                        mathml[node.self_id] += ['<mfrac>',
+                                                 mathml[child_node.self_id],
+                                                 '<mtext>',
+                                                 node.category,
+                                                 '</mtext></mfrac>']
+                        if child_node.is_leaf:
+                            mathml[child_node.self_id] += ['<mfrac><mtext>',
+                                                           child_node.content[0],
+                                                           '</mtext><mtext>',
+                                                           child_node.category,
+                                                           '</mtext></mfrac>']
                         else:
-                            waiting_nodes.append(node.child)
+                            waiting_nodes.append(child_node)
                     elif node.num_child == 2:
-                        node.left_child.mathml = []
-                        node.right_child.mathml = []
-                        node.mathml += ['<mfrac><mrow>',
-                                        node.left_child.mathml,
-                                        node.right_child.mathml,
-                                        '</mrow><mtext>',
-                                        node.category,
-                                        '</mtext></mfrac>']
-                        if node.left_child.is_leaf:
-                            node.left_child.mathml += ['<mfrac><mtext>',
-                                                       node.left_child.content[0],
-                                                       '</mtext><mtext>',
-                                                       node.left_child.category,
-                                                       '</mtext></mfrac>']
+                        left_child_node = tree.node_list[node.left_child_node_id]
+                        right_child_node = tree.node_list[node.right_child_node_id]
+                        mathml[node.self_id] += ['<mfrac><mrow>',
+                                                 mathml[left_child_node.self_id],
+                                                 mathml[right_child_node.self_id],
+                                                 '</mrow><mtext>',
+                                                 node.category,
+                                                 '</mtext></mfrac>']
+                        if left_child_node.is_leaf:
+                            mathml[left_child_node.self_id] += ['<mfrac><mtext>',
+                                                                left_child_node.content[0],
+                                                                '</mtext><mtext>',
+                                                                left_child_node.category,
+                                                                '</mtext></mfrac>']
                         else:
-                            waiting_nodes.append(node.left_child)
-                        if node.right_child.is_leaf:
-                            node.right_child.mathml += ['<mfrac><mtext>',
-                                                        node.right_child.content[0],
-                                                        '</mtext><mtext>',
-                                                        node.right_child.category,
-                                                        '</mtext></mfrac>']
+                            waiting_nodes.append(left_child_node)
+                        if right_child_node.is_leaf:
+                            mathml[right_child_node.self_id] += ['<mfrac><mtext>',
+                                                                 right_child_node.content[0],
+                                                                 '</mtext><mtext>',
+                                                                 right_child_node.category,
+                                                                 '</mtext></mfrac>']
                         else:
-                            waiting_nodes.append(node.right_child)
+                            waiting_nodes.append(right_child_node)
             mathml_list.append('<p>Sentence ID={}</p><math>{}</math>'.format(tree.self_id,
-                                                                             ''.join(flatten(tree.root_node.mathml))))
+                                                                             ''.join(flatten(mathml[root_node.self_id]))))
             pbar.update(1)
 
     html = '''\
@@ -0,0 +1,218 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tree import TreeList
+from typing import Iterator, List, Tuple
+
+
+def make_budget_batch_tree_id(
+        num_token: np.ndarray,
+        num_composition: np.ndarray,
+        batch_size: int = None,
+        max_num_token: int = None,
+        max_num_composition: int = None,
+        shuffle: bool = True) -> List[np.ndarray]:
+    """Pack trees sorted by length into batches whose padded sizes are within budgets
+
+    A batch is padded to its longest sentence in the encoder and to its largest number of
+    compositions in composition, so its cost is the number of trees times the maximum.
+    A tree exceeding a budget by itself makes a batch alone.
+
+    Parameters
+    ----------
+    num_token : np.ndarray
+        number of subword tokens of each sentence including special tokens
+    num_composition : np.ndarray
+        number of compositions of each tree
+    batch_size : int, optional
+        maximum number of trees in a batch, by default None
+    max_num_token : int, optional
+        maximum number of padded tokens in a batch, by default None
+    max_num_composition : int, optional
+        maximum number of padded composition steps in a batch, by default None
+    shuffle : bool, optional
+        whether to draw trees of the same length in random order and shuffle batches, by default True.
+        Otherwise batches are deterministic and in the order of length
+
+    Returns
+    -------
+    List[np.ndarray]
+        id of trees in each batch
+    """
+    if shuffle:
+        order = np.lexsort((np.random.permutation(len(num_token)), num_composition, num_token))
+    else:
+        order = np.lexsort((np.arange(len(num_token)), num_composition, num_token))
+    batch_tree_id_list = []
+    start = 0
+    batch_num_token = 0
+    batch_num_composition = 0
+    for idx, tree_id in enumerate(order.tolist()):
+        size = idx - start + 1
+        new_num_token = max(batch_num_token, num_token[tree_id])
+        new_num_composition = max(batch_num_composition, num_composition[tree_id])
+        if size > 1 and (
+                (batch_size is not None and size > batch_size)
+                or (max_num_token is not None and new_num_token * size > max_num_token)
+                or (max_num_composition is not None and new_num_composition * size > max_num_composition)):
+            batch_tree_id_list.append(order[start:idx])
+            start = idx
+            new_num_token = num_token[tree_id]
+            new_num_composition = num_composition[tree_id]
+        batch_num_token = new_num_token
+        batch_num_composition = new_num_composition
+    if start < len(order):
+        batch_tree_id_list.append(order[start:])
+    if shuffle:
+        batch_tree_id_list = [batch_tree_id_list[idx] for idx in np.random.permutation(len(batch_tree_id_list))]
+    return batch_tree_id_list
+
+
+def padding_stat(num_token: np.ndarray, num_composition: np.ndarray, batch_tree_id_list: List[np.ndarray]) -> dict:
+    """Statistics of padding in the encoder and composition of batches
+
+    Parameters
+    ----------
+    num_token : np.ndarray
+        number of subword tokens of each sentence including special tokens
+    num_composition : np.ndarray
+        number of compositions of each tree
+    batch_tree_id_list : List[np.ndarray]
+        id of trees in each batch
+
+    Returns
+    -------
+    dict
+        number of batches, mean number of trees in a batch, the ratio of padding in padded tokens and
+        composition steps, and the maximum numbers of padded tokens and composition steps in a batch
+    """
+    padded_token = np.array([len(tree_id) * num_token[tree_id].max() for tree_id in batch_tree_id_list])
+    padded_composition = np.array(
+        [len(tree_id) * num_composition[tree_id].max() for tree_id in batch_tree_id_list])
+    num_tree = sum(len(tree_id) for tree_id in batch_tree_id_list)
+    return {
+        'num_batch': len(batch_tree_id_list),
+        'mean_batch_size': num_tree / len(batch_tree_id_list),
+        'token_padding': float(1 - num_token.sum() / padded_token.sum()),
+        'composition_padding': float(1 - num_composition.sum() / max(padded_composition.sum(), 1)),
+        'max_padded_token': int(padded_token.max()),
+        'max_padded_composition': int(padded_composition.max())}
+
+
+class BatchLoader:
+    def __init__(
+            self,
+            tree_list: TreeList,
+            batch_size: int = None,
+            shuffle: bool = True,
+            num_prefetch: int = 2,
+            max_num_token: int = None,
+            max_num_composition: int = None,
+            sort_by_length: bool = False) -> None:
+        """iterable of batches for training, which are collated by a background thread a few batches ahead
+
+        Each iteration is an epoch. Random trees are regenerated and trees are shuffled in the buckets of
+        similar numbers of nodes as TreeList.make_batch, but only the batches being prefetched are kept,
+        so that collation overlaps with the computation of the model.
+        When budgets of padded tokens or composition steps are given, or sort_by_length is set,
+        batches are packed from trees sorted by length by make_budget_batch_tree_id instead.
+
+        Parameters
+        ----------
+        tree_list : TreeList
+            tree list whose info for training is set
+        batch_size : int, optional
+            batch size, by default None, which makes one batch of all trees unless batches are packed
+        shuffle : bool, optional
+            whether to shuffle trees as TreeList.make_batch, by default True
+        num_prefetch : int, optional
+            number of batches collated ahead of the batch being used, by default 2
+        max_num_token : int, optional
+            maximum number of padded subword tokens in a batch, by default None
+        max_num_composition : int, optional
+            maximum number of padded composition steps in a batch, by default None
+        sort_by_length : bool, optional
+            whether to pack batches from trees sorted by length without budgets, by default False
+        """
+        self.tree_list = tree_list
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.num_prefetch = num_prefetch
+        self.max_num_token = max_num_token
+        self.max_num_composition = max_num_composition
+        self.sort_by_length = sort_by_length or max_num_token is not None or max_num_composition is not None
+        # the subword tokens of each sentence are followed by the end token after the start token
+        self.num_token = np.array([word_split[-1][1] + 2 for word_split in tree_list.word_split])
+        self.num_composition = np.diff(tree_list.composition_offset)
+        # batches of the last epoch, whose number may change over epochs when batches are packed
+        self.batch_tree_id_list = None
+
+    def __len__(self) -> int:
+        if self.batch_tree_id_list is not None:
+            return len(self.batch_tree_id_list)
+        if self.sort_by_length:
+            return len(self.make_batch_tree_id(shuffle=False))
+        if self.batch_size is None:
+            return 1
+        return -(-len(self.tree_list.tree_list) // self.batch_size)
+
+    def make_batch_tree_id(self, shuffle: bool = None) -> List[np.ndarray]:
+        """Split the id of trees into batches
+
+        Parameters
+        ----------
+        shuffle : bool, optional
+            whether to shuffle trees, by default None, which follows the setting of loader
+
+        Returns
+        -------
+        List[np.ndarray]
+            id of trees in each batch
+        """
+        if shuffle is None:
+            shuffle = self.shuffle
+        num_tree = len(self.tree_list.tree_list)
+        if self.sort_by_length:
+            return make_budget_batch_tree_id(
+                self.num_token,
+                self.num_composition,
+                batch_size=self.batch_size,
+                max_num_token=self.max_num_token,
+                max_num_composition=self.max_num_composition,
+                shuffle=shuffle)
+        if self.batch_size is None:
+            return [np.arange(num_tree)]
+        if shuffle:
+            tree_id = self.tree_list.make_shuffled_tree_id()
+        else:
+            tree_id = np.arange(num_tree)
+        return [tree_id[idx:idx + self.batch_size] for idx in range(0, num_tree, self.batch_size)]
+
+    def padding_stat(self) -> dict:
+        """Statistics of padding of the batches of the last epoch, or of unshuffled batches before the first epoch"""
+        batch_tree_id_list = self.batch_tree_id_list
+        if batch_tree_id_list is None:
+            batch_tree_id_list = self.make_batch_tree_id(shuffle=False)
+        return padding_stat(self.num_token, self.num_composition, batch_tree_id_list)
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, tuple]]:
+        """Yield the id of trees and the batch fed into HolCCG
+
+        Random trees and batches are drawn in the same order as TreeList.make_batch
+        in the main thread, so that the batches are the same under the same random seed.
+        """
+        random_tree_info = self.tree_list.generate_random_tree_info()
+        self.batch_tree_id_list = self.make_batch_tree_id()
+        executor = ThreadPoolExecutor(max_workers=1)
+        waiting = deque()
+        try:
+            for tree_id_list in self.batch_tree_id_list:
+                waiting.append((tree_id_list, executor.submit(self.tree_list.collate, tree_id_list, random_tree_info)))
+                if len(waiting) > self.num_prefetch:
+                    tree_id_list, future = waiting.popleft()
+                    yield tree_id_list, future.result()
+            while len(waiting) > 0:
+                tree_id_list, future = waiting.popleft()
+                yield tree_id_list, future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
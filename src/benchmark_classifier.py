@@ -0,0 +1,169 @@
+import time
+import argparse
+import torch
+from utils import num_candidate
+from holccg import HolCCG, load_holccg
+from tree_store import open_tree_list
+from typing import Callable, List
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path_to_model', type=str, help='path to model to be benchmarked')
+    parser.add_argument(
+        '--path_to_baseline_model',
+        type=str,
+        default=None,
+        help='path to model with full output layers to be compared, e.g. trained without --adaptive_softmax')
+    parser.add_argument(
+        '--path_to_tree_list', type=str, default='../dataset/tree_list/', help='path to tree list')
+    parser.add_argument('--num_sentence', type=int, default=None, help='number of dev sentences to use')
+    parser.add_argument('--stag_threshold', type=float, default=0.1, help='threshold for supertagging')
+    parser.add_argument(
+        '--num_phrase_candidate',
+        type=int,
+        default=8,
+        help='number of candidate phrase categories scored for each vector')
+    parser.add_argument('--num_repeat', type=int, default=10, help='number of repetitions of timing')
+    parser.add_argument(
+        '--device',
+        type=torch.device,
+        default=torch.device('cuda:0'),
+        help='device to use for benchmark')
+    args = parser.parse_args()
+    return args
+
+
+def measure(function: Callable, device: torch.device, num_repeat: int) -> float:
+    """measure mean elapsed time of function
+
+    Parameters
+    ----------
+    function : Callable
+        function without arguments
+    device : torch.device
+        device on which function runs
+    num_repeat : int
+        number of repetitions
+
+    Returns
+    -------
+    float
+        mean elapsed time in milliseconds
+    """
+    function()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for _ in range(num_repeat):
+        function()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) / num_repeat * 1000
+
+
+@torch.no_grad()
+def benchmark_model(holccg: HolCCG, word_vectors: List[torch.Tensor], args) -> dict:
+    """measure the time of classifier stage for supertagging and phrase scoring
+
+    Parameters
+    ----------
+    holccg : HolCCG
+        model to be benchmarked
+    word_vectors : List[torch.Tensor]
+        word vectors of each sentence
+    args
+        command line arguments
+
+    Returns
+    -------
+    dict
+        elapsed time of each stage in milliseconds
+    """
+    word_classifier = holccg.word_classifier
+    k = num_candidate(holccg.num_word_cat, args.stag_threshold)
+    scoring_head = holccg.make_scoring_head()
+    hidden_list = [scoring_head(vector) for vector in word_vectors]
+    # random candidates stand in for the categories allowed by the grammar
+    ids_list = [torch.randint(1, holccg.num_phrase_cat, (vector.shape[0], args.num_phrase_candidate),
+                              device=vector.device) for vector in word_vectors]
+
+    def full_stag():
+        for vector in word_vectors:
+            prob = torch.softmax(word_classifier(vector), dim=-1)
+            torch.argsort(prob, descending=True)
+
+    def top_k_stag():
+        for vector in word_vectors:
+            word_classifier.top_k(vector, k)
+
+    def full_phrase():
+        for hidden, ids in zip(hidden_list, ids_list):
+            torch.gather(scoring_head.log_prob(hidden, 1), -1, ids)
+
+    def candidate_phrase():
+        for hidden, ids in zip(hidden_list, ids_list):
+            scoring_head.log_prob(hidden, 1, ids)
+
+    return {
+        'stag_full_ms': measure(full_stag, holccg.device, args.num_repeat),
+        'stag_top_k_ms': measure(top_k_stag, holccg.device, args.num_repeat),
+        'phrase_full_ms': measure(full_phrase, holccg.device, args.num_repeat),
+        'phrase_candidate_ms': measure(candidate_phrase, holccg.device, args.num_repeat)}
+
+
+@torch.no_grad()
+def encode_tree_list(holccg: HolCCG, tree_list) -> List[torch.Tensor]:
+    """encode dev sentences into word vectors
+
+    Parameters
+    ----------
+    holccg : HolCCG
+        model used for encoding
+    tree_list : TreeList
+        dev trees
+
+    Returns
+    -------
+    List[torch.Tensor]
+        word vectors of each sentence
+    """
+    word_vectors = []
+    for tree in tree_list.tree_list:
+        word_split = holccg.set_word_split(tree.sentence)
+        vector, _ = holccg.encode([" ".join(tree.sentence)], [word_split])
+        word_vectors.append(vector[0])
+    return word_vectors
+
+
+def main():
+    args = arg_parse()
+
+    dev_tree_list = open_tree_list(args.path_to_tree_list, 'dev')
+    if args.num_sentence is not None:
+        dev_tree_list.tree_list = dev_tree_list.tree_list[:args.num_sentence]
+
+    model_list = [('model', args.path_to_model)]
+    if args.path_to_baseline_model is not None:
+        model_list.append(('baseline', args.path_to_baseline_model))
+    stat = {}
+    for name, path_to_model in model_list:
+        holccg = load_holccg(path_to_model, args.device)
+        stat[name] = benchmark_model(holccg, encode_tree_list(holccg, dev_tree_list), args)
+
+    print('{:<24}'.format('') + ''.join('{:>12}'.format(name) for name in stat))
+    for key in ['stag_full_ms', 'stag_top_k_ms', 'phrase_full_ms', 'phrase_candidate_ms']:
+        print('{:<24}'.format(key) + ''.join('{:>12.3f}'.format(stat[name][key]) for name in stat))
+    for name in stat:
+        print('{} speedup: stag {:.2f}x, phrase {:.2f}x'.format(
+            name,
+            stat[name]['stag_full_ms'] / stat[name]['stag_top_k_ms'],
+            stat[name]['phrase_full_ms'] / stat[name]['phrase_candidate_ms']))
+    if 'baseline' in stat:
+        print('speedup against baseline: stag {:.2f}x, phrase {:.2f}x'.format(
+            stat['baseline']['stag_full_ms'] / stat['model']['stag_top_k_ms'],
+            stat['baseline']['phrase_full_ms'] / stat['model']['phrase_candidate_ms']))
+
+
+if __name__ == "__main__":
+    main()
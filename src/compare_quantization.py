@@ -0,0 +1,136 @@
+import os
+import time
+import argparse
+import torch
+from utils import load
+from holccg import HolCCG, load_holccg
+from span_parser import SpanParser
+from evaluation_functions import evaluate_stag
+from tree_store import open_tree_list
+from typing import List
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path_to_model', type=str, help='path to fp32 model to be compared')
+    parser.add_argument(
+        '--path_to_quantized_model',
+        type=str,
+        default=None,
+        help='path to saved quantized model. The fp32 model is quantized when not given')
+    parser.add_argument('--path_to_dataset', type=str, default='../dataset/', help='path to dataset')
+    parser.add_argument(
+        '--path_to_tree_list', type=str, default='../dataset/tree_list/', help='path to tree list')
+    parser.add_argument('--num_sentence', type=int, default=None, help='number of dev sentences to use')
+    parser.add_argument('--stag_threshold', type=float, default=0.1, help='threshold for supertagging')
+    parser.add_argument('--phrase_threshold', type=float, default=0.01, help='threshold for phrase')
+    parser.add_argument('--span_threshold', type=float, default=0.01, help='threshold for span')
+    parser.add_argument('--min_freq', type=int, default=1, help='minimum frequency of combinatory rule to be used')
+    parser.add_argument('--num_threads', type=int, default=None, help='number of cpu threads')
+    args = parser.parse_args()
+    return args
+
+
+def parse_sentences(parser: SpanParser, sentence_list: List[str]) -> List[str]:
+    """parse sentences and return the best derivation in auto format
+
+    Parameters
+    ----------
+    parser : SpanParser
+        span parser
+    sentence_list : List[str]
+        sentences to be parsed
+
+    Returns
+    -------
+    List[str]
+        derivation of each sentence, or None when parsing is failed
+    """
+    autos = []
+    for sentence in sentence_list:
+        chart = parser.parse(sentence)
+        root_cell = list(chart.values())[-1]
+        if len(root_cell.best_category) == 0:
+            autos.append(None)
+        else:
+            autos.append(parser.decode(root_cell))
+    return autos
+
+
+def evaluate_model(holccg: HolCCG, dev_tree_list, sentence_list: List[str], args) -> dict:
+    """evaluate supertagging accuracy, parsing output and speed of a model on cpu
+
+    Parameters
+    ----------
+    holccg : HolCCG
+        model to be evaluated
+    dev_tree_list : TreeList
+        dev trees
+    sentence_list : List[str]
+        dev sentences
+    args
+        command line arguments
+
+    Returns
+    -------
+    dict
+        evaluation result
+    """
+    stat = {}
+    start = time.perf_counter()
+    dev_tree_list.set_vector(holccg)
+    stat['stag_sentence_per_sec'] = len(dev_tree_list.tree_list) / (time.perf_counter() - start)
+    stat['stag_acc'] = evaluate_stag(dev_tree_list, holccg)
+
+    parser = SpanParser(
+        word_category_vocab=load(os.path.join(args.path_to_dataset, 'grammar/word_category_vocab.pickle')),
+        phrase_category_vocab=load(os.path.join(args.path_to_dataset, 'grammar/phrase_category_vocab.pickle')),
+        head_info=load(os.path.join(args.path_to_dataset, 'grammar/head_info.pickle')),
+        rule_counter=load(os.path.join(args.path_to_dataset, 'grammar/rule_counter.pickle')),
+        holccg=holccg,
+        stag_threshold=args.stag_threshold,
+        phrase_threshold=args.phrase_threshold,
+        span_threshold=args.span_threshold,
+        min_freq=args.min_freq)
+    start = time.perf_counter()
+    stat['autos'] = parse_sentences(parser, sentence_list)
+    stat['parse_sentence_per_sec'] = len(sentence_list) / (time.perf_counter() - start)
+    return stat
+
+
+def main():
+    args = arg_parse()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    device = torch.device('cpu')
+
+    dev_tree_list = open_tree_list(args.path_to_tree_list, 'dev')
+    if args.num_sentence is not None:
+        dev_tree_list.tree_list = dev_tree_list.tree_list[:args.num_sentence]
+    dev_tree_list.device = device
+    sentence_list = [' '.join(tree.sentence) for tree in dev_tree_list.tree_list]
+
+    holccg = load_holccg(args.path_to_model, device)
+    dev_tree_list.set_info_for_training(holccg.tokenizer)
+    fp32_stat = evaluate_model(holccg, dev_tree_list, sentence_list, args)
+
+    if args.path_to_quantized_model is None:
+        holccg = load_holccg(args.path_to_model, device, quantize='int8')
+    else:
+        holccg = load_holccg(args.path_to_quantized_model, device, quantize='int8')
+    int8_stat = evaluate_model(holccg, dev_tree_list, sentence_list, args)
+
+    num_same = 0
+    for fp32_auto, int8_auto in zip(fp32_stat['autos'], int8_stat['autos']):
+        if fp32_auto == int8_auto:
+            num_same += 1
+
+    print('{:<24}{:>12}{:>12}'.format('', 'fp32', 'int8'))
+    for key in ['stag_acc', 'stag_sentence_per_sec', 'parse_sentence_per_sec']:
+        print('{:<24}{:>12.4f}{:>12.4f}'.format(key, fp32_stat[key], int8_stat[key]))
+    print('parse_agreement: {} / {} ({:.4f})'.format(
+        num_same, len(sentence_list), num_same / len(sentence_list)))
+
+
+if __name__ == "__main__":
+    main()
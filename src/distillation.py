@@ -0,0 +1,286 @@
+import os
+import json
+import numpy as np
+import torch
+import torch.nn.functional as F
+from tqdm import tqdm
+from holccg import HolCCG
+from tree import TreeList
+from batch_loader import BatchLoader
+from typing import Dict, List, Tuple
+
+
+class TeacherCache:
+    def __init__(self, path_to_cache: str) -> None:
+        """class for the outputs of teacher HolCCG cached on disk
+
+        The top-k logits of word and phrase classifiers, the logits of span classifier for
+        gold spans and optionally node vectors are stored as numpy memmaps, whose rows are
+        the word or phrase nodes of all trees in the order of tree id and node id.
+
+        Parameters
+        ----------
+        path_to_cache : str
+            directory of the cache made by TeacherCache.build
+        """
+        with open(os.path.join(path_to_cache, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        offset = np.load(os.path.join(path_to_cache, 'offset.npz'))
+        self.word_offset = offset['word_offset']
+        self.phrase_offset = offset['phrase_offset']
+        self.array = {}
+        for name in self.meta['array']:
+            self.array[name] = np.load(os.path.join(path_to_cache, f'{name}.npy'), mmap_mode='r')
+
+    @staticmethod
+    @torch.no_grad()
+    def build(
+            teacher: HolCCG,
+            tree_list: TreeList,
+            path_to_cache: str,
+            top_k: int,
+            batch_size: int,
+            save_vector: bool = False,
+            path_to_teacher: str = None) -> 'TeacherCache':
+        """Compute the outputs of teacher for all trees and store them on disk
+
+        Parameters
+        ----------
+        teacher : HolCCG
+            trained teacher model
+        tree_list : TreeList
+            tree list whose info for training is set by the tokenizer of teacher
+        path_to_cache : str
+            directory to store the cache
+        top_k : int
+            number of top categories whose logits are kept
+        batch_size : int
+            batch size
+        save_vector : bool, optional
+            whether to store the vectors of word and phrase nodes, by default False
+        path_to_teacher : str, optional
+            path to the checkpoint of teacher, which is recorded to validate the cache when it is reused
+
+        Returns
+        -------
+        TeacherCache
+            the cache
+        """
+        os.makedirs(path_to_cache, exist_ok=True)
+        num_word = tree_list.num_word
+        num_phrase = tree_list.num_node - tree_list.num_word
+        word_offset = np.concatenate([[0], np.cumsum(num_word)])
+        phrase_offset = np.concatenate([[0], np.cumsum(num_phrase)])
+        num_word_node = int(word_offset[-1])
+        num_phrase_node = int(phrase_offset[-1])
+        word_top_k = min(top_k, teacher.num_word_cat)
+        phrase_top_k = min(top_k, teacher.num_phrase_cat)
+        shape = {
+            'word_topk_id': (num_word_node, word_top_k),
+            'word_topk_logit': (num_word_node, word_top_k),
+            'phrase_topk_id': (num_phrase_node, phrase_top_k),
+            'phrase_topk_logit': (num_phrase_node, phrase_top_k),
+            'span_logit': (num_phrase_node, 2)}
+        dtype = {
+            'word_topk_id': np.int32,
+            'word_topk_logit': np.float32,
+            'phrase_topk_id': np.int32,
+            'phrase_topk_logit': np.float32,
+            'span_logit': np.float32}
+        if save_vector:
+            shape['word_vector'] = (num_word_node, teacher.model_dim)
+            shape['phrase_vector'] = (num_phrase_node, teacher.model_dim)
+            dtype['word_vector'] = np.float16
+            dtype['phrase_vector'] = np.float16
+        array = {}
+        for name in shape:
+            array[name] = np.lib.format.open_memmap(
+                os.path.join(path_to_cache, f'{name}.npy'), mode='w+', dtype=dtype[name], shape=shape[name])
+
+        teacher.eval()
+        # trees are processed in order, so that the rows are written contiguously
+        batch_loader = BatchLoader(tree_list, batch_size, shuffle=False)
+        with tqdm(total=len(batch_loader), unit="batch") as pbar:
+            pbar.set_description("caching teacher outputs...")
+            for tree_id_list, batch in batch_loader:
+                output = teacher(batch, return_vector=save_vector)
+                word_output, phrase_output, span_output = output[0], output[1], output[2]
+                word_slice = slice(word_offset[tree_id_list[0]], word_offset[tree_id_list[-1] + 1])
+                phrase_slice = slice(phrase_offset[tree_id_list[0]], phrase_offset[tree_id_list[-1] + 1])
+                word_topk = torch.topk(word_output.float(), word_top_k, dim=-1)
+                phrase_topk = torch.topk(phrase_output.float(), phrase_top_k, dim=-1)
+                array['word_topk_id'][word_slice] = word_topk.indices.cpu().numpy()
+                array['word_topk_logit'][word_slice] = word_topk.values.cpu().numpy()
+                array['phrase_topk_id'][phrase_slice] = phrase_topk.indices.cpu().numpy()
+                array['phrase_topk_logit'][phrase_slice] = phrase_topk.values.cpu().numpy()
+                # the first rows of span output are gold spans, which are phrase nodes
+                array['span_logit'][phrase_slice] = span_output[:phrase_output.shape[0]].float().cpu().numpy()
+                if save_vector:
+                    array['word_vector'][word_slice] = output[6].cpu().numpy()
+                    array['phrase_vector'][phrase_slice] = output[7].cpu().numpy()
+                pbar.update(1)
+        for name in array:
+            array[name].flush()
+        np.savez(os.path.join(path_to_cache, 'offset.npz'), word_offset=word_offset, phrase_offset=phrase_offset)
+        meta = {
+            'num_tree': len(tree_list.tree_list),
+            'path_to_teacher': None if path_to_teacher is None else os.path.abspath(path_to_teacher),
+            'top_k': top_k,
+            'save_vector': save_vector,
+            'model_dim': teacher.model_dim,
+            'array': list(array)}
+        with open(os.path.join(path_to_cache, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        return TeacherCache(path_to_cache)
+
+    def validate(
+            self,
+            num_tree: int,
+            path_to_teacher: str,
+            top_k: int,
+            save_vector: bool,
+            model_dim: int) -> None:
+        """Check that the cache was made with the given settings before reusing it
+
+        Parameters
+        ----------
+        num_tree : int
+            number of training trees
+        path_to_teacher : str
+            path to the checkpoint of teacher
+        top_k : int
+            number of top categories whose logits are kept
+        save_vector : bool
+            whether the vectors of word and phrase nodes are needed
+        model_dim : int
+            dimension of student representation, which should match the cached vectors when they are needed
+
+        Raises
+        ------
+        ValueError
+            if the cache does not match the settings
+        """
+        expected = {
+            'num_tree': num_tree,
+            'path_to_teacher': os.path.abspath(path_to_teacher),
+            'top_k': top_k}
+        # a cache with node vectors also serves the training without them
+        if save_vector:
+            expected['save_vector'] = True
+            expected['model_dim'] = model_dim
+        mismatch = [
+            f'{key} (cached: {self.meta.get(key)}, given: {value})'
+            for key, value in expected.items() if self.meta.get(key) != value]
+        if len(mismatch) > 0:
+            raise ValueError(
+                f"teacher cache does not match the settings in {', '.join(mismatch)}, "
+                'remove the cache or give another path to teacher cache')
+
+    def get(self, tree_id_list: List[int], device: torch.device) -> Dict[str, torch.Tensor]:
+        """Gather the teacher outputs of the trees in a batch
+
+        Parameters
+        ----------
+        tree_id_list : List[int]
+            id of trees in the batch
+        device : torch.device
+            device to put the outputs
+
+        Returns
+        -------
+        Dict[str, torch.Tensor]
+            teacher outputs whose rows are in the same order as the outputs of HolCCG for the batch
+        """
+        word_row = np.concatenate(
+            [np.arange(self.word_offset[tree_id], self.word_offset[tree_id + 1]) for tree_id in tree_id_list])
+        phrase_row = np.concatenate(
+            [np.arange(self.phrase_offset[tree_id], self.phrase_offset[tree_id + 1]) for tree_id in tree_id_list])
+        output = {}
+        for name, array in self.array.items():
+            if name.startswith('word'):
+                row = word_row
+            else:
+                row = phrase_row
+            value = torch.from_numpy(array[row])
+            if value.dtype == torch.int32:
+                value = value.long()
+            else:
+                value = value.float()
+            output[name] = value.to(device)
+        return output
+
+
+def soft_cross_entropy(
+        student_logit: torch.Tensor,
+        teacher_logit: torch.Tensor,
+        temperature: float,
+        teacher_id: torch.Tensor = None) -> torch.Tensor:
+    """Compute cross entropy between the softened distributions of teacher and student
+
+    Parameters
+    ----------
+    student_logit : torch.Tensor
+        logits of student for all classes
+    teacher_logit : torch.Tensor
+        logits of teacher for all classes, or for the classes given by teacher_id
+    temperature : float
+        temperature of softmax
+    teacher_id : torch.Tensor, optional
+        top-k classes of teacher, by default None.
+        The teacher distribution is renormalized over these classes
+
+    Returns
+    -------
+    torch.Tensor
+        loss scaled by the square of temperature
+    """
+    student_log_prob = F.log_softmax(student_logit / temperature, dim=-1)
+    if teacher_id is not None:
+        student_log_prob = torch.gather(student_log_prob, -1, teacher_id)
+    teacher_prob = F.softmax(teacher_logit / temperature, dim=-1)
+    return -torch.sum(teacher_prob * student_log_prob, dim=-1).mean() * temperature ** 2
+
+
+def distillation_loss(
+        output: Tuple,
+        teacher_output: Dict[str, torch.Tensor],
+        temperature: float,
+        phrase_loss_weight: float = 1.0,
+        span_loss_weight: float = 1.0,
+        vector_loss_weight: float = 0.0) -> torch.Tensor:
+    """Compute the loss of student against the cached teacher outputs
+
+    Parameters
+    ----------
+    output : Tuple
+        output of student HolCCG computed with return_vector=True
+    teacher_output : Dict[str, torch.Tensor]
+        teacher outputs of the batch
+    temperature : float
+        temperature of softmax
+    phrase_loss_weight : float, optional
+        weight of phrase loss, by default 1.0
+    span_loss_weight : float, optional
+        weight of span loss, by default 1.0
+    vector_loss_weight : float, optional
+        weight of cosine distance between node vectors of teacher and student, by default 0.0
+
+    Returns
+    -------
+    torch.Tensor
+        distillation loss
+    """
+    word_output, phrase_output, span_output = output[0], output[1], output[2]
+    word_loss = soft_cross_entropy(
+        word_output, teacher_output['word_topk_logit'], temperature, teacher_output['word_topk_id'])
+    phrase_loss = soft_cross_entropy(
+        phrase_output, teacher_output['phrase_topk_logit'], temperature, teacher_output['phrase_topk_id'])
+    span_loss = soft_cross_entropy(
+        span_output[:phrase_output.shape[0]], teacher_output['span_logit'], temperature)
+    loss = word_loss + phrase_loss_weight * phrase_loss + span_loss_weight * span_loss
+    if vector_loss_weight > 0.0:
+        word_vector, phrase_vector = output[6], output[7]
+        vector_loss = torch.mean(1 - F.cosine_similarity(word_vector, teacher_output['word_vector'], dim=-1))
+        vector_loss += torch.mean(1 - F.cosine_similarity(phrase_vector, teacher_output['phrase_vector'], dim=-1))
+        loss += vector_loss_weight * vector_loss
+    return loss
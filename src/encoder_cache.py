@@ -0,0 +1,202 @@
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.utils.rnn import pad_sequence
+from typing import Any, Dict, List, Tuple
+
+
+def update_hash(hash: Any, value: Any) -> None:
+    """Update hash by a value of state dict
+
+    Parameters
+    ----------
+    hash : Any
+        hash object of hashlib
+    value : Any
+        tensor, tuple of tensors (e.g. packed parameters of quantized layers) or other value
+    """
+    if isinstance(value, torch.Tensor):
+        value = value.detach().cpu()
+        if value.is_quantized:
+            value = value.int_repr()
+        if value.dtype == torch.bfloat16:
+            value = value.float()
+        hash.update(value.contiguous().numpy().tobytes())
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            update_hash(hash, v)
+    else:
+        hash.update(repr(value).encode())
+
+
+def model_fingerprint(holccg: nn.Module) -> str:
+    """Compute the fingerprint of the weights which determine word vectors
+
+    Parameters
+    ----------
+    holccg : nn.Module
+        HolCCG, or the exported HolCCG whose whole graph is hashed
+
+    Returns
+    -------
+    str
+        hex digest of the weights
+    """
+    if hasattr(holccg, 'graph'):
+        modules = [holccg.graph]
+    else:
+        modules = [holccg.encoder, holccg.linear]
+    hash = hashlib.sha1()
+    for module in modules:
+        state_dict = module.state_dict()
+        for key in sorted(state_dict):
+            hash.update(key.encode())
+            update_hash(hash, state_dict[key])
+    return hash.hexdigest()
+
+
+class EncoderCache:
+    def __init__(self, path_to_cache: str, max_num_pending: int = 10000) -> None:
+        """class for word vectors of sentences cached on disk
+
+        The word vectors computed by HolCCG.encode are stored for each model fingerprint, which
+        consists of the weights of encoder and projection and the options changing the vectors.
+        The vectors of each fingerprint are stored in shards of numpy memmaps, and the index maps
+        each sentence to its shard, first row and number of words. New vectors are kept in memory
+        and written as a new shard by flush.
+
+        Parameters
+        ----------
+        path_to_cache : str
+            directory of the cache
+        max_num_pending : int, optional
+            number of new sentences to be written at once, by default 10000
+        """
+        self.path_to_cache = path_to_cache
+        self.max_num_pending = max_num_pending
+        self.weight_fingerprint = {}
+        self.store = {}
+
+    def fingerprint(self, holccg: nn.Module) -> str:
+        """Compute the fingerprint of the current setting of the model
+
+        Parameters
+        ----------
+        holccg : nn.Module
+            HolCCG or the exported HolCCG
+
+        Returns
+        -------
+        str
+            hex digest of the weights and the options
+        """
+        # the weights are hashed only once for each model
+        if id(holccg) not in self.weight_fingerprint:
+            self.weight_fingerprint[id(holccg)] = model_fingerprint(holccg)
+        option = {
+            'weight': self.weight_fingerprint[id(holccg)],
+            'normalize_type': holccg.normalize_type,
+            'vector_norm': holccg.vector_norm}
+        for name in ['num_encoder_layers', 'early_exit_threshold', 'window_size', 'window_stride', 'quantized']:
+            option[name] = getattr(holccg, name, None)
+        return hashlib.sha1(json.dumps(option, sort_keys=True).encode()).hexdigest()
+
+    def load_store(self, fingerprint: str) -> Dict[str, Any]:
+        """Load the index and shards of a fingerprint
+
+        Parameters
+        ----------
+        fingerprint : str
+            fingerprint of the model
+
+        Returns
+        -------
+        Dict[str, Any]
+            index, memory-mapped shards and pending vectors
+        """
+        if fingerprint not in self.store:
+            path = os.path.join(self.path_to_cache, fingerprint)
+            index = {}
+            shard = []
+            if os.path.exists(os.path.join(path, 'index.json')):
+                with open(os.path.join(path, 'index.json'), 'r') as f:
+                    index = json.load(f)
+                num_shard = 1 + max([shard_id for shard_id, _, _ in index.values()], default=-1)
+                shard = [np.load(os.path.join(path, f'vector_{shard_id}.npy'), mmap_mode='r')
+                         for shard_id in range(num_shard)]
+            self.store[fingerprint] = {'path': path, 'index': index, 'shard': shard, 'pending': {}}
+        return self.store[fingerprint]
+
+    def encode(
+            self,
+            holccg: nn.Module,
+            sentence: List[str],
+            word_split: List[List[Tuple]],
+            input_ids: List[torch.Tensor] = None) -> Tuple:
+        """Encode sentences into word vectors, running the encoder only for sentences not cached
+
+        Parameters
+        ----------
+        holccg : nn.Module
+            HolCCG or the exported HolCCG
+        sentence : List[str]
+            The sentences to encode
+        word_split : List[List[Tuple]]
+            The word split information
+        input_ids : List[torch.Tensor], optional
+            The token ids of each sentence, by default None. The vectors are still looked up by the sentences
+
+        Returns
+        -------
+        Tuple
+            The word vectors and their corresponding lengths, as HolCCG.encode
+        """
+        store = self.load_store(self.fingerprint(holccg))
+        vector_list = [None] * len(sentence)
+        missing = []
+        for idx, s in enumerate(sentence):
+            if s in store['pending']:
+                vector_list[idx] = store['pending'][s]
+            elif s in store['index']:
+                shard_id, offset, length = store['index'][s]
+                vector_list[idx] = torch.from_numpy(np.array(store['shard'][shard_id][offset:offset + length]))
+            else:
+                missing.append(idx)
+        if len(missing) > 0:
+            word_vector, lengths = holccg.encode_without_cache(
+                [sentence[idx] for idx in missing],
+                [word_split[idx] for idx in missing],
+                input_ids=None if input_ids is None else [input_ids[idx] for idx in missing])
+            for idx, vector, length in zip(missing, word_vector, lengths):
+                vector_list[idx] = vector[:length].float().cpu()
+                store['pending'][sentence[idx]] = vector_list[idx]
+            if len(store['pending']) >= self.max_num_pending:
+                self.flush()
+        word_vector = pad_sequence(vector_list, batch_first=True).to(holccg.device)
+        lengths = torch.tensor([len(vector) for vector in vector_list], device=torch.device('cpu'))
+        return word_vector, lengths
+
+    def flush(self) -> None:
+        """Write the pending vectors of all fingerprints as new shards
+        """
+        for store in self.store.values():
+            if len(store['pending']) == 0:
+                continue
+            os.makedirs(store['path'], exist_ok=True)
+            shard_id = len(store['shard'])
+            vector = torch.cat(list(store['pending'].values())).numpy()
+            np.save(os.path.join(store['path'], f'vector_{shard_id}.npy'), vector)
+            offset = 0
+            for s, v in store['pending'].items():
+                store['index'][s] = (shard_id, offset, len(v))
+                offset += len(v)
+            # the index is replaced at once, so that an interrupted write does not break the cache
+            path_to_index = os.path.join(store['path'], 'index.json')
+            with open(path_to_index + '.tmp', 'w') as f:
+                json.dump(store['index'], f)
+            os.replace(path_to_index + '.tmp', path_to_index)
+            store['shard'].append(np.load(os.path.join(store['path'], f'vector_{shard_id}.npy'), mmap_mode='r'))
+            store['pending'] = {}
@@ -0,0 +1,115 @@
+import time
+import argparse
+import torch
+from holccg import HolCCG, load_holccg
+from tree_store import open_tree_list
+from typing import List
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path_to_model', type=str, help='path to model to be evaluated')
+    parser.add_argument(
+        '--path_to_tree_list', type=str, default='../dataset/tree_list/', help='path to tree list')
+    parser.add_argument(
+        '--num_encoder_layers',
+        type=int,
+        nargs='*',
+        default=None,
+        help='numbers of encoder layers to be evaluated, by default all numbers of layers')
+    parser.add_argument(
+        '--early_exit_threshold',
+        type=float,
+        nargs='*',
+        default=[],
+        help='thresholds of early exit to be evaluated with all layers')
+    parser.add_argument('--batch_size', type=int, default=16, help='number of sentences encoded at once')
+    parser.add_argument('--num_sentence', type=int, default=None, help='number of dev sentences to use')
+    parser.add_argument(
+        '--device',
+        type=torch.device,
+        default=torch.device('cuda:0'),
+        help='device to use for evaluation')
+    args = parser.parse_args()
+    return args
+
+
+@torch.no_grad()
+def evaluate_setting(holccg: HolCCG, tree_list, batch_size: int) -> dict:
+    """evaluate supertagging accuracy and speed of encoding with current setting of encoder layers
+
+    Parameters
+    ----------
+    holccg : HolCCG
+        model to be evaluated
+    tree_list : TreeList
+        trees whose word split is set
+    batch_size : int
+        number of sentences encoded at once
+
+    Returns
+    -------
+    dict
+        supertagging accuracy, sentences per second and mean number of used layers
+    """
+    word_category_vocab = tree_list.word_category_vocab
+    num_word = 0
+    num_correct_word = 0
+    num_layer = 0
+    elapsed_time = 0.0
+    for idx in range(0, len(tree_list.tree_list), batch_size):
+        batch_tree_list = tree_list.tree_list[idx:idx + batch_size]
+        sentence = [" ".join(tree.sentence) for tree in batch_tree_list]
+        word_split = [tree.word_split for tree in batch_tree_list]
+        if holccg.device.type == 'cuda':
+            torch.cuda.synchronize(holccg.device)
+        start = time.perf_counter()
+        word_vector, lengths = holccg.encode(sentence, word_split)
+        predict_idx_list = holccg.word_classifier.top_k(word_vector, 1)[1][..., 0].tolist()
+        elapsed_time += time.perf_counter() - start
+        num_layer += holccg.exit_layer * len(batch_tree_list)
+        for tree, predict_idx in zip(batch_tree_list, predict_idx_list):
+            for node_id, original_position in tree.original_position:
+                num_word += 1
+                if predict_idx[original_position] != 0:
+                    predict_cat = word_category_vocab.get_itos()[predict_idx[original_position]]
+                    if predict_cat.split('-->')[0] == tree.node_list[node_id].prime_category:
+                        num_correct_word += 1
+    return {
+        'stag_acc': num_correct_word / num_word,
+        'sentence_per_sec': len(tree_list.tree_list) / elapsed_time,
+        'mean_layer': num_layer / len(tree_list.tree_list)}
+
+
+def main():
+    args = arg_parse()
+
+    holccg = load_holccg(args.path_to_model, args.device)
+    dev_tree_list = open_tree_list(args.path_to_tree_list, 'dev')
+    if args.num_sentence is not None:
+        dev_tree_list.tree_list = dev_tree_list.tree_list[:args.num_sentence]
+    dev_tree_list.device = args.device
+    for tree in dev_tree_list.tree_list:
+        tree.set_word_split(holccg.tokenizer)
+
+    num_layer = len(holccg.encoder.encoder.layer)
+    if args.num_encoder_layers is None:
+        args.num_encoder_layers = list(range(1, num_layer + 1))
+    settings: List[tuple] = [(k, None) for k in args.num_encoder_layers]
+    settings += [(num_layer, threshold) for threshold in args.early_exit_threshold]
+
+    print('{:<10}{:>10}{:>12}{:>12}{:>18}'.format('layers', 'threshold', 'mean_layer', 'stag_acc', 'sentence_per_sec'))
+    for num_encoder_layers, early_exit_threshold in settings:
+        holccg.num_encoder_layers = num_encoder_layers
+        holccg.early_exit_threshold = early_exit_threshold
+        stat = evaluate_setting(holccg, dev_tree_list, args.batch_size)
+        print('{:<10}{:>10}{:>12.2f}{:>12.4f}{:>18.2f}'.format(
+            num_encoder_layers,
+            '-' if early_exit_threshold is None else early_exit_threshold,
+            stat['mean_layer'],
+            stat['stag_acc'],
+            stat['sentence_per_sec']))
+
+
+if __name__ == "__main__":
+    main()
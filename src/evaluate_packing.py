@@ -0,0 +1,97 @@
+import time
+import argparse
+import torch
+from holccg import HolCCG, load_holccg, padding_efficiency
+from tree_store import open_tree_list
+from typing import List
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path_to_model', type=str, help='path to model to be evaluated')
+    parser.add_argument(
+        '--path_to_tree_list', type=str, default='../dataset/tree_list/', help='path to tree list')
+    parser.add_argument('--pack_size', type=int, default=512, help='number of tokens in each packed sequence')
+    parser.add_argument('--batch_size', type=int, default=64, help='number of sentences encoded at once')
+    parser.add_argument('--num_sentence', type=int, default=None, help='number of dev sentences to use')
+    parser.add_argument(
+        '--device',
+        type=torch.device,
+        default=torch.device('cuda:0'),
+        help='device to use for evaluation')
+    args = parser.parse_args()
+    return args
+
+
+@torch.no_grad()
+def encode_batch_list(holccg: HolCCG, batch_list: List[list]) -> tuple:
+    """encode sentences of each batch with current setting of packing
+
+    Parameters
+    ----------
+    holccg : HolCCG
+        model used for encoding
+    batch_list : List[list]
+        list of trees in each batch, whose word split is set
+
+    Returns
+    -------
+    tuple
+        word vectors of each sentence and elapsed time in seconds
+    """
+    word_vector_list = []
+    elapsed_time = 0.0
+    for batch_tree_list in batch_list:
+        sentence = [" ".join(tree.sentence) for tree in batch_tree_list]
+        word_split = [tree.word_split for tree in batch_tree_list]
+        if holccg.device.type == 'cuda':
+            torch.cuda.synchronize(holccg.device)
+        start = time.perf_counter()
+        word_vector, lengths = holccg.encode(sentence, word_split)
+        if holccg.device.type == 'cuda':
+            torch.cuda.synchronize(holccg.device)
+        elapsed_time += time.perf_counter() - start
+        word_vector_list += [vector[:length] for vector, length in zip(word_vector, lengths)]
+    return word_vector_list, elapsed_time
+
+
+def main():
+    args = arg_parse()
+
+    holccg = load_holccg(args.path_to_model, args.device)
+    dev_tree_list = open_tree_list(args.path_to_tree_list, 'dev')
+    if args.num_sentence is not None:
+        dev_tree_list.tree_list = dev_tree_list.tree_list[:args.num_sentence]
+    for tree in dev_tree_list.tree_list:
+        tree.set_word_split(holccg.tokenizer)
+    batch_list = [dev_tree_list.tree_list[idx:idx + args.batch_size]
+                  for idx in range(0, len(dev_tree_list.tree_list), args.batch_size)]
+
+    # padding efficiency weighted by the number of tokens in each batch
+    num_token = 0
+    num_padded_slot = 0.0
+    num_packed_slot = 0.0
+    for batch_tree_list in batch_list:
+        lengths = [len(ids) for ids in holccg.tokenizer(
+            [" ".join(tree.sentence) for tree in batch_tree_list])['input_ids']]
+        num_token += sum(lengths)
+        num_padded_slot += sum(lengths) / padding_efficiency(lengths)
+        num_packed_slot += sum(lengths) / padding_efficiency(lengths, args.pack_size)
+
+    holccg.pack_size = None
+    padded_vector_list, padded_time = encode_batch_list(holccg, batch_list)
+    holccg.pack_size = args.pack_size
+    packed_vector_list, packed_time = encode_batch_list(holccg, batch_list)
+    max_diff = max([torch.max(torch.abs(padded - packed)).item()
+                    for padded, packed in zip(padded_vector_list, packed_vector_list)])
+
+    print('{:<24}{:>12}{:>12}'.format('', 'padded', 'packed'))
+    print('{:<24}{:>12.4f}{:>12.4f}'.format(
+        'padding_efficiency', num_token / num_padded_slot, num_token / num_packed_slot))
+    print('{:<24}{:>12.2f}{:>12.2f}'.format(
+        'sentence_per_sec', len(padded_vector_list) / padded_time, len(packed_vector_list) / packed_time))
+    print(f'max abs difference of word vectors: {max_diff:.3e}')
+
+
+if __name__ == "__main__":
+    main()
@@ -107,16 +107,18 @@ def evaluate_stag(tree_list: List[Tree], holccg: HolCCG) -> float:
     with tqdm(total=len(tree_list.tree_list)) as pbar:
         pbar.set_description("evaluating supertag...")
         for tree in tree_list.tree_list:
-            for node in tree.node_list:
-                if node.is_leaf:
-                    predict_prob = torch.softmax(word_classifier(node.vector), dim=-1)
-                    predict_idx = torch.argmax(predict_prob, dim=-1)
-                    num_word += 1
-                    if predict_idx != 0:
-                        predict_cat = word_category_vocab.get_itos()[predict_idx]
-                        predict_prime_cat = predict_cat.split('-->')[0]
-                        if predict_prime_cat == node.prime_category:
-                            num_correct_word += 1
+            leaf_node_list = [node for node in tree.node_list if node.is_leaf]
+            # classify all leaf nodes of the tree at once
+            _, predict_idx_list = word_classifier.top_k(
+                tree_list.node_vector[[node.vector_id for node in leaf_node_list]], 1)
+            predict_idx_list = predict_idx_list[:, 0]
+            for node, predict_idx in zip(leaf_node_list, predict_idx_list):
+                num_word += 1
+                if predict_idx != 0:
+                    predict_cat = word_category_vocab.get_itos()[predict_idx]
+                    predict_prime_cat = predict_cat.split('-->')[0]
+                    if predict_prime_cat == node.prime_category:
+                        num_correct_word += 1
             pbar.update(1)
     print(f'supertagging_acc: {num_correct_word / num_word}')
     return num_correct_word / num_word
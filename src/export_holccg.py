@@ -0,0 +1,32 @@
+import argparse
+import torch
+from holccg import load_holccg, export_holccg
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path_to_model', type=str, help='path to model to be exported')
+    parser.add_argument('--path_to_export', type=str, help='directory to save the exported model')
+    parser.add_argument(
+        '--quantize',
+        type=str,
+        default='none',
+        choices=['none', 'int8'],
+        help='apply dynamic quantization to linear layers before export (int8 is available only on cpu)')
+    parser.add_argument(
+        '--device',
+        type=torch.device,
+        default=torch.device('cpu'),
+        help='device to use for export')
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = arg_parse()
+    holccg = load_holccg(args.path_to_model, args.device, args.quantize)
+    export_holccg(holccg, args.path_to_export)
+
+
+if __name__ == "__main__":
+    main()
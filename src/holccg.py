@@ -1,11 +1,18 @@
-from torch.nn.functional import normalize
+import os
+import copy
+import json
+import mmap
 from torch.nn.init import kaiming_uniform_
 import numpy as np
 from torch.nn.utils.rnn import pad_sequence
 import torch
 import torch.nn as nn
-from utils import circular_correlation, circular_convolution, shuffled_circular_convolution, complex_normalize
-from typing import List, Tuple
+from transformers import AutoConfig, AutoModel, AutoTokenizer
+from accelerate import init_empty_weights
+from safetensors.torch import save_file
+from utils import compose_pair, compose_pair_backward, complex_normalize, scale_to_norm
+from utils import spectral_compose_pair, to_spectrum, from_spectrum
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 
 class HolCCG(nn.Module):
@@ -20,7 +27,17 @@ class HolCCG(nn.Module):
             normalize_type: str,
             vector_norm: int,
             composition: str,
-            device: torch.device) -> None:
+            device: torch.device,
+            memory_efficient_composition: bool = False,
+            spectral: bool = False,
+            num_encoder_layers: int = None,
+            early_exit_threshold: float = None,
+            encoder_dim: int = None,
+            word_category_frequency: List[int] = None,
+            phrase_category_frequency: List[int] = None,
+            window_size: int = None,
+            window_stride: int = None,
+            pack_size: int = None) -> None:
         """class for HolCCG
 
         Parameters
@@ -45,6 +62,34 @@ class HolCCG(nn.Module):
             The type of composition.
         device : torch.device
             The device to use for HolCCG
+        memory_efficient_composition : bool, optional
+            Whether to recompute composed vectors in backward pass instead of keeping
+            the intermediate state of every composition step, by default False
+        spectral : bool, optional
+            Whether to compose node vectors in Fourier domain, by default False.
+            It cannot be used with 's_conv' composition or memory_efficient_composition
+        num_encoder_layers : int, optional
+            The number of encoder layers to use from the bottom, by default None, which uses all layers
+        early_exit_threshold : float, optional
+            The confidence of word classifier to stop encoding at intermediate layers, by default None.
+            Encoding stops when the top probability of all words in the batch exceeds the threshold
+        encoder_dim : int, optional
+            The dimension of encoder's hidden state, by default None, which is the same as model_dim
+        word_category_frequency : List[int], optional
+            The frequency of each word category in training data, by default None.
+            When given, the word classifier has adaptive output layer and outputs log probability
+        phrase_category_frequency : List[int], optional
+            The frequency of each phrase category in training data, by default None.
+            When given, the phrase classifier has adaptive output layer and outputs log probability
+        window_size : int, optional
+            The number of tokens in each window, including special tokens, by default None.
+            Sentences longer than the window are encoded by overlapping windows
+        window_stride : int, optional
+            The number of subwords between the starts of adjacent windows,
+            by default None, which is the half of the window
+        pack_size : int, optional
+            The number of tokens in each encoder sequence into which several sentences are packed,
+            by default None, which encodes each sentence as its own padded sequence
         """
         super(HolCCG, self).__init__()
         self.num_word_cat = num_word_cat
@@ -58,25 +103,45 @@ class HolCCG(nn.Module):
         elif self.normalize_type == 'complex':
             self.vector_norm = None
         self.composition = composition
+        self.memory_efficient_composition = memory_efficient_composition
+        if spectral and self.composition == 's_conv':
+            raise ValueError("'s_conv' composition cannot be computed in Fourier domain")
+        if spectral and memory_efficient_composition:
+            # the recomputation in backward pass composes node vectors in real domain
+            raise ValueError('memory efficient composition cannot be computed in Fourier domain')
+        self.spectral = spectral
+        self.num_encoder_layers = num_encoder_layers
+        self.early_exit_threshold = early_exit_threshold
+        self.window_size = window_size
+        self.window_stride = window_stride
+        self.pack_size = pack_size
+        # the cache of word vectors for inference, which is set by the caller
+        self.encoder_cache = None
+        self.word_category_frequency = word_category_frequency
+        self.phrase_category_frequency = phrase_category_frequency
         if self.composition == 's_conv':
             self.P = torch.tensor(np.random.permutation(self.model_dim), device=device)
         # the list which to record the modules to set separated learning rate
         self.base_modules = []
         self.base_params = []
 
-        self.linear = nn.Linear(self.model_dim, self.model_dim)
+        if encoder_dim is None:
+            encoder_dim = self.model_dim
+        self.linear = nn.Linear(encoder_dim, self.model_dim)
         kaiming_uniform_(self.linear.weight)
         self.base_modules.append(self.linear)
         self.word_classifier = SyntacticClassifier(
             self.model_dim,
             self.model_dim,
             self.num_word_cat,
-            dropout=dropout)
+            dropout=dropout,
+            class_frequency=word_category_frequency)
         self.phrase_classifier = SyntacticClassifier(
             self.model_dim,
             self.model_dim,
             self.num_phrase_cat,
-            dropout=dropout)
+            dropout=dropout,
+            class_frequency=phrase_category_frequency)
         self.span_classifier = SyntacticClassifier(self.model_dim, self.model_dim, 2, dropout=dropout)
         self.base_modules.append(self.word_classifier)
         self.base_modules.append(self.phrase_classifier)
@@ -86,20 +151,24 @@ class HolCCG(nn.Module):
                 self.base_params.append(params)
         self.base_params = iter(self.base_params)
         self.device = device
+        self.quantized = False
 
     # input batch as tuple of training info
-    def forward(self, batch: Tuple) -> Tuple:
+    def forward(self, batch: Tuple, return_vector: bool = False) -> Tuple:
         """forward function
 
         Parameters
         ----------
         batch : Tuple
             The batch of training data
+        return_vector : bool, optional
+            Whether to return the vectors of word and phrase nodes as well, by default False
 
         Returns
         -------
         Tuple
             The output of HolCCG. Classification results of word, phrase and span and their corresponding labels.
+            The vectors of word and phrase nodes follow when return_vector is True.
         """
 
         num_node = batch[0]
@@ -112,8 +181,9 @@ class HolCCG(nn.Module):
         random_composition_info = batch[7]
         random_original_position = batch[8]
         random_negative_node_id = batch[9]
+        input_ids = batch[10]
 
-        vector_list, lengths = self.encode(sentence, word_split)
+        vector_list, lengths = self.encode(sentence, word_split, input_ids=input_ids)
 
         # compose word vectors and fed them into FFNN
         original_vector = self.set_leaf_node_vector(
@@ -133,25 +203,234 @@ class HolCCG(nn.Module):
         composed_vector = self.compose(original_vector, composition_info)
         random_composed_vector = self.compose(random_vector, random_composition_info)
         word_vector, phrase_vector, word_label, phrase_label = self.devide_word_phrase(
-            composed_vector, batch_label, original_position)
+            composed_vector, batch_label)
         span_vector, span_label = self.extract_span_vector(
             phrase_vector, random_composed_vector, random_negative_node_id)
 
         word_output = self.word_classifier(word_vector)
         phrase_output = self.phrase_classifier(phrase_vector)
         span_output = self.span_classifier(span_vector)
+        if return_vector:
+            return (word_output, phrase_output, span_output, word_label, phrase_label, span_label,
+                    word_vector, phrase_vector)
         return word_output, phrase_output, span_output, word_label, phrase_label, span_label
 
     # encoding word vector
-    def encode(self, sentence: List[str], word_split: List[List[Tuple]]) -> Tuple:
+    def encode(
+            self,
+            sentence: List[str],
+            word_split: List[List[Tuple]],
+            input_ids: List[torch.Tensor] = None) -> Tuple:
         """Encoding sentence into word vectors
 
+        In evaluation mode, the vectors are taken from encoder_cache when it is set.
+
+        Parameters
+        ----------
+        sentence : List[str]
+            The sentence to encode
+        word_split : List[List[Tuple]]
+            The word split information
+        input_ids : List[torch.Tensor], optional
+            The token ids of each sentence including special tokens, by default None,
+            which tokenizes the sentence. They are padded by pad_input_ids
+
+        Returns
+        -------
+        Tuple
+            The word vectors and their corresponding lengths
+        """
+        if self.encoder_cache is not None and not self.training:
+            return self.encoder_cache.encode(self, sentence, word_split, input_ids=input_ids)
+        return self.encode_without_cache(sentence, word_split, input_ids=input_ids)
+
+    def encode_without_cache(
+            self,
+            sentence: List[str],
+            word_split: List[List[Tuple]],
+            input_ids: List[torch.Tensor] = None) -> Tuple:
+        """Encoding sentence into word vectors by running the encoder
+
         Parameters
         ----------
         sentence : List[str]
             The sentence to encode
         word_split : List[List[Tuple]]
             The word split information
+        input_ids : List[torch.Tensor], optional
+            The token ids of each sentence including special tokens, by default None, which tokenizes the sentence
+
+        Returns
+        -------
+        Tuple
+            The word vectors and their corresponding lengths
+        """
+        if input_ids is None:
+            input_ids = self.tokenize(sentence)
+        if exceed_window(self.tokenizer, word_split, self.window_size):
+            # early exit is not applied to the sentences encoded by windows
+            hidden = encode_by_window(
+                self.run_encoder,
+                self.tokenizer,
+                [ids.tolist() for ids in input_ids],
+                self.window_size,
+                self.window_stride,
+                self.device)
+            return self.pool_word_vector(hidden, word_split)
+        if self.pack_size is not None and len(input_ids) > 1:
+            # early exit is not applied to packed sentences either
+            return self.pool_word_vector(self.encode_by_packing([ids.tolist() for ids in input_ids]), word_split)
+        input = {
+            key: value.to(self.device)
+            for key, value in pad_input_ids(input_ids, self.tokenizer.pad_token_id).items()}
+        if self.num_encoder_layers is None and self.early_exit_threshold is None:
+            hidden = self.encoder(**input).last_hidden_state
+            return self.pool_word_vector(hidden, word_split)
+        return self.encode_by_layer(input, word_split)
+
+    def tokenize(self, sentence: List[str]) -> List[torch.Tensor]:
+        """Tokenize the sentence for encoder
+
+        Parameters
+        ----------
+        sentence : List[str]
+            The sentence to tokenize
+
+        Returns
+        -------
+        List[torch.Tensor]
+            The token ids of each sentence including special tokens
+        """
+        return [torch.tensor(ids, dtype=torch.long) for ids in self.tokenizer(sentence)['input_ids']]
+
+    def encode_by_layer(self, input: dict, word_split: List[List[Tuple]]) -> Tuple:
+        """Encode the sentence by running encoder layers one by one
+
+        Only the first num_encoder_layers layers are used. When early_exit_threshold is set,
+        encoding stops at the first layer where the word classifier is confident for all words.
+        The number of used layers is recorded as exit_layer.
+
+        Parameters
+        ----------
+        input : dict
+            The input of encoder
+        word_split : List[List[Tuple]]
+            The word split information
+
+        Returns
+        -------
+        Tuple
+            The word vectors and their corresponding lengths
+        """
+
+        num_layer = len(self.encoder.encoder.layer)
+        if self.num_encoder_layers is not None:
+            num_layer = min(num_layer, self.num_encoder_layers)
+        for idx, hidden in enumerate(self.iterate_layers(input)):
+            self.exit_layer = idx + 1
+            if self.early_exit_threshold is not None and idx < num_layer - 1:
+                word_vector, lengths = self.pool_word_vector(hidden, word_split)
+                word_prob = torch.softmax(self.word_classifier(word_vector), dim=-1)
+                confidence = torch.max(word_prob, dim=-1).values
+                is_word = torch.arange(confidence.shape[1]) < lengths.unsqueeze(-1)
+                if torch.all(confidence[is_word.to(confidence.device)] > self.early_exit_threshold):
+                    return word_vector, lengths
+        return self.pool_word_vector(hidden, word_split)
+
+    def iterate_layers(self, input: dict) -> Iterator[torch.Tensor]:
+        """Run the first num_encoder_layers encoder layers one by one
+
+        Parameters
+        ----------
+        input : dict
+            The input of encoder
+
+        Yields
+        ------
+        torch.Tensor
+            The hidden states after each layer
+        """
+        hidden = self.encoder.embeddings(
+            input_ids=input['input_ids'],
+            token_type_ids=input.get('token_type_ids'),
+            position_ids=input.get('position_ids'))
+        attention_mask = input['attention_mask']
+        # packed sentences have the mask for each query, otherwise it is broadcast over queries
+        if attention_mask.dim() == 2:
+            attention_mask = attention_mask[:, None, :]
+        # additive attention mask broadcast over heads
+        attention_mask = attention_mask[:, None].to(hidden.dtype)
+        attention_mask = (1.0 - attention_mask) * torch.finfo(hidden.dtype).min
+        layers = self.encoder.encoder.layer
+        if self.num_encoder_layers is not None:
+            layers = layers[:self.num_encoder_layers]
+        for layer in layers:
+            output = layer(hidden, attention_mask=attention_mask)
+            # older transformers return the tuple of outputs
+            if isinstance(output, tuple):
+                output = output[0]
+            hidden = output
+            yield hidden
+
+    def encode_by_packing(self, input_ids: List[List[int]]) -> torch.Tensor:
+        """Encode sentences packed into sequences of pack_size tokens
+
+        The sentences in a sequence attend only to themselves and their position ids start from
+        the beginning of each sentence, so that they are encoded in the same way as unpacked ones.
+
+        Parameters
+        ----------
+        input_ids : List[List[int]]
+            The token ids of each sentence including special tokens
+
+        Returns
+        -------
+        torch.Tensor
+            The hidden states of each sentence including special tokens, of shape
+            (batch_size, max_num_token, hidden_dim) as the sentences are encoded without packing
+        """
+        # roberta counts positions from the next of padding index
+        position_offset = getattr(self.encoder.embeddings, 'padding_idx', -1) + 1
+        input, unpack_index = make_packed_input(self.tokenizer, input_ids, self.pack_size, position_offset)
+        input = {key: value.to(self.device) for key, value in input.items()}
+        for packed_hidden in self.iterate_layers(input):
+            pass
+        sentence_idx, token_idx, pack_idx, pack_position = [index.to(self.device) for index in unpack_index]
+        hidden = torch.zeros(
+            (len(input_ids), int(token_idx.max()) + 1, packed_hidden.shape[-1]),
+            dtype=packed_hidden.dtype,
+            device=self.device)
+        hidden[sentence_idx, token_idx] = packed_hidden[pack_idx, pack_position]
+        return hidden
+
+    def run_encoder(self, input: dict) -> torch.Tensor:
+        """Compute the last hidden state of the encoder layers in use
+
+        Parameters
+        ----------
+        input : dict
+            The input of encoder
+
+        Returns
+        -------
+        torch.Tensor
+            The last hidden state including special tokens
+        """
+        if self.num_encoder_layers is None:
+            return self.encoder(**input).last_hidden_state
+        for hidden in self.iterate_layers(input):
+            pass
+        return hidden
+
+    def pool_word_vector(self, hidden: torch.Tensor, word_split: List[List[Tuple]]) -> Tuple:
+        """Compute word vectors from the hidden states of subwords
+
+        Parameters
+        ----------
+        hidden : torch.Tensor
+            The hidden states of encoder including special tokens
+        word_split : List[List[Tuple]]
+            The word split information
 
         Returns
         -------
@@ -159,11 +438,7 @@ class HolCCG(nn.Module):
             The word vectors and their corresponding lengths
         """
 
-        input = self.tokenizer(
-            sentence,
-            padding=True,
-            return_tensors='pt').to(self.device)
-        word_vector = self.encoder(**input).last_hidden_state[:, 1:-1]
+        word_vector = hidden[:, 1:-1]
         word_vector_list = []
         lengths = []
         for vector, info in zip(word_vector, word_split):
@@ -175,7 +450,7 @@ class HolCCG(nn.Module):
         word_vector = pad_sequence(word_vector_list, batch_first=True)
         word_vector = self.linear(word_vector)
         if self.normalize_type == 'real':
-            word_vector = self.vector_norm * normalize(word_vector, dim=-1)
+            word_vector = scale_to_norm(word_vector, self.vector_norm)
         elif self.normalize_type == 'complex':
             word_vector = complex_normalize(word_vector)
         lengths = torch.tensor(lengths, device=torch.device('cpu'))
@@ -235,6 +510,30 @@ class HolCCG(nn.Module):
             The composed vector
         """
 
+        schedule = self.make_composition_schedule(composition_info)
+        if self.memory_efficient_composition and torch.is_grad_enabled() and vector.requires_grad:
+            return TreeComposition.apply(vector, self, schedule)
+        if self.spectral:
+            # keep node vectors in Fourier domain during composition and transform back once
+            return from_spectrum(self.compose_by_schedule(to_spectrum(vector), schedule), self.model_dim)
+        return self.compose_by_schedule(vector, schedule)
+
+    def make_composition_schedule(self, composition_info: torch.Tensor) -> List[Tuple]:
+        """Make the index of nodes composed at each step of composition
+
+        Parameters
+        ----------
+        composition_info : torch.Tensor
+            The composition information of shape (batch, max_num_composition, 4)
+
+        Returns
+        -------
+        List[Tuple]
+            The index of one child composition (batch, parent, child) and that of
+            two child composition (batch, parent, left child, right child) at each step
+        """
+
+        schedule = []
         # itteration of composition
         for idx in range(composition_info.shape[1]):
             # the positional index where the composition info of one child is located in batch
@@ -244,8 +543,6 @@ class HolCCG(nn.Module):
             one_child_parent_idx = one_child_composition_info[:, 1]
             # the child node index of one child composition
             child_idx = one_child_composition_info[:, 2]
-            child_vector = vector[(one_child_compositino_idx, child_idx)]
-            vector[(one_child_compositino_idx, one_child_parent_idx)] = child_vector
             two_child_composition_idx = torch.squeeze(
                 torch.nonzero(composition_info[:, idx, 0] == 2))
             two_child_composition_info = composition_info[composition_info[:, idx, 0] == 2][:, idx]
@@ -254,68 +551,84 @@ class HolCCG(nn.Module):
                 # left child node index of two child composition
                 left_child_idx = two_child_composition_info[:, 2]
                 right_child_idx = two_child_composition_info[:, 3]
-                left_child_vector = vector[(two_child_composition_idx, left_child_idx)]
-                right_child_vector = vector[(two_child_composition_idx, right_child_idx)]
-                if self.composition == 'corr':
-                    composed_vector = circular_correlation(
-                        left_child_vector, right_child_vector, self.vector_norm)
-                elif self.composition == 'conv':
-                    composed_vector = circular_convolution(
-                        left_child_vector, right_child_vector, self.vector_norm)
-                elif self.composition == 's_conv':
-                    composed_vector = shuffled_circular_convolution(
-                        left_child_vector, right_child_vector, self.P, self.vector_norm)
-                vector[(two_child_composition_idx, two_child_parent_idx)] = composed_vector
+                two_child = (two_child_composition_idx, two_child_parent_idx, left_child_idx, right_child_idx)
+            else:
+                two_child = None
+            schedule.append(((one_child_compositino_idx, one_child_parent_idx, child_idx), two_child))
+        return schedule
+
+    def compose_by_schedule(self, vector: torch.Tensor, schedule: List[Tuple]) -> torch.Tensor:
+        """Compose word vectors in place following the composition schedule
+
+        Parameters
+        ----------
+        vector : torch.Tensor
+            The word vectors, or their spectra when composing in Fourier domain
+        schedule : List[Tuple]
+            The composition schedule made by make_composition_schedule
+
+        Returns
+        -------
+        torch.Tensor
+            The composed vector
+        """
+
+        for one_child, two_child in schedule:
+            batch_idx, parent_idx, child_idx = one_child
+            vector[(batch_idx, parent_idx)] = vector[(batch_idx, child_idx)]
+            if two_child is not None:
+                batch_idx, parent_idx, left_child_idx, right_child_idx = two_child
+                left_child_vector = vector[(batch_idx, left_child_idx)]
+                right_child_vector = vector[(batch_idx, right_child_idx)]
+                vector[(batch_idx, parent_idx)] = self.compose_pair(left_child_vector, right_child_vector)
         return vector
 
-    def devide_word_phrase(self, vector: torch.Tensor, batch_label: list, original_position: list) -> Tuple:
+    def compose_pair(self, left: torch.Tensor, right: torch.Tensor) -> torch.Tensor:
+        """Compose the vectors of left and right child with the composition of this model
+
+        Parameters
+        ----------
+        left : torch.Tensor
+            The vectors of left child, or their spectra, of any batch shape
+        right : torch.Tensor
+            The vectors of right child, or their spectra, of any batch shape
+
+        Returns
+        -------
+        torch.Tensor
+            The composed vector, which is a spectrum when the children are spectra
+        """
+
+        if left.is_complex():
+            return spectral_compose_pair(left, right, self.composition, self.vector_norm, self.model_dim)
+        return compose_pair(left, right, self.composition, getattr(self, 'P', None), self.vector_norm)
+
+    def devide_word_phrase(self, vector: torch.Tensor, batch_label: Tuple) -> Tuple:
         """Devide the word vector and phrase vector
 
         Parameters
         ----------
         vector : torch.Tensor
             The vectors of all nodes
-        batch_label : list
-            The labels of all nodes
-        original_position : list
-            The original position of all nodes in the sentence
+        batch_label : Tuple
+            The flat index of word and phrase nodes in the batch and their labels
 
         Returns
         -------
         Tuple
             The word vector, phrase vector, word label and phrase label"""
 
-        word_vector = []
-        phrase_vector = []
-        word_label = []
-        phrase_label = []
-        for i in range(vector.shape[0]):
-            word_idx = torch.zeros(len(batch_label[i]), dtype=torch.bool, device=self.device)
-            word_idx[original_position[i][:, 0]] = True
-            phrase_idx = torch.logical_not(word_idx)
-            word_vector.append(vector[i, :len(batch_label[i])][word_idx])
-            phrase_vector.append(vector[i, :len(batch_label[i])][phrase_idx])
-            word_label.append(
-                torch.tensor(
-                    batch_label[i],
-                    dtype=torch.long,
-                    device=self.device)[word_idx])
-            phrase_label.append(
-                torch.tensor(
-                    batch_label[i],
-                    dtype=torch.long,
-                    device=self.device)[phrase_idx])
-        word_vector = torch.cat(word_vector)
-        phrase_vector = torch.cat(phrase_vector)
-        word_label = torch.squeeze(torch.vstack(word_label))
-        phrase_label = torch.squeeze(torch.vstack(phrase_label))
+        word_idx, phrase_idx, word_label, phrase_label = batch_label
+        vector = vector.reshape(-1, self.model_dim)
+        word_vector = torch.index_select(vector, 0, word_idx)
+        phrase_vector = torch.index_select(vector, 0, phrase_idx)
         return word_vector, phrase_vector, word_label, phrase_label
 
     def extract_span_vector(
             self,
             phrase_vector: torch.Tensor,
             random_composed_vector: torch.Tensor,
-            random_negative_node_id: List[int]) -> Tuple:
+            random_negative_node_id: torch.Tensor) -> Tuple:
         """Extract the span vector from phrase vector and random composed vector
 
         Parameters
@@ -324,8 +637,8 @@ class HolCCG(nn.Module):
             vector of gold phrases
         random_composed_vector : torch.Tensor
             vector of random composed phrases
-        random_negative_node_id : List[int]
-            the node id of random negative phrases
+        random_negative_node_id : torch.Tensor
+            the flat index of random negative phrases in the batch
 
         Returns
         -------
@@ -336,17 +649,8 @@ class HolCCG(nn.Module):
         # the label for gold spans
         positive_label = torch.ones(phrase_vector.shape[0], dtype=torch.long, device=self.device)
 
-        # the list to contain vectors for negative spans
-        negative_span_vector = []
-        for i in range(random_composed_vector.shape[0]):
-            negative_span_idx = random_negative_node_id[i]
-            if negative_span_idx.shape[0] > 0:
-                negative_span_vector.append(
-                    torch.index_select(
-                        random_composed_vector[i],
-                        0,
-                        negative_span_idx))
-        negative_span_vector = torch.cat(negative_span_vector)
+        negative_span_vector = torch.index_select(
+            random_composed_vector.reshape(-1, self.model_dim), 0, random_negative_node_id)
         negative_label = torch.zeros(
             negative_span_vector.shape[0],
             dtype=torch.long,
@@ -394,9 +698,357 @@ class HolCCG(nn.Module):
         self.word_split = word_split
         return word_split
 
+    def quantize(self) -> 'HolCCG':
+        """Apply dynamic int8 quantization to the linear layers for CPU inference
+
+        The linear layers of the encoder, the projection and the syntactic classifiers are
+        quantized in place. Weights are stored as int8 and activations are quantized on the fly.
+
+        Returns
+        -------
+        HolCCG
+            The quantized model
+        """
+        self.to(torch.device('cpu'))
+        self.device = torch.device('cpu')
+        quantize_linear(self)
+        # the projection layer is replaced by the quantized one
+        self.base_modules = [self.linear, self.word_classifier, self.phrase_classifier, self.span_classifier]
+        self.quantized = True
+        return self
+
+    def save_checkpoint(self, path_to_checkpoint: str, encoder_name: str = None) -> None:
+        """Save the model as safetensors weights, json config and tokenizer files
+
+        Parameters
+        ----------
+        path_to_checkpoint : str
+            The directory to save the checkpoint
+        encoder_name : str, optional
+            The name of pretrained encoder, by default the name recorded in the encoder config
+        """
+        os.makedirs(path_to_checkpoint, exist_ok=True)
+        state_dict = {key: value.contiguous() for key, value in self.state_dict().items()}
+        save_file(state_dict, os.path.join(path_to_checkpoint, 'model.safetensors'))
+        if encoder_name is None:
+            encoder_name = self.encoder.config.name_or_path
+        if self.composition == 's_conv':
+            P = self.P.tolist()
+        else:
+            P = None
+        config = {
+            'encoder': encoder_name,
+            'encoder_config': self.encoder.config.to_dict(),
+            'num_word_cat': self.num_word_cat,
+            'num_phrase_cat': self.num_phrase_cat,
+            'model_dim': self.model_dim,
+            'encoder_dim': self.linear.in_features,
+            'dropout': self.word_classifier.dropout.p,
+            'normalize_type': self.normalize_type,
+            'vector_norm': self.vector_norm,
+            'composition': self.composition,
+            'num_encoder_layers': self.num_encoder_layers,
+            'word_category_frequency': self.word_category_frequency,
+            'phrase_category_frequency': self.phrase_category_frequency,
+            'P': P}
+        with open(os.path.join(path_to_checkpoint, 'config.json'), 'w') as f:
+            json.dump(config, f, indent=2)
+        self.tokenizer.save_pretrained(path_to_checkpoint)
+
+    @classmethod
+    def from_checkpoint(cls, path_to_checkpoint: str, device: torch.device, **kwargs) -> 'HolCCG':
+        """Load the model saved by save_checkpoint
+
+        The weights are memory-mapped instead of being read into memory, so that processes
+        loading the same checkpoint share the page cache. The modules are built without
+        initializing their parameters, which are replaced by the loaded weights.
+
+        Parameters
+        ----------
+        path_to_checkpoint : str
+            The directory of the checkpoint
+        device : torch.device
+            The device to use for HolCCG
+        **kwargs
+            The other arguments of HolCCG, such as memory_efficient_composition and spectral
+
+        Returns
+        -------
+        HolCCG
+            The loaded model
+        """
+        with open(os.path.join(path_to_checkpoint, 'config.json'), 'r') as f:
+            config = json.load(f)
+        encoder_config = AutoConfig.for_model(**config['encoder_config'])
+        # the model fine-tuned on truncated encoder keeps using the same layers
+        kwargs.setdefault('num_encoder_layers', config.get('num_encoder_layers'))
+        tokenizer = AutoTokenizer.from_pretrained(path_to_checkpoint)
+        with init_empty_weights(include_buffers=False):
+            holccg = cls(
+                num_word_cat=config['num_word_cat'],
+                num_phrase_cat=config['num_phrase_cat'],
+                encoder=AutoModel.from_config(encoder_config),
+                tokenizer=tokenizer,
+                model_dim=config['model_dim'],
+                dropout=config['dropout'],
+                normalize_type=config['normalize_type'],
+                vector_norm=config['vector_norm'],
+                composition=config['composition'],
+                device=device,
+                encoder_dim=config.get('encoder_dim'),
+                word_category_frequency=config.get('word_category_frequency'),
+                phrase_category_frequency=config.get('phrase_category_frequency'),
+                **kwargs)
+        state_dict = load_safetensors(os.path.join(path_to_checkpoint, 'model.safetensors'))
+        holccg.load_state_dict(state_dict, assign=True)
+        if config['P'] is not None:
+            holccg.P = torch.tensor(config['P'], device=device)
+        # parameters are replaced when loading, so the list for learning rate is rebuilt
+        holccg.base_params = iter([params for module in holccg.base_modules for params in module.parameters()])
+        return holccg.to(device)
+
+    def make_scoring_head(self) -> 'FusedScoringHead':
+        """Make the head which evaluates span and phrase classifiers at once for parsing
+
+        Returns
+        -------
+        FusedScoringHead
+            The head whose first output is span and second output is phrase category
+        """
+        return FusedScoringHead([self.span_classifier, self.phrase_classifier])
+
+
+class TreeComposition(torch.autograd.Function):
+    """Recursive composition which keeps only leaf vectors and the schedule for backward pass.
+
+    The composed vectors are recomputed in backward pass, and the gradient is propagated
+    from parent to children in reverse order of the schedule.
+    """
+
+    @staticmethod
+    def forward(ctx, vector: torch.Tensor, holccg: HolCCG, schedule: List[Tuple]) -> torch.Tensor:
+        ctx.holccg = holccg
+        ctx.schedule = schedule
+        ctx.save_for_backward(vector)
+        with torch.no_grad():
+            return holccg.compose_by_schedule(vector.clone(), schedule)
+
+    @staticmethod
+    def backward(ctx, grad_output: torch.Tensor) -> Tuple:
+        holccg = ctx.holccg
+        vector, = ctx.saved_tensors
+        with torch.no_grad():
+            vector = holccg.compose_by_schedule(vector.clone(), ctx.schedule)
+            grad = grad_output.clone()
+            for one_child, two_child in reversed(ctx.schedule):
+                # each row of batch has at most one composition at each step
+                batch_idx, parent_idx, child_idx = one_child
+                parent_grad = grad[(batch_idx, parent_idx)]
+                grad[(batch_idx, parent_idx)] = 0
+                grad.index_put_((batch_idx, child_idx), parent_grad, accumulate=True)
+                if two_child is not None:
+                    batch_idx, parent_idx, left_child_idx, right_child_idx = two_child
+                    left_child_grad, right_child_grad = compose_pair_backward(
+                        grad[(batch_idx, parent_idx)],
+                        vector[(batch_idx, left_child_idx)],
+                        vector[(batch_idx, right_child_idx)],
+                        holccg.composition,
+                        getattr(holccg, 'P', None),
+                        holccg.vector_norm)
+                    grad[(batch_idx, parent_idx)] = 0
+                    grad.index_put_((batch_idx, left_child_idx), left_child_grad, accumulate=True)
+                    grad.index_put_((batch_idx, right_child_idx), right_child_grad, accumulate=True)
+        return grad, None, None
+
+
+class AdaptiveOutput(nn.Module):
+    def __init__(
+            self,
+            input_dim: int,
+            class_frequency: List[int],
+            coverage: Tuple[float, ...] = (0.95, 0.99),
+            div_value: float = 4.0) -> None:
+        """class for frequency-aware output layer of syntactic classifier
+
+        The classes are ranked by their frequency. The frequent classes form the head together with
+        one entry per cluster of rare classes, and the rare classes are scored by low-rank projections
+        only when they are needed. The output is log probability in the original order of class id.
+
+        Parameters
+        ----------
+        input_dim : int
+            The dimension of input vector
+        class_frequency : List[int]
+            The frequency of each class in training data
+        coverage : Tuple[float, ...], optional
+            The ratio of training occurrences covered by the head and by the clusters up to each one,
+            by default (0.95, 0.99). The last cluster covers the rest
+        div_value : float, optional
+            The ratio to reduce the dimension of projection for each cluster, by default 4.0
+        """
+        super(AdaptiveOutput, self).__init__()
+        self.in_features = input_dim
+        self.out_features = len(class_frequency)
+        self.cutoffs = frequency_cutoffs(class_frequency, coverage)
+        self.shortlist_size = self.cutoffs[0]
+        self.num_cluster = len(self.cutoffs) - 1
+        rank_to_class = torch.tensor(np.argsort(-np.array(class_frequency), kind='stable'), dtype=torch.long)
+        class_to_rank = torch.empty_like(rank_to_class)
+        class_to_rank[rank_to_class] = torch.arange(self.out_features)
+        self.register_buffer('rank_to_class', rank_to_class)
+        self.register_buffer('class_to_rank', class_to_rank)
+        self.head = nn.Linear(input_dim, self.shortlist_size + self.num_cluster)
+        kaiming_uniform_(self.head.weight)
+        self.tail = nn.ModuleList()
+        for idx in range(self.num_cluster):
+            projection_dim = max(1, int(input_dim // (div_value ** (idx + 1))))
+            cluster_size = self.cutoffs[idx + 1] - self.cutoffs[idx]
+            self.tail.append(nn.Sequential(
+                nn.Linear(input_dim, projection_dim, bias=False),
+                nn.Linear(projection_dim, cluster_size, bias=False)))
+
+    def log_prob_by_rank(self, x: torch.Tensor) -> torch.Tensor:
+        """Compute the log probability of all classes in the order of frequency rank
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            The input vector of shape (num_vector, input_dim)
+
+        Returns
+        -------
+        torch.Tensor
+            The log probability of shape (num_vector, num_class)
+        """
+        head_log_prob = torch.log_softmax(self.head(x), dim=-1)
+        log_prob = [head_log_prob[:, :self.shortlist_size]]
+        for idx, tail in enumerate(self.tail):
+            cluster_log_prob = head_log_prob[:, self.shortlist_size + idx:self.shortlist_size + idx + 1]
+            log_prob.append(torch.log_softmax(tail(x), dim=-1) + cluster_log_prob)
+        return torch.cat(log_prob, dim=-1)
+
+    def forward(self, x: torch.Tensor, ids: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Compute the log probability of classes
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            The input vector of shape (..., input_dim)
+        ids : torch.Tensor, optional
+            The class ids of shape (..., num_candidate) to compute the log probability of,
+            by default None, in which case the log probability of all classes is returned.
+            The clusters are computed only for the vectors which have candidates in them
+
+        Returns
+        -------
+        torch.Tensor
+            The log probability of the classes
+        """
+        leading_shape = list(x.shape[:-1])
+        x = x.reshape(-1, self.in_features)
+        if ids is None:
+            log_prob = self.log_prob_by_rank(x).index_select(-1, self.class_to_rank)
+            return log_prob.view(leading_shape + [self.out_features])
+
+        rank = self.class_to_rank[ids.reshape(x.shape[0], -1)]
+        head_log_prob = torch.log_softmax(self.head(x), dim=-1)
+        log_prob = torch.gather(head_log_prob, -1, rank.clamp(max=self.shortlist_size - 1))
+        for idx, tail in enumerate(self.tail):
+            start, end = self.cutoffs[idx], self.cutoffs[idx + 1]
+            in_cluster = (rank >= start) & (rank < end)
+            row = torch.nonzero(in_cluster.any(dim=-1)).squeeze(-1)
+            if row.shape[0] > 0:
+                cluster_log_prob = head_log_prob[row, self.shortlist_size + idx].unsqueeze(-1)
+                tail_log_prob = torch.log_softmax(tail(x[row]), dim=-1) + cluster_log_prob
+                tail_log_prob = torch.gather(tail_log_prob, -1, (rank[row] - start).clamp(0, end - start - 1))
+                log_prob[row] = torch.where(in_cluster[row], tail_log_prob, log_prob[row])
+        return log_prob.view(leading_shape + [rank.shape[-1]])
+
+    @torch.jit.export
+    def top_k(self, x: torch.Tensor, k: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Compute the classes with the highest log probability
+
+        The head alone decides the top-k classes of a vector when its k-th best frequent class is
+        more probable than every cluster, and the clusters are computed only for the other vectors.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            The input vector of shape (..., input_dim)
+        k : int
+            The number of classes
+
+        Returns
+        -------
+        Tuple[torch.Tensor, torch.Tensor]
+            The log probability and the class ids of shape (..., k) in descending order
+        """
+        leading_shape = list(x.shape[:-1])
+        x = x.reshape(-1, self.in_features)
+        head_log_prob = torch.log_softmax(self.head(x), dim=-1)
+        if k <= self.shortlist_size:
+            value, rank = torch.topk(head_log_prob[:, :self.shortlist_size], k, dim=-1)
+            cluster_log_prob = head_log_prob[:, self.shortlist_size:]
+            if self.num_cluster > 0:
+                need_tail = value[:, -1] < cluster_log_prob.max(dim=-1).values
+            else:
+                need_tail = torch.zeros_like(value[:, -1], dtype=torch.bool)
+        else:
+            value = torch.empty(x.shape[0], k, dtype=head_log_prob.dtype, device=x.device)
+            rank = torch.empty(x.shape[0], k, dtype=torch.long, device=x.device)
+            need_tail = torch.ones(x.shape[0], dtype=torch.bool, device=x.device)
+        row = torch.nonzero(need_tail).squeeze(-1)
+        if row.shape[0] > 0:
+            tail_value, tail_rank = torch.topk(self.log_prob_by_rank(x[row]), k, dim=-1)
+            value[row] = tail_value
+            rank[row] = tail_rank
+        return value.view(leading_shape + [k]), self.rank_to_class[rank].view(leading_shape + [k])
+
+
+class LogSoftmaxOutput(nn.Module):
+    def __init__(self, linear: nn.Module) -> None:
+        """class which gives the same interface as AdaptiveOutput to a plain output layer
+
+        Parameters
+        ----------
+        linear : nn.Module
+            The output layer which computes the logits of all classes
+        """
+        super(LogSoftmaxOutput, self).__init__()
+        self.linear = linear
+
+    def forward(self, x: torch.Tensor, ids: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Compute the log probability of classes
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            The input vector of shape (..., input_dim)
+        ids : torch.Tensor, optional
+            The class ids of shape (..., num_candidate) to compute the log probability of,
+            by default None, in which case the log probability of all classes is returned
+
+        Returns
+        -------
+        torch.Tensor
+            The log probability of the classes
+        """
+        logits = self.linear(x)
+        # logsumexp over all classes is shared among candidates
+        lse = torch.logsumexp(logits, dim=-1, keepdim=True)
+        if ids is not None:
+            logits = torch.gather(logits, -1, ids)
+        return logits - lse
+
 
 class SyntacticClassifier(nn.Module):
-    def __init__(self, input_dim: int, hidden_dim: int, output_dim: int, dropout: float = 0.2) -> None:
+    def __init__(
+            self,
+            input_dim: int,
+            hidden_dim: int,
+            output_dim: int,
+            dropout: float = 0.2,
+            class_frequency: List[int] = None) -> None:
         """class for syntactic classifier
 
         Parameters
@@ -409,15 +1061,22 @@ class SyntacticClassifier(nn.Module):
             The dimension of output
         dropout : float, optional
             The dropout rate, by default 0.2
+        class_frequency : List[int], optional
+            The frequency of each class in training data, by default None.
+            When given, the output layer is AdaptiveOutput and the output is log probability
         """
         super(SyntacticClassifier, self).__init__()
         self.linear1 = nn.Linear(input_dim, hidden_dim)
         self.layer_norm = nn.LayerNorm(hidden_dim)
         self.relu = nn.ReLU()
         self.dropout = nn.Dropout(p=dropout)
-        self.linear2 = nn.Linear(hidden_dim, output_dim)
+        if class_frequency is None:
+            self.linear2 = nn.Linear(hidden_dim, output_dim)
+        else:
+            self.linear2 = AdaptiveOutput(hidden_dim, class_frequency)
         kaiming_uniform_(self.linear1.weight)
-        kaiming_uniform_(self.linear2.weight)
+        if class_frequency is None:
+            kaiming_uniform_(self.linear2.weight)
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """Forward function
@@ -432,5 +1091,778 @@ class SyntacticClassifier(nn.Module):
         torch.Tensor
             The output vector
         """
-        x = self.linear2(self.dropout(self.relu(self.layer_norm(self.linear1(x)))))
+        x = self.linear2(self.hidden(x))
         return x
+
+    def hidden(self, x: torch.Tensor) -> torch.Tensor:
+        """Compute the hidden representation before the output layer
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            The input vector
+
+        Returns
+        -------
+        torch.Tensor
+            The hidden representation
+        """
+        return self.dropout(self.relu(self.layer_norm(self.linear1(x))))
+
+    @torch.jit.export
+    def top_k(self, x: torch.Tensor, k: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Compute the classes with the highest log probability
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            The input vector of shape (..., input_dim)
+        k : int
+            The number of classes
+
+        Returns
+        -------
+        Tuple[torch.Tensor, torch.Tensor]
+            The log probability and the class ids of shape (..., k) in descending order
+        """
+        h = self.hidden(x)
+        # hasattr instead of isinstance is resolved when the classifier is compiled by TorchScript
+        if hasattr(self.linear2, 'top_k'):
+            return self.linear2.top_k(h, k)
+        log_prob = torch.log_softmax(self.linear2(h), dim=-1)
+        value, ids = torch.topk(log_prob, k, dim=-1)
+        return value, ids
+
+
+class FusedScoringHead(nn.Module):
+    def __init__(self, classifiers: List[SyntacticClassifier]) -> None:
+        """class for inference-time head which evaluates several syntactic classifiers on the same input at once
+
+        The first layers of the classifiers are stacked into one matrix and their layer
+        normalizations are applied in a batched way. The weights are copied from the
+        classifiers, so the head should be rebuilt when the classifiers are updated.
+        When the classifiers are dynamically quantized, the stacked layer is quantized as well.
+
+        Parameters
+        ----------
+        classifiers : List[SyntacticClassifier]
+            The classifiers to be fused
+        """
+        super(FusedScoringHead, self).__init__()
+        self.num_head = len(classifiers)
+        self.hidden_dim = classifiers[0].linear1.out_features
+        self.eps = classifiers[0].layer_norm.eps
+        first_layers = [c.linear1 for c in classifiers]
+        quantized = not isinstance(first_layers[0], nn.Linear)
+        if quantized:
+            weight = torch.cat([layer.weight().dequantize() for layer in first_layers])
+            bias = torch.cat([layer.bias() for layer in first_layers])
+        else:
+            weight = torch.cat([layer.weight.detach() for layer in first_layers])
+            bias = torch.cat([layer.bias.detach() for layer in first_layers])
+        self.linear1 = nn.Linear(weight.shape[1], weight.shape[0], device=weight.device)
+        self.linear1.weight.data.copy_(weight)
+        self.linear1.bias.data.copy_(bias)
+        self.register_buffer('layer_norm_weight', torch.stack([c.layer_norm.weight.detach() for c in classifiers]))
+        self.register_buffer('layer_norm_bias', torch.stack([c.layer_norm.bias.detach() for c in classifiers]))
+        self.output_layers = nn.ModuleList([
+            c.linear2 if isinstance(c.linear2, AdaptiveOutput) else LogSoftmaxOutput(c.linear2)
+            for c in classifiers])
+        if quantized:
+            quantize_linear(self)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        """Compute the hidden representation of all classifiers
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            The input vector of shape (..., input_dim)
+
+        Returns
+        -------
+        torch.Tensor
+            The hidden representation of shape (..., num_head, hidden_dim)
+        """
+        h = self.linear1(x)
+        h = h.view(list(x.shape[:-1]) + [self.num_head, self.hidden_dim])
+        h = nn.functional.layer_norm(h, (self.hidden_dim,), eps=self.eps)
+        return torch.relu(h * self.layer_norm_weight + self.layer_norm_bias)
+
+    @torch.jit.export
+    def log_prob(self, hidden: torch.Tensor, head_idx: int, ids: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Compute the log probability of the classes of one classifier
+
+        Parameters
+        ----------
+        hidden : torch.Tensor
+            The hidden representation computed by forward
+        head_idx : int
+            The index of the classifier
+        ids : torch.Tensor, optional
+            The class ids of shape (..., num_candidate) to compute the log probability of,
+            by default None, in which case the log probability of all classes is returned
+
+        Returns
+        -------
+        torch.Tensor
+            The log probability of the classes
+        """
+        log_prob = hidden
+        # loop instead of indexing so that the head can be compiled by TorchScript
+        for idx, output_layer in enumerate(self.output_layers):
+            if idx == head_idx:
+                log_prob = output_layer(hidden[..., idx, :], ids)
+        return log_prob
+
+
+class EncoderOutput(nn.Module):
+    def __init__(self, encoder: nn.Module) -> None:
+        """class to take the last hidden state of encoder, which is traced for export
+
+        Parameters
+        ----------
+        encoder : nn.Module
+            Text encoder used for HolCCG
+        """
+        super(EncoderOutput, self).__init__()
+        self.encoder = encoder
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        return self.encoder(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+
+
+class InferenceGraph(nn.Module):
+    # attributes with None value need explicit type for TorchScript
+    vector_norm: Optional[float]
+
+    def __init__(self, holccg: HolCCG, encoder: nn.Module) -> None:
+        """class for the inference graph of HolCCG, which is compiled by TorchScript for export
+
+        Parameters
+        ----------
+        holccg : HolCCG
+            The trained HolCCG in evaluation mode
+        encoder : nn.Module
+            The traced encoder which maps input ids and attention mask to the last hidden state
+        """
+        super(InferenceGraph, self).__init__()
+        self.encoder = encoder
+        self.linear = holccg.linear
+        self.word_classifier = holccg.word_classifier
+        self.phrase_classifier = holccg.phrase_classifier
+        self.span_classifier = holccg.span_classifier
+        self.scoring_head = holccg.make_scoring_head()
+        self.model_dim = holccg.model_dim
+        self.normalize_type = holccg.normalize_type
+        self.vector_norm = holccg.vector_norm
+        self.composition = holccg.composition
+        if self.composition == 's_conv':
+            self.register_buffer('P', holccg.P.clone())
+        else:
+            self.register_buffer('P', torch.zeros(0, dtype=torch.long))
+
+    def forward(
+            self,
+            input_ids: torch.Tensor,
+            attention_mask: torch.Tensor,
+            word_start: torch.Tensor,
+            word_end: torch.Tensor) -> torch.Tensor:
+        """Encode the tokenized sentences into word vectors
+
+        Parameters
+        ----------
+        input_ids : torch.Tensor
+            The token ids of shape (batch_size, num_token)
+        attention_mask : torch.Tensor
+            The attention mask of shape (batch_size, num_token)
+        word_start : torch.Tensor
+            The index of the first subword of each word, of shape (batch_size, num_word)
+        word_end : torch.Tensor
+            The index next to the last subword of each word, of shape (batch_size, num_word)
+
+        Returns
+        -------
+        torch.Tensor
+            The word vectors of shape (batch_size, num_word, model_dim)
+        """
+        return self.pool_word_vector(self.encoder(input_ids, attention_mask), word_start, word_end)
+
+    @torch.jit.export
+    def pool_word_vector(self, hidden: torch.Tensor, word_start: torch.Tensor, word_end: torch.Tensor) -> torch.Tensor:
+        """Compute word vectors from the hidden states of subwords
+
+        Parameters
+        ----------
+        hidden : torch.Tensor
+            The hidden states of encoder including special tokens
+        word_start : torch.Tensor
+            The index of the first subword of each word, of shape (batch_size, num_word)
+        word_end : torch.Tensor
+            The index next to the last subword of each word, of shape (batch_size, num_word)
+
+        Returns
+        -------
+        torch.Tensor
+            The word vectors of shape (batch_size, num_word, model_dim)
+        """
+        hidden = hidden[:, 1:-1]
+        # mean of subwords as the difference of cumulative sums
+        cumsum = torch.cat([torch.zeros_like(hidden[:, :1]), torch.cumsum(hidden, dim=1)], dim=1)
+        start = word_start.unsqueeze(-1).expand(-1, -1, hidden.shape[-1])
+        end = word_end.unsqueeze(-1).expand(-1, -1, hidden.shape[-1])
+        num_subword = (word_end - word_start).clamp_min(1).unsqueeze(-1)
+        word_vector = (torch.gather(cumsum, 1, end) - torch.gather(cumsum, 1, start)) / num_subword
+        word_vector = self.linear(word_vector)
+        if self.normalize_type == 'real':
+            word_vector = scale_to_norm(word_vector, self.vector_norm)
+        elif self.normalize_type == 'complex':
+            word_vector = complex_normalize(word_vector)
+        return word_vector
+
+    @torch.jit.export
+    def compose(self, left: torch.Tensor, right: torch.Tensor) -> torch.Tensor:
+        """Compose the vectors of left and right child into the vector of parent
+
+        Parameters
+        ----------
+        left : torch.Tensor
+            The vector of left child
+        right : torch.Tensor
+            The vector of right child
+
+        Returns
+        -------
+        torch.Tensor
+            The vector of parent
+        """
+        return compose_pair(left, right, self.composition, self.P, self.vector_norm)
+
+
+class ExportedHolCCG:
+    # the word split and token ids are computed in the same way as HolCCG
+    set_word_split = HolCCG.set_word_split
+    tokenize = HolCCG.tokenize
+
+    def __init__(self, path_to_model: str, device: torch.device) -> None:
+        """class for HolCCG loaded from the exported inference graph
+
+        It has the same interface as HolCCG used by supertagging and parsing, without
+        constructing the encoder from transformers.
+
+        Parameters
+        ----------
+        path_to_model : str
+            The directory of the exported model
+        device : torch.device
+            The device to use for inference
+        """
+        self.graph = torch.jit.load(os.path.join(path_to_model, 'holccg.pt'), map_location=device)
+        self.tokenizer = AutoTokenizer.from_pretrained(path_to_model)
+        self.device = device
+        self.model_dim = self.graph.model_dim
+        self.normalize_type = self.graph.normalize_type
+        self.vector_norm = self.graph.vector_norm
+        self.composition = self.graph.composition
+        self.word_classifier = self.graph.word_classifier
+        self.phrase_classifier = self.graph.phrase_classifier
+        self.span_classifier = self.graph.span_classifier
+        self.spectral = False
+        self.quantized = False
+        self.window_size = None
+        self.window_stride = None
+        # the traced encoder takes the attention mask of padded sentences only
+        self.pack_size = None
+        self.encoder_cache = None
+
+    def eval(self) -> 'ExportedHolCCG':
+        return self
+
+    def encode(
+            self,
+            sentence: List[str],
+            word_split: List[List[Tuple]],
+            input_ids: List[torch.Tensor] = None) -> Tuple:
+        """Encode the sentence into word vectors, which are taken from encoder_cache when it is set
+
+        Parameters
+        ----------
+        sentence : List[str]
+            The sentence to encode
+        word_split : List[List[Tuple]]
+            The word split information
+        input_ids : List[torch.Tensor], optional
+            The token ids of each sentence including special tokens, by default None, which tokenizes the sentence
+
+        Returns
+        -------
+        Tuple
+            The word vectors and their corresponding lengths
+        """
+        if self.encoder_cache is not None:
+            return self.encoder_cache.encode(self, sentence, word_split, input_ids=input_ids)
+        return self.encode_without_cache(sentence, word_split, input_ids=input_ids)
+
+    def encode_without_cache(
+            self,
+            sentence: List[str],
+            word_split: List[List[Tuple]],
+            input_ids: List[torch.Tensor] = None) -> Tuple:
+        """Encode the sentence into word vectors by running the encoder
+
+        Parameters
+        ----------
+        sentence : List[str]
+            The sentence to encode
+        word_split : List[List[Tuple]]
+            The word split information
+        input_ids : List[torch.Tensor], optional
+            The token ids of each sentence including special tokens, by default None, which tokenizes the sentence
+
+        Returns
+        -------
+        Tuple
+            The word vectors and their corresponding lengths
+        """
+        if input_ids is None:
+            input_ids = self.tokenize(sentence)
+        lengths = torch.tensor([len(info) for info in word_split], device=torch.device('cpu'))
+        word_start = torch.zeros((len(word_split), int(max(lengths))), dtype=torch.long)
+        word_end = torch.zeros((len(word_split), int(max(lengths))), dtype=torch.long)
+        for idx, info in enumerate(word_split):
+            word_start[idx, :len(info)] = torch.tensor([start_idx for start_idx, _ in info])
+            word_end[idx, :len(info)] = torch.tensor([end_idx for _, end_idx in info])
+        if exceed_window(self.tokenizer, word_split, self.window_size):
+            hidden = encode_by_window(
+                lambda input: self.graph.encoder(input['input_ids'], input['attention_mask']),
+                self.tokenizer,
+                [ids.tolist() for ids in input_ids],
+                self.window_size,
+                self.window_stride,
+                self.device)
+            word_vector = self.graph.pool_word_vector(hidden, word_start.to(self.device), word_end.to(self.device))
+            return word_vector, lengths
+        input = {
+            key: value.to(self.device)
+            for key, value in pad_input_ids(input_ids, self.tokenizer.pad_token_id).items()}
+        word_vector = self.graph(
+            input['input_ids'],
+            input['attention_mask'],
+            word_start.to(self.device),
+            word_end.to(self.device))
+        return word_vector, lengths
+
+    def compose_pair(self, left: torch.Tensor, right: torch.Tensor) -> torch.Tensor:
+        """Compose vectors of left and right child, or their spectra in Fourier domain
+
+        Parameters
+        ----------
+        left : torch.Tensor
+            The vector or spectrum of left child
+        right : torch.Tensor
+            The vector or spectrum of right child
+
+        Returns
+        -------
+        torch.Tensor
+            The vector or spectrum of parent
+        """
+        if left.is_complex():
+            return spectral_compose_pair(left, right, self.composition, self.vector_norm, self.model_dim)
+        return self.graph.compose(left, right)
+
+    def make_scoring_head(self) -> nn.Module:
+        """Return the exported head which evaluates span and phrase classifiers at once
+
+        Returns
+        -------
+        nn.Module
+            The head whose first output is span and second output is phrase category
+        """
+        return self.graph.scoring_head
+
+
+def export_holccg(holccg: HolCCG, path_to_export: str) -> None:
+    """Export the inference graph of HolCCG by TorchScript with tokenizer files
+
+    Parameters
+    ----------
+    holccg : HolCCG
+        The trained HolCCG
+    path_to_export : str
+        The directory to save the exported model
+    """
+    holccg.eval()
+    # the shapes of example input are not fixed in the traced graph
+    example = holccg.tokenizer(['This is an example .', 'Example'], padding=True, return_tensors='pt')
+    example = example.to(holccg.device)
+    encoder = holccg.encoder
+    if holccg.num_encoder_layers is not None:
+        # upper layers are dropped from the exported graph
+        encoder = copy.deepcopy(encoder)
+        encoder.encoder.layer = encoder.encoder.layer[:holccg.num_encoder_layers]
+    with torch.no_grad():
+        encoder = torch.jit.trace(
+            EncoderOutput(encoder).eval(),
+            (example['input_ids'], example['attention_mask']),
+            strict=False)
+        graph = torch.jit.script(InferenceGraph(holccg, encoder))
+    os.makedirs(path_to_export, exist_ok=True)
+    torch.jit.save(graph, os.path.join(path_to_export, 'holccg.pt'))
+    holccg.tokenizer.save_pretrained(path_to_export)
+
+
+# dtypes of safetensors format
+SAFETENSORS_DTYPE = {
+    'F64': torch.float64,
+    'F32': torch.float32,
+    'F16': torch.float16,
+    'BF16': torch.bfloat16,
+    'I64': torch.int64,
+    'I32': torch.int32,
+    'I16': torch.int16,
+    'I8': torch.int8,
+    'U8': torch.uint8,
+    'BOOL': torch.bool}
+
+
+def load_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """Load tensors in safetensors format by memory map
+
+    Pages are read lazily from the file, and are shared among processes until written.
+
+    Parameters
+    ----------
+    path : str
+        path to the safetensors file
+
+    Returns
+    -------
+    Dict[str, torch.Tensor]
+        tensors on cpu backed by the memory-mapped file
+    """
+    with open(path, 'rb') as f:
+        header_size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_size))
+        # copy-on-write mapping, as torch requires writable buffer
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header.pop('__metadata__', None)
+    state_dict = {}
+    for key, info in header.items():
+        dtype = SAFETENSORS_DTYPE[info['dtype']]
+        start, end = info['data_offsets']
+        if start == end:
+            tensor = torch.empty(0, dtype=dtype)
+        else:
+            tensor = torch.frombuffer(
+                buffer,
+                dtype=dtype,
+                count=(end - start) // dtype.itemsize,
+                offset=8 + header_size + start)
+        state_dict[key] = tensor.view(info['shape'])
+    return state_dict
+
+
+def exceed_window(tokenizer: nn.Module, word_split: List[List[Tuple]], window_size: Optional[int]) -> bool:
+    """Check whether any sentence is longer than the window
+
+    Parameters
+    ----------
+    tokenizer : nn.Module
+        Tokenizer used for encoder
+    word_split : List[List[Tuple]]
+        The word split information, whose last end index is the number of subwords
+    window_size : int, optional
+        The number of tokens in each window including special tokens, or None when windows are not used
+
+    Returns
+    -------
+    bool
+        Whether the sentences should be encoded by windows
+    """
+    if window_size is None:
+        return False
+    num_subword = max([info[-1][1] for info in word_split if len(info) > 0], default=0)
+    return num_subword > window_size - tokenizer.num_special_tokens_to_add()
+
+
+def encode_by_window(
+        encoder: Callable[[dict], torch.Tensor],
+        tokenizer: nn.Module,
+        input_ids: List[List[int]],
+        window_size: int,
+        window_stride: Optional[int],
+        device: torch.device) -> torch.Tensor:
+    """Encode sentences by overlapping windows of subwords
+
+    All windows of the batch are encoded at once. The hidden state of each subword is taken
+    from the window where it has the most context on both sides, so that the output has the same
+    layout as encoding the whole sentence and the indices of word split can be used as they are.
+
+    Parameters
+    ----------
+    encoder : Callable[[dict], torch.Tensor]
+        The function which maps the tokenized input to the last hidden state
+    tokenizer : nn.Module
+        Tokenizer used for encoder
+    input_ids : List[List[int]]
+        The token ids of each sentence including special tokens at both ends
+    window_size : int
+        The number of tokens in each window including special tokens
+    window_stride : int, optional
+        The number of subwords between the starts of adjacent windows, or None for the half of the window
+    device : torch.device
+        The device to use
+
+    Returns
+    -------
+    torch.Tensor
+        The hidden states of shape (batch_size, max_num_subword + 2, hidden_dim), where the first
+        and the last positions stand for special tokens and are not used for word vectors
+    """
+    window_length = window_size - tokenizer.num_special_tokens_to_add()
+    if window_stride is None:
+        window_stride = max(1, window_length // 2)
+    if window_length < 1 or not 0 < window_stride <= window_length:
+        raise ValueError('window stride should be positive and not longer than the window')
+    subword_ids = [ids[1:-1] for ids in input_ids]
+    window_ids = []
+    # the sentence, window and position in window of each subword
+    sentence_idx, window_idx, position_idx = [], [], []
+    for idx, ids in enumerate(subword_ids):
+        num_subword = len(ids)
+        window_start = np.array(
+            list(range(0, max(num_subword - window_length, 0), window_stride)) + [max(num_subword - window_length, 0)])
+        window_end = np.minimum(window_start + window_length, num_subword)
+        position = np.arange(num_subword)
+        # the context is not cut at the ends of sentence
+        start, end = window_start[:, None], window_end[:, None]
+        left_context = np.where(start > 0, position[None] - start, num_subword)
+        right_context = np.where(end < num_subword, end - 1 - position[None], num_subword)
+        context = np.minimum(left_context, right_context)
+        context[(position[None] < start) | (position[None] >= end)] = -1
+        best_window = np.argmax(context, axis=0)
+        sentence_idx.append(np.full(num_subword, idx))
+        window_idx.append(best_window + len(window_ids))
+        # shifted by the special token at the beginning of window
+        position_idx.append(position - window_start[best_window] + 1)
+        for first, last in zip(window_start, window_end):
+            window_ids.append([tokenizer.cls_token_id] + ids[first:last] + [tokenizer.sep_token_id])
+    input = tokenizer.pad({'input_ids': window_ids}, return_tensors='pt').to(device)
+    window_hidden = encoder(input)
+    max_num_subword = max([len(ids) for ids in subword_ids])
+    hidden = torch.zeros(
+        (len(input_ids), max_num_subword + 2, window_hidden.shape[-1]), dtype=window_hidden.dtype, device=device)
+    sentence_idx = torch.from_numpy(np.concatenate(sentence_idx)).to(device)
+    subword_idx = torch.cat([torch.arange(len(ids)) for ids in subword_ids]).to(device) + 1
+    window_idx = torch.from_numpy(np.concatenate(window_idx)).to(device)
+    position_idx = torch.from_numpy(np.concatenate(position_idx)).to(device)
+    hidden[sentence_idx, subword_idx] = window_hidden[window_idx, position_idx]
+    return hidden
+
+
+def pack_sentences(lengths: List[int], pack_size: int) -> List[List[int]]:
+    """Assign sentences to sequences by first-fit decreasing bin packing
+
+    Parameters
+    ----------
+    lengths : List[int]
+        The number of tokens of each sentence including special tokens
+    pack_size : int
+        The maximum number of tokens in a sequence. A longer sentence has its own sequence
+
+    Returns
+    -------
+    List[List[int]]
+        The indices of sentences in each sequence
+    """
+    packs = []
+    space = []
+    for idx in sorted(range(len(lengths)), key=lambda idx: -lengths[idx]):
+        for pack_id in range(len(packs)):
+            if lengths[idx] <= space[pack_id]:
+                packs[pack_id].append(idx)
+                space[pack_id] -= lengths[idx]
+                break
+        else:
+            packs.append([idx])
+            space.append(pack_size - lengths[idx])
+    return packs
+
+
+def make_packed_input(
+        tokenizer: nn.Module,
+        input_ids: List[List[int]],
+        pack_size: int,
+        position_offset: int = 0) -> Tuple[dict, Tuple[torch.Tensor, ...]]:
+    """Pack tokenized sentences into sequences with block diagonal attention mask
+
+    Parameters
+    ----------
+    tokenizer : nn.Module
+        Tokenizer used for encoder
+    input_ids : List[List[int]]
+        The token ids of each sentence to pack including special tokens
+    pack_size : int
+        The maximum number of tokens in a sequence
+    position_offset : int, optional
+        The position id of the first token of each sentence, by default 0
+
+    Returns
+    -------
+    Tuple[dict, Tuple[torch.Tensor, ...]]
+        The input of encoder with attention mask of shape (num_pack, num_token, num_token) and
+        position ids, and the sentence, token, sequence and position in sequence of each token
+    """
+    lengths = [len(ids) for ids in input_ids]
+    packs = pack_sentences(lengths, pack_size)
+    num_token = max([sum([lengths[idx] for idx in pack]) for pack in packs])
+    packed_ids = torch.full((len(packs), num_token), tokenizer.pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(packs), num_token, num_token), dtype=torch.long)
+    position_ids = torch.full((len(packs), num_token), position_offset, dtype=torch.long)
+    sentence_idx, token_idx, pack_idx, pack_position = [], [], [], []
+    for pack_id, pack in enumerate(packs):
+        start = 0
+        for idx in pack:
+            end = start + lengths[idx]
+            packed_ids[pack_id, start:end] = torch.tensor(input_ids[idx])
+            attention_mask[pack_id, start:end, start:end] = 1
+            position_ids[pack_id, start:end] = torch.arange(lengths[idx]) + position_offset
+            sentence_idx.append(torch.full((lengths[idx],), idx))
+            token_idx.append(torch.arange(lengths[idx]))
+            pack_idx.append(torch.full((lengths[idx],), pack_id))
+            pack_position.append(torch.arange(start, end))
+            start = end
+    input = {'input_ids': packed_ids, 'attention_mask': attention_mask, 'position_ids': position_ids}
+    unpack_index = tuple(torch.cat(index) for index in [sentence_idx, token_idx, pack_idx, pack_position])
+    return input, unpack_index
+
+
+def pad_input_ids(input_ids: List[torch.Tensor], pad_token_id: int) -> Dict[str, torch.Tensor]:
+    """Collate the token ids of sentences into the padded input of encoder
+
+    Parameters
+    ----------
+    input_ids : List[torch.Tensor]
+        The token ids of each sentence including special tokens
+    pad_token_id : int
+        The id of padding token
+
+    Returns
+    -------
+    Dict[str, torch.Tensor]
+        The input ids and attention mask of shape (batch_size, max_num_token)
+    """
+    padded_ids = pad_sequence(list(input_ids), batch_first=True, padding_value=pad_token_id)
+    lengths = torch.tensor([len(ids) for ids in input_ids], device=padded_ids.device)
+    attention_mask = (torch.arange(padded_ids.shape[1], device=padded_ids.device) < lengths[:, None]).long()
+    return {'input_ids': padded_ids, 'attention_mask': attention_mask}
+
+
+def padding_efficiency(lengths: List[int], pack_size: int = None) -> float:
+    """Compute the ratio of real tokens to all tokens fed into encoder
+
+    Parameters
+    ----------
+    lengths : List[int]
+        The number of tokens of each sentence including special tokens
+    pack_size : int, optional
+        The maximum number of tokens in a packed sequence, by default None, which pads each sentence
+
+    Returns
+    -------
+    float
+        The padding efficiency
+    """
+    if pack_size is None:
+        return sum(lengths) / (len(lengths) * max(lengths))
+    packs = pack_sentences(lengths, pack_size)
+    num_token = max([sum([lengths[idx] for idx in pack]) for pack in packs])
+    return sum(lengths) / (len(packs) * num_token)
+
+
+def frequency_cutoffs(class_frequency: List[int], coverage: Tuple[float, ...]) -> List[int]:
+    """Compute the boundaries of head and clusters of classes ranked by frequency
+
+    Parameters
+    ----------
+    class_frequency : List[int]
+        The frequency of each class in training data
+    coverage : Tuple[float, ...]
+        The ratio of training occurrences covered by the head and by the clusters up to each one
+
+    Returns
+    -------
+    List[int]
+        The end rank of head and of each cluster, whose last element is the number of classes
+    """
+    num_class = len(class_frequency)
+    cumulative_frequency = np.cumsum(np.sort(np.array(class_frequency))[::-1])
+    total = max(int(cumulative_frequency[-1]), 1)
+    cutoffs = []
+    for ratio in coverage:
+        cutoff = int(np.searchsorted(cumulative_frequency, ratio * total)) + 1
+        # empty clusters are skipped
+        if cutoff > (cutoffs[-1] if cutoffs else 0) and cutoff < num_class:
+            cutoffs.append(cutoff)
+    cutoffs.append(num_class)
+    return cutoffs
+
+
+def quantize_linear(module: nn.Module) -> None:
+    """Apply dynamic int8 quantization to linear layers in place
+
+    Parameters
+    ----------
+    module : nn.Module
+        The module whose linear layers are quantized
+    """
+    torch.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    # qconfig left on modules holds local functions, which makes the model unpicklable
+    for submodule in module.modules():
+        if hasattr(submodule, 'qconfig'):
+            del submodule.qconfig
+
+
+def load_holccg(path_to_model: str, device: torch.device, quantize: str = 'none') -> Union[HolCCG, ExportedHolCCG]:
+    """Load trained HolCCG for inference
+
+    Parameters
+    ----------
+    path_to_model : str
+        path to the checkpoint directory saved by HolCCG.save_checkpoint. The directory of the
+        exported model, and the pickled model (e.g. saved after quantization) can be loaded as well
+    device : torch.device
+        device to use for inference
+    quantize : str, optional
+        'int8' to apply dynamic int8 quantization, by default 'none'
+
+    Returns
+    -------
+    HolCCG
+        the model in evaluation mode, or ExportedHolCCG for the exported model
+    """
+    if quantize == 'int8' and device.type != 'cpu':
+        raise ValueError('dynamic int8 quantization is only available on cpu')
+    if os.path.exists(os.path.join(path_to_model, 'holccg.pt')):
+        # the exported model is quantized when exported, if required
+        if quantize != 'none':
+            raise ValueError('quantization should be applied when exporting the model')
+        return ExportedHolCCG(path_to_model, device)
+    elif os.path.exists(os.path.join(path_to_model, 'model.safetensors')):
+        holccg = HolCCG.from_checkpoint(path_to_model, device)
+    else:
+        holccg = torch.load(path_to_model, map_location=device, weights_only=False)
+        # options added after the model was pickled
+        for name, value in [('memory_efficient_composition', False), ('spectral', False),
+                            ('num_encoder_layers', None), ('early_exit_threshold', None),
+                            ('word_category_frequency', None), ('phrase_category_frequency', None),
+                            ('window_size', None), ('window_stride', None), ('pack_size', None),
+                            ('encoder_cache', None)]:
+            if not hasattr(holccg, name):
+                setattr(holccg, name, value)
+    holccg.device = device
+    if quantize == 'int8' and not getattr(holccg, 'quantized', False):
+        holccg.quantize()
+    holccg.eval()
+    return holccg
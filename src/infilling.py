@@ -2,7 +2,11 @@ import spacy
 import benepar
 from transformers import RobertaTokenizer, RobertaForMaskedLM
 import tqdm
-from utils import load, inverse_circular_correlation
+from utils import inverse_circular_correlation
+from holccg import load_holccg
+from encoder_cache import EncoderCache
+from tree import Node, Tree
+from tree_store import open_tree_list
 import torch
 from torch.nn.functional import cosine_similarity as cos
 import random
@@ -15,6 +19,22 @@ def arg_parse():
     parser.add_argument('--path_to_holccg', type=str, help='path to trained Hol-CCG')
     parser.add_argument('--path_to_roberta', type=str, help='path to trained RoBERTa')
     parser.add_argument('--path_to_dataset', type=str, default='../dataset/', help='path to dataset')
+    parser.add_argument('--spectral', action='store_true', help='compose vectors in Fourier domain')
+    parser.add_argument(
+        '--window_size',
+        type=int,
+        default=None,
+        help='number of tokens in each window to encode sentences longer than it by overlapping windows')
+    parser.add_argument(
+        '--window_stride',
+        type=int,
+        default=None,
+        help='number of subwords between the starts of adjacent windows, by default the half of window')
+    parser.add_argument(
+        '--path_to_encoder_cache',
+        type=str,
+        default=None,
+        help='directory to cache word vectors of sentences, which are reused by later runs with the same model')
     parser.add_argument(
         '--device',
         type=torch.device,
@@ -37,25 +57,61 @@ def initialize_berkeley_parser():
     return berkeley_parser
 
 
+class InfillingSample:
+    def __init__(self, tree: Tree, target_node: Node) -> None:
+        """results of infilling a phrase of tree, which are kept apart from the tree and its nodes
+
+        Parameters
+        ----------
+        tree : Tree
+            tree whose phrase is infilled
+        target_node : Node
+            node of the phrase to be infilled
+        """
+        self.tree = tree
+        self.target_node = target_node
+        self.sibling_node = None
+        self.lr = None
+        self.reconstruct_vector = None
+        self.original_sentence = None
+        self.original_tree = None
+        self.original_symbol = None
+        self.infilled_content = []
+        self.infilled_sentences = []
+        self.infilled_trees = []
+        self.infilled_symbols = []
+        self.roberta_infilled_sentence = None
+        self.roberta_infilled_phrase = None
+        self.roberta_infilled_tree = None
+        self.roberta_infilled_symbol = None
+
+
 def infilling_with_holccg(args, berkeley_parser):
-    holccg = torch.load(args.path_to_holccg, map_location=args.device)
-    holccg.device = args.device
+    holccg = load_holccg(args.path_to_holccg, args.device)
+    holccg.spectral = args.spectral
+    holccg.window_size = args.window_size
+    holccg.window_stride = args.window_stride
+    if args.path_to_encoder_cache is not None:
+        holccg.encoder_cache = EncoderCache(args.path_to_encoder_cache)
 
-    dev_tree_list = load(os.path.join(args.path_to_dataset, 'tree_list/dev_tree_list.pickle'))
+    dev_tree_list = open_tree_list(os.path.join(args.path_to_dataset, 'tree_list/'), 'dev')
     dev_tree_list.tokenizer = holccg.tokenizer
     dev_tree_list.set_info_for_training(tokenizer=holccg.tokenizer)
     with torch.no_grad():
         dev_tree_list.set_vector(holccg)
+    if holccg.encoder_cache is not None:
+        holccg.encoder_cache.flush()
 
     # store vectors and contents for each node
-    vector_list = []
+    vector_id_list = []
     content_list = []
     for tree in dev_tree_list.tree_list:
         for node in tree.node_list:
             if not node.is_leaf:
-                vector_list.append(node.vector)
+                vector_id_list.append(node.vector_id)
                 content_list.append(node.content)
-    vector_list = torch.stack(vector_list)
+    node_vector = dev_tree_list.node_vector
+    vector_list = node_vector[vector_id_list]
 
     # filter out sentences whose length is longer than 30 or shorter than 10
     tree_list = []
@@ -65,6 +121,7 @@ def infilling_with_holccg(args, berkeley_parser):
         tree_list.append(tree)
 
     # randomly sample 1 nodes from each tree whose content is longer than 2 and shorter than 6
+    sample_list = []
     for tree in tree_list:
         while True:
             node = random.choice(tree.node_list)
@@ -74,85 +131,86 @@ def infilling_with_holccg(args, berkeley_parser):
                 continue
             else:
                 break
-        tree.replace_target_node = node
-        parent_node = tree.replace_target_node.parent_node
-        if tree.node_list[parent_node.left_child_node_id] == tree.replace_target_node:
-            tree.replace_target_node.lr = 'l'
-            tree.sibling_node = tree.node_list[parent_node.right_child_node_id]
-            reconstruct_vector = inverse_circular_correlation(parent_node.vector,
-                                                              tree.sibling_node.vector,
+        sample = InfillingSample(tree, node)
+        parent_node = sample.target_node.parent_node
+        if tree.node_list[parent_node.left_child_node_id] == sample.target_node:
+            sample.lr = 'l'
+            sample.sibling_node = tree.node_list[parent_node.right_child_node_id]
+            reconstruct_vector = inverse_circular_correlation(node_vector[parent_node.vector_id],
+                                                              node_vector[sample.sibling_node.vector_id],
                                                               holccg.vector_norm,
                                                               child_is_left=False)
-            tree.replace_target_node.reconstruct_vector = reconstruct_vector
+            sample.reconstruct_vector = reconstruct_vector
         else:
-            tree.replace_target_node.lr = 'r'
-            tree.sibling_node = tree.node_list[parent_node.left_child_node_id]
-            reconstruct_vector = inverse_circular_correlation(parent_node.vector,
-                                                              tree.sibling_node.vector,
+            sample.lr = 'r'
+            sample.sibling_node = tree.node_list[parent_node.left_child_node_id]
+            reconstruct_vector = inverse_circular_correlation(node_vector[parent_node.vector_id],
+                                                              node_vector[sample.sibling_node.vector_id],
                                                               holccg.vector_norm,
                                                               child_is_left=True)
-            tree.replace_target_node.reconstruct_vector = reconstruct_vector
+            sample.reconstruct_vector = reconstruct_vector
+        sample_list.append(sample)
 
     # find top k similar vectors and store their words or phrases
-    for tree in tree_list:
-        vector = tree.replace_target_node.reconstruct_vector
-        content = tree.replace_target_node.content
+    for sample in sample_list:
+        vector = sample.reconstruct_vector
+        content = sample.target_node.content
         # search top k similar vector from vector_list
         k = 1
         vector = vector.unsqueeze(0)
         similarity = cos(vector, vector_list)
         top_k = torch.topk(similarity, k + 1)
         top_k_index = top_k.indices[1:]
-        tree.replace_target_node.infilled_content = []
+        sample.infilled_content = []
         for idx in top_k_index:
-            tree.replace_target_node.infilled_content.append(content_list[idx])
-        tree.original_sentence = ' '.join(tree.sentence)
-        tree.infilled_sentences = []
-        for content in tree.replace_target_node.infilled_content:
-            infilled_sentence = tree.original_sentence.replace(
-                ' '.join(tree.replace_target_node.content), ' '.join(content))
-            tree.infilled_sentences.append(infilled_sentence)
+            sample.infilled_content.append(content_list[idx])
+        sample.original_sentence = ' '.join(sample.tree.sentence)
+        sample.infilled_sentences = []
+        for content in sample.infilled_content:
+            infilled_sentence = sample.original_sentence.replace(
+                ' '.join(sample.target_node.content), ' '.join(content))
+            sample.infilled_sentences.append(infilled_sentence)
 
     # parse infilled sentences with berkeley parser
-    with tqdm.tqdm(total=len(tree_list)) as pbar:
+    with tqdm.tqdm(total=len(sample_list)) as pbar:
         pbar.set_description('Parsing infilled sentences with Berkeley Parser')
-        for tree in tree_list:
-            doc = berkeley_parser(tree.original_sentence)
+        for sample in sample_list:
+            doc = berkeley_parser(sample.original_sentence)
             sent = list(doc.sents)[0]
-            tree.original_tree = sent
-            tree.infilled_trees = []
-            for infilled_sentence in tree.infilled_sentences:
+            sample.original_tree = sent
+            sample.infilled_trees = []
+            for infilled_sentence in sample.infilled_sentences:
                 doc = berkeley_parser(infilled_sentence)
                 sent = list(doc.sents)[0]
-                tree.infilled_trees.append(sent)
+                sample.infilled_trees.append(sent)
             pbar.update(1)
 
     # extract non-terminal symbols of infilled phrases
-    for tree in tree_list:
-        target_phrase = ' '.join(tree.replace_target_node.content)
-        tree.replace_target_node.original_symbol = None
-        for constituent in tree.original_tree._.constituents:
+    for sample in sample_list:
+        target_phrase = ' '.join(sample.target_node.content)
+        sample.original_symbol = None
+        for constituent in sample.original_tree._.constituents:
             if constituent.text == target_phrase:
-                tree.replace_target_node.original_symbol = str(constituent._.labels[0])
-        tree.replace_target_node.infilled_symbols = []
-        for target_phrase, infilled_tree in zip(tree.replace_target_node.infilled_content, tree.infilled_trees):
+                sample.original_symbol = str(constituent._.labels[0])
+        sample.infilled_symbols = []
+        for target_phrase, infilled_tree in zip(sample.infilled_content, sample.infilled_trees):
             target_phrase = ' '.join(target_phrase)
             infilled_symbol = None
             for constituent in infilled_tree._.constituents:
                 if constituent.text == target_phrase:
                     infilled_symbol = str(constituent._.labels[0])
                     break
-            tree.replace_target_node.infilled_symbols.append(infilled_symbol)
+            sample.infilled_symbols.append(infilled_symbol)
 
     # calculate match rate between original symbols and infilled symbols
     num_match = 0
     num_umatch = 0
-    for tree in tree_list:
-        if tree.replace_target_node.original_symbol is None:
+    for sample in sample_list:
+        if sample.original_symbol is None:
             continue
         else:
-            for infilled_symbol in tree.replace_target_node.infilled_symbols:
-                if infilled_symbol == tree.replace_target_node.original_symbol:
+            for infilled_symbol in sample.infilled_symbols:
+                if infilled_symbol == sample.original_symbol:
                     num_match += 1
                 else:
                     num_umatch += 1
@@ -161,10 +219,10 @@ def infilling_with_holccg(args, berkeley_parser):
     print('num umatch: {}'.format(num_umatch))
     print('match rate: {:.2f}%'.format(match_rate * 100))
 
-    return tree_list
+    return sample_list
 
 
-def infilling_with_roberta(args, berkeley_parser, tree_list):
+def infilling_with_roberta(args, berkeley_parser, sample_list):
     state_dict = torch.load(args.path_to_roberta)
     tokenizer = RobertaTokenizer.from_pretrained('roberta-large')
     model = RobertaForMaskedLM.from_pretrained('roberta-large')
@@ -172,11 +230,11 @@ def infilling_with_roberta(args, berkeley_parser, tree_list):
     model.to(args.device)
 
     # infilling with roberta
-    with tqdm.tqdm(total=len(tree_list)) as pbar:
+    with tqdm.tqdm(total=len(sample_list)) as pbar:
         pbar.set_description('Infilling with RoBERTa')
-        for tree in tree_list:
-            original_sentence = tree.original_sentence
-            target_phrase = ' '.join(tree.replace_target_node.content)
+        for sample in sample_list:
+            original_sentence = sample.original_sentence
+            target_phrase = ' '.join(sample.target_node.content)
             tokenized_target_phrase = tokenizer.tokenize(target_phrase)
             mask_tokens = ''.join([tokenizer.mask_token] * len(tokenized_target_phrase))
             masked_sentence = original_sentence.replace(target_phrase, mask_tokens)
@@ -196,39 +254,39 @@ def infilling_with_roberta(args, berkeley_parser, tree_list):
                 predicted_tokens.append(predicted_token)
                 # replace input_ids with the predicted token
                 input_ids[0, masked_index] = predicted_index
-            tree.roberta_infilled_sentence = tokenizer.decode(input_ids[0, 1:-1])
+            sample.roberta_infilled_sentence = tokenizer.decode(input_ids[0, 1:-1])
             infilled_phrase = tokenizer.convert_tokens_to_string(predicted_tokens).strip()
-            tree.replace_target_node.roberta_infilled_phrase = infilled_phrase
+            sample.roberta_infilled_phrase = infilled_phrase
             pbar.update(1)
 
     # parse infilled sentences with berkeley parser
-    with tqdm.tqdm(total=len(tree_list)) as pbar:
+    with tqdm.tqdm(total=len(sample_list)) as pbar:
         pbar.set_description('Parsing infilled sentences with Berkeley Parser')
-        for tree in tree_list:
-            doc = berkeley_parser(tree.roberta_infilled_sentence)
+        for sample in sample_list:
+            doc = berkeley_parser(sample.roberta_infilled_sentence)
             sent = list(doc.sents)[0]
-            tree.roberta_infilled_tree = sent
+            sample.roberta_infilled_tree = sent
             pbar.update(1)
 
     # extract non-terminal symbols of infilled phrases
-    for tree in tree_list:
-        target_phrase = tree.replace_target_node.roberta_infilled_phrase
+    for sample in sample_list:
+        target_phrase = sample.roberta_infilled_phrase
         infilled_symbol = None
-        for constituent in tree.roberta_infilled_tree._.constituents:
+        for constituent in sample.roberta_infilled_tree._.constituents:
             if constituent.text == target_phrase:
                 if len(constituent._.labels) > 0:
                     infilled_symbol = str(constituent._.labels[0])
                     break
-        tree.replace_target_node.roberta_infilled_symbol = infilled_symbol
+        sample.roberta_infilled_symbol = infilled_symbol
 
     # calculate match rate between original symbols and infilled symbols
     num_match = 0
     num_umatch = 0
-    for tree in tree_list:
-        if tree.replace_target_node.original_symbol is None:
+    for sample in sample_list:
+        if sample.original_symbol is None:
             continue
         else:
-            if tree.replace_target_node.roberta_infilled_symbol == tree.replace_target_node.original_symbol:
+            if sample.roberta_infilled_symbol == sample.original_symbol:
                 num_match += 1
             else:
                 num_umatch += 1
@@ -241,8 +299,8 @@ def infilling_with_roberta(args, berkeley_parser, tree_list):
 def main():
     args = arg_parse()
     berkeley_parser = initialize_berkeley_parser()
-    tree_list = infilling_with_holccg(args, berkeley_parser)
-    infilling_with_roberta(args, berkeley_parser, tree_list)
+    sample_list = infilling_with_holccg(args, berkeley_parser)
+    infilling_with_roberta(args, berkeley_parser, sample_list)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,62 @@
+import gc
+import time
+import argparse
+import tracemalloc
+from tree_store import open_tree_list
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--path_to_tree_list', type=str, default='../dataset/tree_list/', help='path to tree list directory')
+    parser.add_argument('--split', type=str, default='train', help='split to be measured')
+    args = parser.parse_args()
+    return args
+
+
+def measure_tree_list(path_to_tree_list: str, split: str) -> dict:
+    """measure memory allocated for the trees of a split held in memory
+
+    The trees of tree store are materialized so that the result is comparable with pickled tree list.
+
+    Parameters
+    ----------
+    path_to_tree_list : str
+        path to tree list directory
+    split : str
+        'train' or 'dev' or 'test'
+
+    Returns
+    -------
+    dict
+        number of trees and nodes, allocated memory in bytes and elapsed time in seconds
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    tree_list = open_tree_list(path_to_tree_list, split)
+    trees = list(tree_list.tree_list)
+    elapsed_time = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'num_tree': len(trees),
+        'num_node': sum(len(tree.node_list) for tree in trees),
+        'current': current,
+        'peak': peak,
+        'time': elapsed_time}
+
+
+def main():
+    args = arg_parse()
+    stat = measure_tree_list(args.path_to_tree_list, args.split)
+    print('trees: {}'.format(stat['num_tree']))
+    print('nodes: {}'.format(stat['num_node']))
+    print('memory: {:.1f} MB (peak {:.1f} MB)'.format(stat['current'] / 2**20, stat['peak'] / 2**20))
+    print('memory per node: {:.0f} bytes'.format(stat['current'] / stat['num_node']))
+    print('loading time: {:.2f} s'.format(stat['time']))
+
+
+if __name__ == "__main__":
+    main()
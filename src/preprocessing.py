@@ -1,6 +1,7 @@
 import os
 from typing import Tuple
 from tree import TreeList
+from tree_store import TreeStore
 from utils import dump
 
 
@@ -342,9 +343,9 @@ def main():
     dev_tree_list.convert_to_binary(type='dev')
     test_tree_list.convert_to_binary(type='test')
 
-    dump(train_tree_list, os.path.join(path_to_tree_list, 'train_tree_list.pickle'))
-    dump(dev_tree_list, os.path.join(path_to_tree_list, 'dev_tree_list.pickle'))
-    dump(test_tree_list, os.path.join(path_to_tree_list, 'test_tree_list.pickle'))
+    TreeStore.build(train_tree_list, os.path.join(path_to_tree_list, 'train_tree_store'))
+    TreeStore.build(dev_tree_list, os.path.join(path_to_tree_list, 'dev_tree_store'))
+    TreeStore.build(test_tree_list, os.path.join(path_to_tree_list, 'test_tree_store'))
     dump(word_category_vocab, os.path.join(path_to_grammar, 'word_category_vocab.pickle'))
     dump(phrase_category_vocab, os.path.join(path_to_grammar, 'phrase_category_vocab.pickle'))
     dump(head_info, os.path.join(path_to_grammar, 'head_info.pickle'))
@@ -1,10 +1,11 @@
 import os
 import argparse
-from utils import load, convert_content
+from utils import load, convert_content, num_candidate, log_threshold
 import torch
-from utils import circular_correlation, circular_convolution, shuffled_circular_convolution
+from utils import to_spectrum, from_spectrum
 from torchtext.vocab import vocab
-from holccg import HolCCG
+from holccg import HolCCG, load_holccg
+from encoder_cache import EncoderCache
 from typing import List, Dict, Tuple
 
 
@@ -16,6 +17,7 @@ class Category:
             type: str,
             is_leaf: bool = False,
             vector: torch.Tensor = None,
+            spectrum: torch.Tensor = None,
             total_ll: float = None,
             cat_ll: float = None,
             span_ll: float = None,
@@ -38,6 +40,8 @@ class Category:
             whether the category is leaf or not, by default False
         vector : torch.Tensor, optional
             vector representation of the category, by default None
+        spectrum : torch.Tensor, optional
+            spectrum of the vector representation when composing in Fourier domain, by default None
         total_ll : float, optional
             total log likelihood of the category, by default None
         cat_ll : float, optional
@@ -63,6 +67,7 @@ class Category:
         self.unary_chain = cat_list[:-1]
         self.type = type
         self.vector = vector
+        self.spectrum = spectrum
         self.total_ll = total_ll
         self.cat_ll = cat_ll
         self.span_ll = span_ll
@@ -199,25 +204,71 @@ class SpanParser:
                     self.binary_rule[(key[0], key[1])].append(key[2])
                 else:
                     self.binary_rule[(key[0], key[1])] = [key[2]]
+        # possible parent categories with their ids, excluding <unk>
+        self.binary_rule_id = {}
+        for key, possible_cats in self.binary_rule.items():
+            possible_cats = [(cat, self.phrase_category_vocab[cat]) for cat in possible_cats]
+            possible_cats = [(cat, cat_id) for cat, cat_id in possible_cats if cat_id != 0]
+            if len(possible_cats) > 0:
+                self.binary_rule_id[key] = possible_cats
         self.holccg = holccg
         self.composition = holccg.composition
-        if self.composition == 's_conv':
-            self.P = holccg.P
+        self.spectral = holccg.spectral
+        if self.spectral and self.composition == 's_conv':
+            raise ValueError("'s_conv' composition cannot be computed in Fourier domain")
         self.word_classifier = holccg.word_classifier
         self.phrase_classifier = holccg.phrase_classifier
         self.span_classifier = holccg.span_classifier
+        # span and phrase classifiers are evaluated by one fused head
+        self.scoring_head = holccg.make_scoring_head()
         self.stag_threshold = stag_threshold
+        self.num_stag_candidate = num_candidate(len(self.word_category_vocab), stag_threshold)
         self.phrase_threshold = phrase_threshold
         self.span_threshold = span_threshold
+        # thresholds are compared with log likelihood, so that probabilities are not computed
+        self.log_stag_threshold = log_threshold(stag_threshold)
+        self.log_phrase_threshold = log_threshold(phrase_threshold)
+        self.log_span_threshold = log_threshold(span_threshold)
 
     @torch.no_grad()
-    def initialize_chart(self, sentence: str) -> Dict[Tuple[int, int], Cell]:
+    def predict_word(self, sentence_list: List[str]) -> List[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        """encode sentences at once and predict the top categories of their words
+
+        Parameters
+        ----------
+        sentence_list : List[str]
+            sentences to be parsed
+
+        Returns
+        -------
+        List[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]
+            word vectors, log likelihood of top categories and their ids for each sentence.
+            Only the top categories which can pass the threshold are predicted
+        """
+
+        converted_sentence_list = [[convert_content(content) for content in sentence.split()]
+                                   for sentence in sentence_list]
+        word_split = [self.holccg.set_word_split(converted_sentence)
+                      for converted_sentence in converted_sentence_list]
+        word_vectors, lengths = self.holccg.encode(
+            [" ".join(converted_sentence) for converted_sentence in converted_sentence_list], word_split)
+        word_lls, word_predict_cats = self.word_classifier.top_k(word_vectors, self.num_stag_candidate)
+        return [(word_vectors[idx, :length], word_lls[idx, :length], word_predict_cats[idx, :length])
+                for idx, length in enumerate(lengths)]
+
+    @torch.no_grad()
+    def initialize_chart(
+            self,
+            sentence: str,
+            word_prediction: Tuple[torch.Tensor, torch.Tensor, torch.Tensor] = None) -> Dict[Tuple[int, int], Cell]:
         """initialize CKY chart
 
         Parameters
         ----------
         sentence : str
             sentence to be parsed
+        word_prediction : Tuple[torch.Tensor, torch.Tensor, torch.Tensor], optional
+            output of predict_word for the sentence, by default None, in which case it is computed here
 
         Returns
         -------
@@ -225,48 +276,50 @@ class SpanParser:
             initialized CKY chart
         """
 
+        if word_prediction is None:
+            word_prediction = self.predict_word([sentence])[0]
+        word_vectors, word_lls, word_predict_cats = word_prediction
         sentence = sentence.split()
-        converted_sentence = []
-        for i in range(len(sentence)):
-            content = sentence[i]
-            converted_sentence.append(convert_content(content))
-        word_split = self.holccg.set_word_split(converted_sentence)
-        word_vectors, _ = self.holccg.encode([" ".join(converted_sentence)], [word_split])
-        word_vectors = word_vectors[0]
-        word_probs_list = torch.softmax(self.word_classifier(word_vectors), dim=-1)
-        word_predict_cats = torch.argsort(word_probs_list, descending=True)
-        word_predict_cats = word_predict_cats[word_predict_cats != 0].view(
-            word_probs_list.shape[0], -1)
+        if self.spectral:
+            word_spectra = to_spectrum(word_vectors)
+        else:
+            word_spectra = [None] * len(word_vectors)
 
         chart = {}
 
-        for idx in range(len(converted_sentence)):
+        for idx in range(len(sentence)):
             word = sentence[idx]
             vector = word_vectors[idx]
-            word_probs = word_probs_list[idx]
-            top_cat_id = word_predict_cats[idx, 0]
-            top_cat = self.word_category_vocab.get_itos()[top_cat_id]
+            spectrum = word_spectra[idx]
+            # remove '<unk>'
+            is_known = word_predict_cats[idx] != 0
+            word_ll = word_lls[idx][is_known]
+            word_predict_cat = word_predict_cats[idx][is_known]
+            top_cat = self.word_category_vocab.get_itos()[word_predict_cat[0]]
             top_category = Category(
                 cell_id=(idx, idx + 1),
                 cat=top_cat,
                 type='stag',
                 vector=vector,
-                total_ll=torch.log(word_probs[top_cat_id]),
-                cat_ll=torch.log(word_probs[top_cat_id]),
+                spectrum=spectrum,
+                total_ll=word_ll[0],
+                cat_ll=word_ll[0],
                 is_leaf=True,
                 word=word)
             chart[(idx, idx + 1)] = Cell(word)
             chart[(idx, idx + 1)].add_category(top_category)
 
-            for cat_id in word_predict_cats[idx, 1:]:
-                if word_probs[cat_id] > self.stag_threshold:
+            is_above_threshold = (word_ll[1:] > self.log_stag_threshold).tolist()
+            for cat_id, ll, is_above in zip(word_predict_cat[1:], word_ll[1:], is_above_threshold):
+                if is_above:
                     category = Category(cell_id=(idx,
                                                  idx + 1),
                                         cat=self.word_category_vocab.itos[cat_id],
                                         type='stag',
                                         vector=vector,
-                                        total_ll=torch.log(word_probs[cat_id]),
-                                        cat_ll=torch.log(word_probs[cat_id]),
+                                        spectrum=spectrum,
+                                        total_ll=ll,
+                                        cat_ll=ll,
                                         is_leaf=True,
                                         word=word)
                     chart[(idx, idx + 1)].add_category(category)
@@ -275,13 +328,18 @@ class SpanParser:
         return chart
 
     @torch.no_grad()
-    def parse(self, sentence: str) -> Dict[Tuple[int, int], Cell]:
+    def parse(
+            self,
+            sentence: str,
+            word_prediction: Tuple[torch.Tensor, torch.Tensor, torch.Tensor] = None) -> Dict[Tuple[int, int], Cell]:
         """parse sentence using span-based CKY algorithm
 
         Parameters
         ----------
         sentence : str
             sentence to be parsed
+        word_prediction : Tuple[torch.Tensor, torch.Tensor, torch.Tensor], optional
+            output of predict_word for the sentence, by default None, in which case it is computed here
 
         Returns
         -------
@@ -289,63 +347,105 @@ class SpanParser:
             parsed CKY chart
         """
 
-        chart = self.initialize_chart(sentence)
+        chart = self.initialize_chart(sentence, word_prediction)
         n = len(chart)
         for length in range(2, n + 1):
             for left in range(n - length + 1):
                 right = left + length
                 chart[(left, right)] = Cell(' '.join(sentence.split()[left:right]))
+                # collect all pairs of child categories in the cell to compose and score them at once
+                pairs = []
                 for split in range(left + 1, right):
                     for left_cat in chart[(left, split)].best_category.values():
                         for right_cat in chart[(split, right)].best_category.values():
                             # list of gramatically possible category
-                            possible_cats = self.binary_rule.get(
+                            possible_cats = self.binary_rule_id.get(
                                 (left_cat.cat, right_cat.cat))
-                            # when no binary combination is available
-                            if possible_cats is None:
-                                continue
-                            else:
-                                if self.composition == 'corr':
-                                    composed_vector = circular_correlation(
-                                        left_cat.vector, right_cat.vector, self.holccg.vector_norm)
-                                elif self.composition == 'conv':
-                                    composed_vector = circular_convolution(
-                                        left_cat.vector, right_cat.vector, self.holccg.vector_norm)
-                                elif self.composition == 's_conv':
-                                    composed_vector = shuffled_circular_convolution(
-                                        left_cat.vector, right_cat.vector, self.P, self.holccg.vector_norm)
-                                span_prob = torch.softmax(
-                                    self.span_classifier(composed_vector), dim=-1)[1]
-                                if span_prob > self.span_threshold:
-                                    span_ll = torch.log(span_prob)
-                                    phrase_probs = torch.softmax(
-                                        self.phrase_classifier(composed_vector), dim=-1)
-                                    for parent_cat in possible_cats:
-                                        parent_cat_id = self.phrase_category_vocab[parent_cat]
-                                        # when category is not <unk>
-                                        if parent_cat_id != 0:
-                                            cat_prob = phrase_probs[parent_cat_id]
-                                            if cat_prob > self.phrase_threshold:
-                                                cat_ll = torch.log(cat_prob)
-                                                total_ll = cat_ll + span_ll + left_cat.total_ll + right_cat.total_ll
-                                                head = self.head_info[(
-                                                    left_cat.cat, right_cat.cat, parent_cat.split('-->')[0])]
-                                                parent_category = Category(
-                                                    cell_id=(left, right),
-                                                    cat=parent_cat,
-                                                    type='bin',
-                                                    vector=composed_vector,
-                                                    total_ll=total_ll,
-                                                    cat_ll=cat_ll,
-                                                    span_ll=span_ll,
-                                                    num_child=2,
-                                                    left_child=left_cat,
-                                                    right_child=right_cat,
-                                                    head=head)
-                                                chart[(left, right)].add_category(
-                                                    parent_category)
+                            # when binary combination is available
+                            if possible_cats is not None:
+                                pairs.append((left_cat, right_cat, possible_cats))
+                if len(pairs) == 0:
+                    continue
+                if self.spectral:
+                    # children are kept in Fourier domain, and only the composed
+                    # vector fed into classifiers is transformed back
+                    composed_spectrum = self.holccg.compose_pair(
+                        torch.stack([pair[0].spectrum for pair in pairs]),
+                        torch.stack([pair[1].spectrum for pair in pairs]))
+                    composed_vector = from_spectrum(composed_spectrum, self.holccg.model_dim)
+                else:
+                    composed_spectrum = [None] * len(pairs)
+                    composed_vector = self.holccg.compose_pair(
+                        torch.stack([pair[0].vector for pair in pairs]),
+                        torch.stack([pair[1].vector for pair in pairs]))
+                span_ll_list, cat_ll_list = self.score(composed_vector, [pair[2] for pair in pairs])
+                for idx, (left_cat, right_cat, possible_cats) in enumerate(pairs):
+                    span_ll = span_ll_list[idx]
+                    if span_ll is None:
+                        continue
+                    for (parent_cat, _), cat_ll in zip(possible_cats, cat_ll_list[idx]):
+                        if cat_ll is None:
+                            continue
+                        total_ll = cat_ll + span_ll + left_cat.total_ll + right_cat.total_ll
+                        head = self.head_info[(
+                            left_cat.cat, right_cat.cat, parent_cat.split('-->')[0])]
+                        parent_category = Category(
+                            cell_id=(left, right),
+                            cat=parent_cat,
+                            type='bin',
+                            vector=composed_vector[idx],
+                            spectrum=composed_spectrum[idx],
+                            total_ll=total_ll,
+                            cat_ll=cat_ll,
+                            span_ll=span_ll,
+                            num_child=2,
+                            left_child=left_cat,
+                            right_child=right_cat,
+                            head=head)
+                        chart[(left, right)].add_category(
+                            parent_category)
         return chart
 
+    @torch.no_grad()
+    def score(self, composed_vector: torch.Tensor, possible_cats_list: List[List[Tuple[str, int]]]) -> Tuple[list, list]:
+        """score the existence of span and the possible parent categories of composed vectors
+
+        Parameters
+        ----------
+        composed_vector : torch.Tensor
+            composed vectors of shape (num_pair, model_dim)
+        possible_cats_list : List[List[Tuple[str, int]]]
+            possible parent categories and their ids for each composed vector
+
+        Returns
+        -------
+        Tuple[list, list]
+            log likelihood of span existence, and that of each possible parent category.
+            None is set when the probability is not above the threshold
+        """
+
+        hidden = self.scoring_head(composed_vector)
+        span_ll = self.scoring_head.log_prob(hidden, 0)[:, 1]
+        span_ll_list = [ll if is_above else None
+                        for ll, is_above in zip(span_ll, (span_ll > self.log_span_threshold).tolist())]
+        cat_ll_list = [[None] * len(possible_cats) for possible_cats in possible_cats_list]
+        # phrase category is scored only for the candidates of spans passing the threshold
+        row = [idx for idx in range(len(span_ll_list)) if span_ll_list[idx] is not None]
+        if len(row) == 0:
+            return span_ll_list, cat_ll_list
+        max_num_cat = max([len(possible_cats_list[idx]) for idx in row])
+        ids = torch.zeros((len(row), max_num_cat), dtype=torch.long, device=composed_vector.device)
+        for i, idx in enumerate(row):
+            ids[i, :len(possible_cats_list[idx])] = torch.tensor(
+                [cat_id for _, cat_id in possible_cats_list[idx]], device=composed_vector.device)
+        cat_ll = self.scoring_head.log_prob(hidden[row], 1, ids)
+        is_above_threshold = (cat_ll > self.log_phrase_threshold).tolist()
+        for i, idx in enumerate(row):
+            for j in range(len(possible_cats_list[idx])):
+                if is_above_threshold[i][j]:
+                    cat_ll_list[idx][j] = cat_ll[i, j]
+        return span_ll_list, cat_ll_list
+
     def skimmer(self, chart: Dict[Tuple[int, int], Cell]) -> Tuple[str, Tuple[int, int]]:
         """apply skimmer mode to chart. find successfully parsed subspans.
 
@@ -512,6 +612,56 @@ class SpanParser:
         return auto
 
 
+def format_parse(
+        parser: SpanParser,
+        chart: Dict[Tuple[int, int], Cell],
+        sentence: str,
+        sentence_id: int,
+        skimmer: bool) -> List[str]:
+    """format parsed CKY chart as the lines of auto file
+
+    Parameters
+    ----------
+    parser : SpanParser
+        span parser which parsed the chart
+    chart : Dict[Tuple[int, int], Cell]
+        parsed CKY chart
+    sentence : str
+        parsed sentence
+    sentence_id : int
+        id of sentence starting from 1
+    skimmer : bool
+        whether to output successfully parsed subspans when parsing is failed
+
+    Returns
+    -------
+    List[str]
+        header and derivation lines
+    """
+    lines = []
+    root_cell = list(chart.values())[-1]
+    # when parsing is failed
+    if len(root_cell.best_category) == 0:
+        if skimmer:
+            autos, scope_list = parser.skimmer(chart)
+            n = 0
+            for auto, scope in zip(autos, scope_list):
+                lines.append(
+                    'ID={}.{} PARSER=TEST APPLY_SKIMMER=True SCOPE=({},{})'.format(
+                        sentence_id, n, scope[0], scope[1]))
+                lines.append(auto)
+                n += 1
+        else:
+            lines.append('ID={} PARSER=TEST APPLY_SKIMMER=False'.format(sentence_id))
+            lines.append('(<L fail POS POS {} fail>)'.format('_'.join(sentence.split())))
+    # when parsing is succesful
+    else:
+        auto = parser.decode(root_cell)
+        lines.append('ID={} PARSER=TEST APPLY_SKIMMER=FALSE'.format(sentence_id))
+        lines.append(auto)
+    return lines
+
+
 def arg_parse():
     parser = argparse.ArgumentParser()
     parser.add_argument('--path_to_sentence', type=str, help='path to sentence to be supertagged')
@@ -522,6 +672,43 @@ def arg_parse():
     parser.add_argument('--span_threshold', type=float, default=0.01, help='threshold for span')
     parser.add_argument('--min_freq', type=int, default=1, help='minimum frequency of combinatory rule to be used')
     parser.add_argument('--skimmer', action='store_true', help='use skimmer')
+    parser.add_argument('--spectral', action='store_true', help='compose vectors in Fourier domain')
+    parser.add_argument(
+        '--num_encoder_layers',
+        type=int,
+        default=None,
+        help='number of encoder layers to use from the bottom')
+    parser.add_argument(
+        '--early_exit_threshold',
+        type=float,
+        default=None,
+        help='stop encoding at the layer where the word classifier is confident for all words')
+    parser.add_argument(
+        '--window_size',
+        type=int,
+        default=None,
+        help='number of tokens in each window to encode sentences longer than it by overlapping windows')
+    parser.add_argument(
+        '--window_stride',
+        type=int,
+        default=None,
+        help='number of subwords between the starts of adjacent windows, by default the half of window')
+    parser.add_argument(
+        '--path_to_encoder_cache',
+        type=str,
+        default=None,
+        help='directory to cache word vectors of sentences, which are reused by later runs with the same model')
+    parser.add_argument(
+        '--quantize',
+        type=str,
+        default='none',
+        choices=['none', 'int8'],
+        help='apply dynamic quantization to linear layers (int8 is available only on cpu)')
+    parser.add_argument(
+        '--path_to_save_quantized_model',
+        type=str,
+        default=None,
+        help='path to save the quantized model, which can be loaded by --path_to_model')
     parser.add_argument(
         '--device',
         type=torch.device,
@@ -542,9 +729,17 @@ def main():
     with open(args.path_to_sentence, 'r') as f:
         sentence_list = f.readlines()
 
-    holccg = torch.load(args.path_to_model, map_location=args.device)
-    holccg.device = args.device
-    holccg.eval()
+    holccg = load_holccg(args.path_to_model, args.device, args.quantize)
+    if args.num_encoder_layers is not None:
+        holccg.num_encoder_layers = args.num_encoder_layers
+    holccg.early_exit_threshold = args.early_exit_threshold
+    holccg.window_size = args.window_size
+    holccg.window_stride = args.window_stride
+    holccg.spectral = args.spectral
+    if args.path_to_save_quantized_model is not None:
+        torch.save(holccg, args.path_to_save_quantized_model)
+    if args.path_to_encoder_cache is not None:
+        holccg.encoder_cache = EncoderCache(args.path_to_encoder_cache)
 
     parser = SpanParser(
         word_category_vocab=word_category_vocab,
@@ -562,26 +757,10 @@ def main():
         sentence_id += 1
         sentence = sentence.rstrip()
         chart = parser.parse(sentence)
-        root_cell = list(chart.values())[-1]
-        # when parsing is failed
-        if len(root_cell.best_category) == 0:
-            if args.skimmer:
-                autos, scope_list = parser.skimmer(chart)
-                n = 0
-                for auto, scope in zip(autos, scope_list):
-                    print(
-                        'ID={}.{} PARSER=TEST APPLY_SKIMMER=True SCOPE=({},{})'.format(
-                            sentence_id, n, scope[0], scope[1]))
-                    print(auto)
-                    n += 1
-            else:
-                print('ID={} PARSER=TEST APPLY_SKIMMER=False'.format(sentence_id))
-                print('(<L fail POS POS {} fail>)'.format('_'.join(sentence.split())))
-        # when parsing is succesful
-        else:
-            auto = parser.decode(root_cell)
-            print('ID={} PARSER=TEST APPLY_SKIMMER=FALSE'.format(sentence_id))
-            print(auto)
+        for line in format_parse(parser, chart, sentence, sentence_id, args.skimmer):
+            print(line)
+    if holccg.encoder_cache is not None:
+        holccg.encoder_cache.flush()
 
 
 if __name__ == "__main__":
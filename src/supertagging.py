@@ -1,7 +1,10 @@
-from utils import load
+from utils import load, num_candidate
+from holccg import load_holccg
+from encoder_cache import EncoderCache
 import torch
 import argparse
 import os
+from typing import List
 
 
 def arg_parse():
@@ -12,6 +15,48 @@ def arg_parse():
     parser.add_argument('--path_to_dataset', type=str, default='../dataset/', help='path to dataset')
     parser.add_argument('--stag_threshold', type=float, default=0.1, help='threshold for supertagging')
     parser.add_argument('--print_probability', action='store_true', help='print probability of supertags')
+    parser.add_argument(
+        '--num_encoder_layers',
+        type=int,
+        default=None,
+        help='number of encoder layers to use from the bottom')
+    parser.add_argument(
+        '--early_exit_threshold',
+        type=float,
+        default=None,
+        help='stop encoding at the layer where the word classifier is confident for all words')
+    parser.add_argument(
+        '--window_size',
+        type=int,
+        default=None,
+        help='number of tokens in each window to encode sentences longer than it by overlapping windows')
+    parser.add_argument(
+        '--window_stride',
+        type=int,
+        default=None,
+        help='number of subwords between the starts of adjacent windows, by default the half of window')
+    parser.add_argument('--batch_size', type=int, default=1, help='number of sentences encoded at once')
+    parser.add_argument(
+        '--pack_size',
+        type=int,
+        default=None,
+        help='number of tokens in each encoder sequence into which the sentences of a batch are packed')
+    parser.add_argument(
+        '--path_to_encoder_cache',
+        type=str,
+        default=None,
+        help='directory to cache word vectors of sentences, which are reused by later runs with the same model')
+    parser.add_argument(
+        '--quantize',
+        type=str,
+        default='none',
+        choices=['none', 'int8'],
+        help='apply dynamic quantization to linear layers (int8 is available only on cpu)')
+    parser.add_argument(
+        '--path_to_save_quantized_model',
+        type=str,
+        default=None,
+        help='path to save the quantized model, which can be loaded by --path_to_model')
     parser.add_argument(
         '--device',
         type=torch.device,
@@ -63,74 +108,156 @@ def convert_slash(content: str) -> str:
     return content
 
 
+def load_pos(path_to_pos: str, sentence_list: List[str]) -> List[List[str]]:
+    """load POS tags of sentences
+
+    Parameters
+    ----------
+    path_to_pos : str
+        path to pos tagged file, whose tokens are in the format of word|POS, or None
+    sentence_list : List[str]
+        sentences to be supertagged
+
+    Returns
+    -------
+    List[List[str]]
+        POS tags of each sentence, which are 'POS' when path_to_pos is None
+    """
+    if path_to_pos is None:
+        # make the same shape POS list as sentence_list
+        return [['POS'] * len(sentence.split()) for sentence in sentence_list]
+    with open(path_to_pos, "r") as f:
+        return [[token.split('|')[1] for token in line.strip().split()] for line in f.readlines()]
+
+
+def select_supertags(
+        word_cat_ll: torch.Tensor,
+        predict_cat_id: torch.Tensor,
+        word_category_vocab,
+        stag_threshold: float) -> List[List[list]]:
+    """select the top category and the categories above threshold for each word
+
+    Parameters
+    ----------
+    word_cat_ll : torch.Tensor
+        log likelihood of top categories of each word in descending order
+    predict_cat_id : torch.Tensor
+        ids of top categories of each word
+    word_category_vocab
+        vocab of word category
+    stag_threshold : float
+        threshold for supertagging
+
+    Returns
+    -------
+    List[List[list]]
+        pairs of supertag and its probability for each word
+    """
+    word_cat_prob = torch.exp(word_cat_ll)
+    super_tags = []
+    for idx in range(word_cat_prob.shape[0]):
+        # remove '<unk>'
+        is_known = predict_cat_id[idx] != 0
+        cat_prob = word_cat_prob[idx][is_known].tolist()
+        cat_id = predict_cat_id[idx][is_known].tolist()
+        # add top probability category
+        temp = [[word_category_vocab.get_itos()[cat_id[0]].split('-->')[0], cat_prob[0]]]
+        for id, prob in zip(cat_id[1:], cat_prob[1:]):
+            if prob > stag_threshold:
+                temp.append([word_category_vocab.get_itos()[id].split('-->')[0], prob])
+            else:
+                break
+        super_tags.append(temp)
+    return super_tags
+
+
+def format_supertags(words: List[str], pos_tags: List[str], super_tags: List[List[list]], print_probability: bool) -> str:
+    """format supertags of a sentence as a line of word|POS|supertag...
+
+    Parameters
+    ----------
+    words : List[str]
+        words of sentence
+    pos_tags : List[str]
+        POS tags of words
+    super_tags : List[List[list]]
+        pairs of supertag and its probability for each word
+    print_probability : bool
+        whether to print probability after each supertag
+
+    Returns
+    -------
+    str
+        formatted line
+    """
+    line = []
+    for word, pos, super in zip(words, pos_tags, super_tags):
+        temp = []
+        temp.append(word)
+        temp.append(pos)
+        for info in super:
+            temp.append(info[0])
+            if print_probability:
+                temp.append(str(info[1]))
+        line.append('|'.join(temp))
+    return ' '.join(line)
+
+
 def main():
     args = arg_parse()
 
     word_category_vocab = load(os.path.join(args.path_to_dataset, "grammar/word_category_vocab.pickle"))
 
-    holccg = torch.load(args.path_to_model, map_location=args.device)
-    holccg.device = args.device
-    holccg.eval()
+    holccg = load_holccg(args.path_to_model, args.device, args.quantize)
+    if args.num_encoder_layers is not None:
+        holccg.num_encoder_layers = args.num_encoder_layers
+    holccg.early_exit_threshold = args.early_exit_threshold
+    holccg.window_size = args.window_size
+    holccg.window_stride = args.window_stride
+    holccg.pack_size = args.pack_size
+    if args.path_to_save_quantized_model is not None:
+        torch.save(holccg, args.path_to_save_quantized_model)
+    if args.path_to_encoder_cache is not None:
+        holccg.encoder_cache = EncoderCache(args.path_to_encoder_cache)
 
     word_classifier = holccg.word_classifier
+    num_stag_candidate = num_candidate(len(word_category_vocab), args.stag_threshold)
 
     with open(args.path_to_sentence, "r") as f:
         sentence_list = f.readlines()
-    if args.path_to_pos is None:
-        # make the same shape POS list as sentence_list
-        pos_list = []
-        for sentence in sentence_list:
-            pos_list.append(['POS'] * len(sentence.split()))
-    else:
-        pos_list = []
-        with open(args.path_to_pos, "r") as f:
-            lines = f.readlines()
-            for pos in lines:
-                pos_tags = []
-                pos = pos.strip().split()
-                pos_tags.append(pos.split('|')[1])
-            pos_list.append(pos_tags)
+    pos_list = load_pos(args.path_to_pos, sentence_list)
 
     with torch.no_grad():
-        for sentence, pos_tags in zip(sentence_list, pos_list):
-            sentence = sentence.split()
-            converted_sentence_for_supertagging = []
-            converted_sentence_for_print = []
-            for i in range(len(sentence)):
-                content = sentence[i]
-                converted_sentence_for_supertagging.append(convert_slash(convert_bracket(content)))
-                converted_sentence_for_print.append(convert_bracket(content))
-            word_split = holccg.set_word_split(converted_sentence_for_supertagging)
-            word_vectors, _ = holccg.encode([" ".join(converted_sentence_for_supertagging)], [word_split])
-            word_cat_prob = torch.softmax(word_classifier(word_vectors[0]), dim=-1)
-            predict_cat_id = torch.argsort(word_cat_prob, descending=True)
-            # remove '<unk>'
-            predict_cat_id = predict_cat_id[predict_cat_id != 0].view(word_cat_prob.shape[0], -1)
-            super_tags = []
-            for idx in range(word_cat_prob.shape[0]):
-                # add top probability category
-                temp = [[word_category_vocab.get_itos()[predict_cat_id[idx, 0]].split('-->')[0],
-                        word_cat_prob[idx, predict_cat_id[idx, 0]].item()]]
-                for cat_id in predict_cat_id[idx, 1:]:
-                    if word_cat_prob[idx, cat_id] > args.stag_threshold:
-                        temp.append([word_category_vocab.get_itos()[cat_id].split('-->')[0],
-                                    word_cat_prob[idx, cat_id].item()])
-                    else:
-                        break
-                super_tags.append(temp)
-
-            line = []
-            for word, pos, super in zip(converted_sentence_for_print, pos_tags, super_tags):
-                temp = []
-                temp.append(word)
-                temp.append(pos)
-                for info in super:
-                    temp.append(info[0])
-                    if args.print_probability:
-                        temp.append(str(info[1]))
-                line.append('|'.join(temp))
-            print(' '.join(line))
-
+        for batch_start in range(0, len(sentence_list), args.batch_size):
+            converted_sentence_for_supertagging_list = []
+            converted_sentence_for_print_list = []
+            for sentence in sentence_list[batch_start:batch_start + args.batch_size]:
+                sentence = sentence.split()
+                converted_sentence_for_supertagging = []
+                converted_sentence_for_print = []
+                for i in range(len(sentence)):
+                    content = sentence[i]
+                    converted_sentence_for_supertagging.append(convert_slash(convert_bracket(content)))
+                    converted_sentence_for_print.append(convert_bracket(content))
+                converted_sentence_for_supertagging_list.append(converted_sentence_for_supertagging)
+                converted_sentence_for_print_list.append(converted_sentence_for_print)
+            word_split = [holccg.set_word_split(converted_sentence_for_supertagging)
+                          for converted_sentence_for_supertagging in converted_sentence_for_supertagging_list]
+            word_vectors_list, lengths = holccg.encode(
+                [" ".join(converted_sentence_for_supertagging)
+                 for converted_sentence_for_supertagging in converted_sentence_for_supertagging_list],
+                word_split)
+            for converted_sentence_for_print, pos_tags, word_vectors, length in zip(
+                    converted_sentence_for_print_list,
+                    pos_list[batch_start:batch_start + args.batch_size],
+                    word_vectors_list,
+                    lengths):
+                # only the top categories which can pass the threshold are predicted
+                word_cat_ll, predict_cat_id = word_classifier.top_k(word_vectors[:length], num_stag_candidate)
+                super_tags = select_supertags(word_cat_ll, predict_cat_id, word_category_vocab, args.stag_threshold)
+                print(format_supertags(converted_sentence_for_print, pos_tags, super_tags, args.print_probability))
+    if holccg.encoder_cache is not None:
+        holccg.encoder_cache.flush()
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,17 @@
 import os
-from utils import load
+import numpy as np
+from tree_store import open_tree_list
 from evaluation_functions import evaluate_stag, evaluate_batch_list
 import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.cuda.amp import autocast, GradScaler
-from tree import Tree
+from tree import Tree, TreeList
 from holccg import HolCCG
+from distillation import TeacherCache, distillation_loss
+from batch_loader import BatchLoader
 from tqdm import tqdm
-from transformers import RobertaTokenizer, RobertaModel, BertTokenizer, BertModel
+from transformers import RobertaTokenizerFast, RobertaModel, BertTokenizerFast, BertModel
 import wandb
 import datetime
 import argparse
@@ -28,10 +31,19 @@ def arg_parse():
             'bert-base-cased',
             'bert-large-cased',
             'roberta-base',
-            'roberta-large'
+            'roberta-large',
+            'distilroberta-base',
+            'google/bert_uncased_L-4_H-256_A-4',
+            'google/bert_uncased_L-4_H-512_A-8',
+            'google/bert_uncased_L-8_H-512_A-8'
         ],
         type=str,
         default='roberta-base', help='pretrained text encoder')
+    parser.add_argument(
+        '--model_dim',
+        type=int,
+        default=None,
+        help='dimension of HolCCG representation, by default the hidden size of encoder')
     parser.add_argument('--phrase_loss_weight', type=float, default=1.0, help='weight of phrase loss')
     parser.add_argument('--span_loss_weight', type=float, default=1.0, help='weight of span loss')
     parser.add_argument('--normalize', choices=['real', 'complex'], default='real', help='normalize type')
@@ -46,6 +58,21 @@ def arg_parse():
     parser.add_argument('--max_norm', type=float, default=30.0, help='max norm of vector')
     parser.add_argument('--epochs', type=int, default=10, help='number of epochs')
     parser.add_argument('--batch_size', type=int, default=16, help='batch size')
+    parser.add_argument(
+        '--num_prefetch',
+        type=int,
+        default=2,
+        help='number of training batches collated in background ahead of the batch being trained')
+    parser.add_argument(
+        '--max_num_token',
+        type=int,
+        default=None,
+        help='maximum number of padded subword tokens in a batch, which packs batches from trees sorted by length')
+    parser.add_argument(
+        '--max_num_composition',
+        type=int,
+        default=None,
+        help='maximum number of padded composition steps in a batch, which packs batches from trees sorted by length')
     parser.add_argument('--base_lr', type=float, default=1e-4, help='base learning rate')
     parser.add_argument('--ft_lr', type=float, default=1e-5, help='fine-tuning learning rate')
     parser.add_argument('--dropout', type=float, default=0.2, help='dropout rate')
@@ -54,6 +81,51 @@ def arg_parse():
         type=str,
         default='cuda',
         help='device to use for training (cpu or cuda)')
+    parser.add_argument(
+        '--memory_efficient_composition',
+        action='store_true',
+        help='recompute composed vectors in backward pass to save activation memory')
+    parser.add_argument('--spectral', action='store_true', help='compose vectors in Fourier domain')
+    parser.add_argument(
+        '--path_to_pretrained_model',
+        type=str,
+        default=None,
+        help='path to trained checkpoint to start from, instead of building a new model')
+    parser.add_argument(
+        '--num_encoder_layers',
+        type=int,
+        default=None,
+        help='number of encoder layers to use from the bottom')
+    parser.add_argument(
+        '--freeze_encoder',
+        action='store_true',
+        help='train only linear layer and classifiers, e.g. to adapt them to truncated encoder')
+    parser.add_argument(
+        '--path_to_teacher_model',
+        type=str,
+        default=None,
+        help='path to trained checkpoint used as teacher for knowledge distillation')
+    parser.add_argument(
+        '--path_to_teacher_cache',
+        type=str,
+        default='../dataset/teacher_cache/',
+        help='directory to cache teacher outputs, which are reused when they exist')
+    parser.add_argument('--distillation_top_k', type=int, default=8, help='number of top categories of teacher')
+    parser.add_argument('--distillation_temperature', type=float, default=2.0, help='temperature of softmax')
+    parser.add_argument(
+        '--distillation_weight',
+        type=float,
+        default=0.5,
+        help='weight of loss against teacher, where the loss against gold labels has the rest of weight')
+    parser.add_argument(
+        '--vector_loss_weight',
+        type=float,
+        default=0.0,
+        help='weight of cosine distance to teacher node vectors, which requires the same model_dim')
+    parser.add_argument(
+        '--adaptive_softmax',
+        action='store_true',
+        help='use frequency-aware adaptive output layer for word and phrase classifiers')
     parser.add_argument('--wandb', action='store_true', help='use wandb for logging')
 
     args = parser.parse_args()
@@ -74,8 +146,8 @@ def load_tree_list(path_to_tree_list: str) -> Tuple[List[Tree], List[Tree]]:
         train tree list and dev tree list
     """
     print('Loading tree list...')
-    train_tree_list = load(os.path.join(path_to_tree_list, 'train_tree_list.pickle'))
-    dev_tree_list = load(os.path.join(path_to_tree_list, 'dev_tree_list.pickle'))
+    train_tree_list = open_tree_list(path_to_tree_list, 'train')
+    dev_tree_list = open_tree_list(path_to_tree_list, 'dev')
     return train_tree_list, dev_tree_list
 
 
@@ -90,22 +162,91 @@ def build_encoder_and_tokenizer(encoder_name: str) -> Tuple[nn.Module, nn.Module
     Returns
     -------
     Tuple[nn.Module, nn.Module, int]
-        pretrained text encoder, tokenizer, and model dimension
+        pretrained text encoder, tokenizer, and the dimension of encoder's hidden state
     """
     print(f"Loading pretrained {encoder_name} encoder...")
     if 'roberta' in encoder_name:
         encoder = RobertaModel.from_pretrained(encoder_name)
-        tokenizer = RobertaTokenizer.from_pretrained(encoder_name)
+        tokenizer = RobertaTokenizerFast.from_pretrained(encoder_name)
     elif 'bert' in encoder_name:
         encoder = BertModel.from_pretrained(encoder_name)
-        tokenizer = BertTokenizer.from_pretrained(encoder_name)
+        tokenizer = BertTokenizerFast.from_pretrained(encoder_name)
 
-    if 'base' in encoder_name:
-        model_dim = 768
-    elif 'large' in encoder_name:
-        model_dim = 1024
+    encoder_dim = encoder.config.hidden_size
     encoder.gradient_checkpointing_enable()
-    return encoder, tokenizer, model_dim
+    return encoder, tokenizer, encoder_dim
+
+
+def prepare_teacher_cache(args, train_tree_list, model_dim: int) -> TeacherCache:
+    """Load the cached teacher outputs, or compute them by the teacher when not cached.
+
+    Parameters
+    ----------
+    args
+        command line arguments
+    train_tree_list : TreeList
+        training trees, whose info for training is overwritten when the teacher is run
+    model_dim : int
+        dimension of student representation
+
+    Returns
+    -------
+    TeacherCache
+        teacher outputs for training trees
+    """
+    save_vector = args.vector_loss_weight > 0.0
+    if os.path.exists(os.path.join(args.path_to_teacher_cache, 'meta.json')):
+        teacher_cache = TeacherCache(args.path_to_teacher_cache)
+        teacher_cache.validate(
+            len(train_tree_list.tree_list),
+            args.path_to_teacher_model,
+            args.distillation_top_k,
+            save_vector,
+            model_dim)
+        return teacher_cache
+    teacher = HolCCG.from_checkpoint(args.path_to_teacher_model, args.device)
+    if save_vector and teacher.model_dim != model_dim:
+        raise ValueError('node vectors can be distilled only when teacher and student have the same model_dim')
+    with torch.no_grad():
+        train_tree_list.set_info_for_training(teacher.tokenizer)
+    teacher_cache = TeacherCache.build(
+        teacher,
+        train_tree_list,
+        args.path_to_teacher_cache,
+        args.distillation_top_k,
+        args.batch_size,
+        save_vector=save_vector,
+        path_to_teacher=args.path_to_teacher_model)
+    del teacher
+    torch.cuda.empty_cache()
+    return teacher_cache
+
+
+def make_batch_loader(tree_list: TreeList, args, shuffle: bool = True) -> BatchLoader:
+    """Make batch loader with the batch size and budgets of command line arguments
+
+    Parameters
+    ----------
+    tree_list : TreeList
+        tree list whose info for training is set
+    args
+        command line arguments
+    shuffle : bool, optional
+        whether to shuffle batches for training, by default True. Otherwise batches are sorted by length
+
+    Returns
+    -------
+    BatchLoader
+        batch loader
+    """
+    return BatchLoader(
+        tree_list,
+        args.batch_size,
+        shuffle=shuffle,
+        num_prefetch=args.num_prefetch,
+        max_num_token=args.max_num_token,
+        max_num_composition=args.max_num_composition,
+        sort_by_length=not shuffle)
 
 
 def log_stat_to_wandb(stat: dict, prefix: str, epoch: int) -> None:
@@ -134,19 +275,62 @@ def train():
     # convert the args to dict
     hyper_params = vars(args)
 
-    trained_model_name = args.encoder + '_word'
+    if args.path_to_pretrained_model is not None:
+        # these options define the architecture, which is restored from the checkpoint instead
+        ignored_options = [
+            option for option, is_given in [
+                ('--model_dim', args.model_dim is not None),
+                ('--adaptive_softmax', args.adaptive_softmax),
+                ('--composition', args.composition != 'corr')] if is_given]
+        if len(ignored_options) > 0:
+            raise ValueError(
+                f"{', '.join(ignored_options)} cannot be used with --path_to_pretrained_model, "
+                'whose architecture is restored from the checkpoint')
+
+    if args.path_to_pretrained_model is None:
+        trained_model_name = args.encoder.split('/')[-1]
+    else:
+        trained_model_name = os.path.basename(os.path.normpath(args.path_to_pretrained_model)) + '_ft'
+    if args.num_encoder_layers is not None:
+        trained_model_name += f'_{args.num_encoder_layers}layers'
+    trained_model_name += '_word'
+    if args.path_to_teacher_model is not None:
+        trained_model_name += '_distilled'
+    if args.adaptive_softmax:
+        trained_model_name += '_adaptive'
     if args.phrase_loss_weight != 0.0:
         trained_model_name += '_phrase'
     if args.span_loss_weight != 0.0:
         trained_model_name += '_span'
     trained_model_name += '_' + str(datetime.datetime.now()).split('.')[0].replace(' ', '_')
-    trained_model_name += '.pth'
     path_to_save_trained_model = os.path.join(args.path_to_save_trained_model, trained_model_name)
 
-    encoder, tokenizer, model_dim = build_encoder_and_tokenizer(args.encoder)
+    if args.path_to_pretrained_model is None:
+        encoder, tokenizer, encoder_dim = build_encoder_and_tokenizer(args.encoder)
+        if args.model_dim is None:
+            model_dim = encoder_dim
+        else:
+            model_dim = args.model_dim
+    else:
+        kwargs = {}
+        if args.num_encoder_layers is not None:
+            kwargs['num_encoder_layers'] = args.num_encoder_layers
+        holccg = HolCCG.from_checkpoint(
+            args.path_to_pretrained_model,
+            args.device,
+            memory_efficient_composition=args.memory_efficient_composition,
+            spectral=args.spectral,
+            **kwargs)
+        tokenizer = holccg.tokenizer
+        model_dim = holccg.model_dim
 
     train_tree_list, dev_tree_list = load_tree_list(args.path_to_tree_list)
 
+    # teacher outputs are computed once before the info for training is set by student tokenizer
+    teacher_cache = None
+    if args.path_to_teacher_model is not None:
+        teacher_cache = prepare_teacher_cache(args, train_tree_list, model_dim)
+
     # set info for training
     train_tree_list.device = args.device
     dev_tree_list.device = args.device
@@ -158,30 +342,52 @@ def train():
     # these are used for building HolCCG's syntactic classifier
     num_word_cat = len(train_tree_list.word_category_vocab.get_stoi())
     num_phrase_cat = len(train_tree_list.phrase_category_vocab.get_stoi())
+    # frequent categories are scored by the head of adaptive output layer, and rare ones by its clusters
+    if args.adaptive_softmax:
+        word_category_frequency = np.bincount(
+            train_tree_list.category_id[train_tree_list.is_word], minlength=num_word_cat).tolist()
+        phrase_category_frequency = np.bincount(
+            train_tree_list.category_id[~train_tree_list.is_word], minlength=num_phrase_cat).tolist()
+    else:
+        word_category_frequency = None
+        phrase_category_frequency = None
 
     # build HolCCG
-    holccg = HolCCG(
-        num_word_cat=num_word_cat,
-        num_phrase_cat=num_phrase_cat,
-        encoder=encoder,
-        tokenizer=tokenizer,
-        model_dim=model_dim,
-        dropout=args.dropout,
-        normalize_type=args.normalize,
-        vector_norm=max_norm,
-        composition=args.composition,
-        device=args.device).to(args.device)
+    if args.path_to_pretrained_model is None:
+        holccg = HolCCG(
+            num_word_cat=num_word_cat,
+            num_phrase_cat=num_phrase_cat,
+            encoder=encoder,
+            tokenizer=tokenizer,
+            model_dim=model_dim,
+            dropout=args.dropout,
+            normalize_type=args.normalize,
+            vector_norm=max_norm,
+            composition=args.composition,
+            device=args.device,
+            memory_efficient_composition=args.memory_efficient_composition,
+            spectral=args.spectral,
+            num_encoder_layers=args.num_encoder_layers,
+            encoder_dim=encoder_dim,
+            word_category_frequency=word_category_frequency,
+            phrase_category_frequency=phrase_category_frequency).to(args.device)
     holccg.eval()
 
     criteria = nn.CrossEntropyLoss()
-    optimizer = optim.AdamW([{'params': holccg.base_params},
-                            {'params': holccg.encoder.parameters(), 'lr': args.ft_lr}], lr=args.base_lr)
+    if args.freeze_encoder:
+        holccg.encoder.requires_grad_(False)
+        optimizer = optim.AdamW(holccg.base_params, lr=args.base_lr)
+    else:
+        optimizer = optim.AdamW([{'params': holccg.base_params},
+                                {'params': holccg.encoder.parameters(), 'lr': args.ft_lr}], lr=args.base_lr)
 
     if args.wandb:
-        wandb.init(project='Hol-CCG', name=trained_model_name.replace('.pth', ''), config=hyper_params)
+        wandb.init(project='Hol-CCG', name=trained_model_name, config=hyper_params)
+
+    # dev batches are deterministic and sorted by length
+    dev_batch_list = [batch for _, batch in make_batch_loader(dev_tree_list, args, shuffle=False)]
 
     # evaluate initial state
-    dev_batch_list = dev_tree_list.make_batch(args.batch_size)
     with torch.no_grad():
         dev_stat = evaluate_batch_list(dev_batch_list, holccg)
         dev_tree_list.set_vector(holccg)
@@ -194,31 +400,46 @@ def train():
 
     accumulation_steps = 4 
 
+    # batches of each epoch are collated in background while the model is trained on earlier ones
+    train_batch_loader = make_batch_loader(train_tree_list, args)
+
     for epoch in range(1, args.epochs + 1):
         holccg.train()
-        train_batch_list = train_tree_list.make_batch(args.batch_size)
+        if args.freeze_encoder:
+            # frozen encoder gives the same representation as in inference
+            holccg.encoder.eval()
         epoch_word_loss = 0.0
         epoch_phrase_loss = 0.0
         epoch_span_loss = 0.0
         num_batch = 0
 
         optimizer.zero_grad()
-        with tqdm(total=len(train_batch_list), unit="batch") as pbar:
+        with tqdm(total=len(train_batch_loader), unit="batch") as pbar:
             pbar.set_description(f"Epoch[{epoch}/{args.epochs}]")
-            for i, batch in enumerate(train_batch_list):
+            for i, (tree_id_list, batch) in enumerate(train_batch_loader):
                 if args.device == 'cuda':
                     autocast_enabled = True
                 else:
                     autocast_enabled = False
 
                 with autocast(enabled=autocast_enabled):
-                    word_output, phrase_output, span_output, word_label, phrase_label, span_label = holccg(batch)
+                    output = holccg(batch, return_vector=teacher_cache is not None)
+                    word_output, phrase_output, span_output, word_label, phrase_label, span_label = output[:6]
                     word_loss = criteria(word_output, word_label)
                     phrase_loss = criteria(phrase_output, phrase_label)
                     span_loss = criteria(span_output, span_label)
                     
-                    # Divide the total loss by accumulation_steps
                     loss = word_loss + args.phrase_loss_weight * phrase_loss + args.span_loss_weight * span_loss
+                    if teacher_cache is not None:
+                        soft_loss = distillation_loss(
+                            output,
+                            teacher_cache.get(tree_id_list, args.device),
+                            args.distillation_temperature,
+                            args.phrase_loss_weight,
+                            args.span_loss_weight,
+                            args.vector_loss_weight)
+                        loss = (1 - args.distillation_weight) * loss + args.distillation_weight * soft_loss
+                    # Divide the total loss by accumulation_steps
                     loss = loss / accumulation_steps
 
                 scaler.scale(loss).backward()
@@ -243,7 +464,7 @@ def train():
 
             # In case the number of batches is not divisible by accumulation_steps,
             # perform an optimizer step at the end of the epoch if needed
-            if len(train_batch_list) % accumulation_steps != 0:
+            if len(train_batch_loader) % accumulation_steps != 0:
                 scaler.step(optimizer)
                 scaler.update()
                 optimizer.zero_grad()
@@ -255,20 +476,26 @@ def train():
             dev_tree_list.set_vector(holccg)
             stag_acc = evaluate_stag(dev_tree_list, holccg)
         dev_stat['stag_acc'] = stag_acc
-        torch.save(holccg.state_dict(), path_to_save_trained_model)
+        holccg.save_checkpoint(path_to_save_trained_model)
+        print('padding of training batches: {}'.format(train_batch_loader.padding_stat()))
         if args.wandb:
             log_stat_to_wandb(dev_stat, 'dev', epoch)
+            log_stat_to_wandb(train_batch_loader.padding_stat(), 'train', epoch)
         torch.cuda.empty_cache()
         gc.collect()
 
 
     # load and prepare batch of test_tree_list
-    test_tree_list = load(os.path.join(args.path_to_tree_list, 'test_tree_list.pickle'))
+    test_tree_list = open_tree_list(args.path_to_tree_list, 'test')
     test_tree_list.device = args.device
     test_tree_list.set_info_for_training(tokenizer)
-    test_batch_list = test_tree_list.make_batch(args.batch_size)
+    test_batch_list = [batch for _, batch in make_batch_loader(test_tree_list, args, shuffle=False)]
 
-    holccg = torch.load(path_to_save_trained_model, map_location=args.device)
+    holccg = HolCCG.from_checkpoint(
+        path_to_save_trained_model,
+        args.device,
+        memory_efficient_composition=args.memory_efficient_composition,
+        spectral=args.spectral)
     holccg.eval()
 
     with torch.no_grad():
@@ -1,5 +1,5 @@
 from torch.optim import AdamW
-from utils import load
+from tree_store import open_tree_list
 from transformers import RobertaTokenizer, RobertaForMaskedLM
 import torch
 import random
@@ -92,12 +92,12 @@ def train():
     model.to(args.device)
 
     # build train dataset
-    train_tree_list = load(os.path.join(args.path_to_dataset, 'tree_list/train_tree_list.pickle'))
+    train_tree_list = open_tree_list(os.path.join(args.path_to_dataset, 'tree_list/'), 'train')
     train_dataset = TreeDataset(train_tree_list.tree_list)
     train_dataloader = torch.utils.data.DataLoader(train_dataset, batch_size=8, shuffle=True, collate_fn=collate_fn)
 
     # build dev dataset
-    dev_tree_list = load(os.path.join(args.path_to_dataset, 'tree_list/dev_tree_list.pickle'))
+    dev_tree_list = open_tree_list(os.path.join(args.path_to_dataset, 'tree_list/'), 'dev')
     dev_dataset = TreeDataset(dev_tree_list.tree_list)
     dev_dataloader = torch.utils.data.DataLoader(dev_dataset, batch_size=8, shuffle=True, collate_fn=collate_fn)
 
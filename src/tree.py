@@ -1,17 +1,56 @@
 from torchtext.vocab import vocab, build_vocab_from_iterator
 from collections import Counter
-import random
+import sys
 from tqdm import tqdm
 import numpy as np
 import torch
-from operator import itemgetter
-from utils import circular_correlation, circular_convolution, convert_content
-from typing import List, Union
+from utils import convert_content, to_spectrum, from_spectrum
+from typing import List, Tuple, Union
 from transformers import RobertaTokenizer, BertTokenizer
 from holccg import HolCCG
 
 
+def set_slots(obj: object, state: Union[dict, tuple]) -> None:
+    """Set attributes of object with slots from its pickled state
+
+    Parameters
+    ----------
+    obj : object
+        object whose class has slots
+    state : Union[dict, tuple]
+        attribute dict of object pickled before slots, or pair of attribute dict and slot dict
+    """
+    if isinstance(state, tuple):
+        state = {**(state[0] or {}), **state[1]}
+    for key, value in state.items():
+        setattr(obj, key, value)
+
+
 class Node:
+    # attributes are kept in slots instead of attribute dict, since a treebank holds about a million nodes.
+    # annotations for experiments are kept in side tables of the scripts rather than on nodes
+    __slots__ = (
+        'is_leaf',
+        'self_id',
+        'sentence',
+        'start_idx',
+        'end_idx',
+        'category',
+        'pos',
+        'ready',
+        'num_child',
+        'child_node_id',
+        'head',
+        'left_child_node_id',
+        'right_child_node_id',
+        'parent_node',
+        'level',
+        'original_position',
+        'category_id',
+        'prime_category',
+        # row of the vector of node in node_vector of tree list, which is set by TreeList.set_vector
+        'vector_id')
+
     def __init__(self, node_info: list) -> None:
         """Class for node in constituency tree.
 
@@ -27,12 +66,16 @@ class Node:
         self.self_id = int(node_info[1])
         if self.is_leaf:
             content = node_info[2]
-            self.content = [convert_content(content)]
-            self.category = node_info[3]
-            self.pos = node_info[4]
+            # content is the span of words in sentence, which is shared by the nodes of tree
+            self.sentence = [convert_content(content)]
+            self.start_idx = 0
+            self.end_idx = 1
+            # categories and POS tags are interned to be shared by nodes
+            self.category = sys.intern(node_info[3])
+            self.pos = sys.intern(node_info[4])
             self.ready = True
         else:
-            self.category = node_info[2]
+            self.category = sys.intern(node_info[2])
             self.num_child = int(node_info[3])
             self.ready = False
             if self.num_child == 1:
@@ -43,8 +86,41 @@ class Node:
                 self.right_child_node_id = int(node_info[5])
                 self.head = int(node_info[6])
 
+    @property
+    def content(self) -> List[str]:
+        """words of the span of node in sentence"""
+        return self.sentence[self.start_idx:self.end_idx]
+
+    def __setstate__(self, state: Union[dict, tuple]) -> None:
+        """Restore pickled node, which may keep its own word list as content
+
+        Parameters
+        ----------
+        state : Union[dict, tuple]
+            pickled state of node
+        """
+        if isinstance(state, dict) and 'content' in state:
+            state = dict(state)
+            content = state.pop('content')
+            # the span of root node is not set when it is a leaf
+            if 'start_idx' not in state:
+                state['start_idx'] = 0
+                state['end_idx'] = len(content)
+            # replaced with the sentence of tree by TreeList.__setstate__
+            state['sentence'] = None
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        # vectors owned by nodes are not restored, which are kept in node_vector of tree list now
+        state.pop('vector', None)
+        set_slots(self, state)
+        for key in ['category', 'pos', 'prime_category']:
+            if isinstance(getattr(self, key, None), str):
+                setattr(self, key, sys.intern(getattr(self, key)))
+
 
 class Tree:
+    __slots__ = ('self_id', 'node_list', 'composition_info', 'sentence', 'original_position', 'spans', 'word_split')
+
     def __init__(self, self_id: int, node_list: list) -> None:
         """Class for constituency tree.
 
@@ -58,42 +134,96 @@ class Tree:
         self.self_id = self_id
         self.node_list = node_list
 
+    def __setstate__(self, state: Union[dict, tuple]) -> None:
+        set_slots(self, state)
+
     def set_node_composition_info(self) -> None:
-        """Set composition information of each node.
+        """Set composition information, span and depth level of each node in a single post-order pass.
+
+        composition_info is a post-order of the nodes, where a node whose children come after it
+        in node_list is finished after them by an explicit stack, so that each node is visited once.
+        Any topological order, in which every child is composed before its parent, gives the same
+        vectors by compose and the same spans. The level of a node is 0 for leaf nodes and
+        1 + the maximum level of its children otherwise.
+        The span of each node is then set top-down, and all nodes share one sentence.
         """
-        for node in self.node_list:
+        node_list = self.node_list
+        is_finished = [False] * len(node_list)
+        num_word = [1] * len(node_list)
+        self.composition_info = []
+
+        def finish(node: Node) -> None:
             if node.is_leaf:
-                node.ready = True
+                node.level = 0
+            elif node.num_child == 1:
+                child_node = node_list[node.child_node_id]
+                num_word[node.self_id] = num_word[child_node.self_id]
+                node.level = child_node.level + 1
+                self.composition_info.append([1, node.self_id, child_node.self_id, 0])
+            else:  # when node has two children
+                left_child_node = node_list[node.left_child_node_id]
+                right_child_node = node_list[node.right_child_node_id]
+                num_word[node.self_id] = num_word[left_child_node.self_id] + num_word[right_child_node.self_id]
+                if left_child_node.level > right_child_node.level:
+                    node.level = left_child_node.level + 1
+                else:
+                    node.level = right_child_node.level + 1
+                self.composition_info.append([2, node.self_id, left_child_node.self_id, right_child_node.self_id])
+            node.ready = True
+            is_finished[node.self_id] = True
+
+        for node in node_list:
+            if is_finished[node.self_id]:
+                continue
+            stack = [node]
+            while stack:
+                current_node = stack[-1]
+                if current_node.is_leaf:
+                    child_node_id = []
+                elif current_node.num_child == 1:
+                    child_node_id = [current_node.child_node_id]
+                else:
+                    child_node_id = [current_node.left_child_node_id, current_node.right_child_node_id]
+                pending_node_id = [idx for idx in child_node_id if not is_finished[idx]]
+                if pending_node_id:
+                    stack.extend([node_list[idx] for idx in pending_node_id])
+                else:
+                    finish(current_node)
+                    stack.pop()
+
+        # parents come before their children in the reversed composition info
+        root_node = node_list[-1]
+        if root_node.is_leaf:
+            sentence = root_node.content
+            root_node.start_idx = 0
+            root_node.end_idx = 1
+        else:
+            sentence = [None] * num_word[root_node.self_id]
+            root_node.start_idx = 0
+            root_node.end_idx = len(sentence)
+        for info in reversed(self.composition_info):
+            parent_node = node_list[info[1]]
+            left_child_node = node_list[info[2]]
+            if info[0] == 1:
+                split_idx = parent_node.end_idx
             else:
-                node.ready = False
-        self.composition_info = []
-        while True:
-            num_ready_node = 0
-            for node in self.node_list:
-                if node.ready:
-                    num_ready_node += 1
-                elif not node.is_leaf and not node.ready:
-                    if node.num_child == 1:
-                        child_node = self.node_list[node.child_node_id]
-                        if child_node.ready:
-                            node.content = child_node.content
-                            node.ready = True
-                            self.composition_info.append(
-                                [node.num_child, node.self_id, child_node.self_id, 0])
-                    else:  # when node has two children
-                        left_child_node = self.node_list[node.left_child_node_id]
-                        right_child_node = self.node_list[node.right_child_node_id]
-                        if left_child_node.ready and right_child_node.ready:
-                            node.content = left_child_node.content + right_child_node.content
-                            node.ready = True
-                            self.composition_info.append(
-                                [node.num_child, node.self_id, left_child_node.self_id, right_child_node.self_id])
-            if num_ready_node == len(self.node_list):
-                break
-        self.sentence = self.node_list[-1].content
+                split_idx = parent_node.start_idx + num_word[info[2]]
+                right_child_node = node_list[info[3]]
+                if right_child_node.is_leaf:
+                    # the word of leaf node is read before its span is moved into sentence
+                    sentence[split_idx] = right_child_node.sentence[right_child_node.start_idx]
+                right_child_node.start_idx = split_idx
+                right_child_node.end_idx = parent_node.end_idx
+            if left_child_node.is_leaf:
+                sentence[parent_node.start_idx] = left_child_node.sentence[left_child_node.start_idx]
+            left_child_node.start_idx = parent_node.start_idx
+            left_child_node.end_idx = split_idx
+        for node in node_list:
+            node.sentence = sentence
+        self.sentence = sentence
 
     def set_original_position_of_leaf_node(self) -> None:
-        """Set original position in the sentence of each leaf node.
+        """Set original position in the sentence of each leaf node and the spans of phrases.
         """
         self.original_position = []
         self.spans = []
@@ -101,16 +231,10 @@ class Tree:
         if node.is_leaf:
             node.original_position = 0
             self.original_position.append([node.self_id, node.original_position])
-        else:
-            node.start_idx = 0
-            node.end_idx = len(node.content)
         for info in reversed(self.composition_info):
             num_child = info[0]
             if num_child == 1:
-                parent_node = self.node_list[info[1]]
                 child_node = self.node_list[info[2]]
-                child_node.start_idx = parent_node.start_idx
-                child_node.end_idx = parent_node.end_idx
                 if child_node.is_leaf:
                     child_node.original_position = child_node.start_idx
                     self.original_position.append(
@@ -120,10 +244,6 @@ class Tree:
                 self.spans.append([parent_node.start_idx, parent_node.end_idx])
                 left_child_node = self.node_list[info[2]]
                 right_child_node = self.node_list[info[3]]
-                left_child_node.start_idx = parent_node.start_idx
-                left_child_node.end_idx = parent_node.start_idx + len(left_child_node.content)
-                right_child_node.start_idx = left_child_node.end_idx
-                right_child_node.end_idx = parent_node.end_idx
                 if left_child_node.is_leaf:
                     left_child_node.original_position = left_child_node.start_idx
                     self.original_position.append(
@@ -133,67 +253,9 @@ class Tree:
                     self.original_position.append(
                         [right_child_node.self_id, right_child_node.original_position])
 
-    def generate_random_tree(self) -> None:
+    def generate_random_tree(self) -> tuple:
         """generate the random binary tree in order to obtain negative training sample for span classification."""
-        random_composition_info = []
-        random_original_position = []
-        # list of span's id which do not exist in gold tree
-        negative_node_id = []
-
-        node_id = 0
-        node = [0, len(self.sentence), node_id]
-        node_list = [node]
-
-        if len(self.sentence) > 1:
-            if node[:2] not in self.spans:
-                negative_node_id.append(node_id)
-            wait_list = [node]
-        else:
-            wait_list = []
-            random_original_position = [[0, 0]]
-
-        node_id += 1
-
-        while True:
-            if wait_list == []:
-                break
-            # information about parent node which is split into two child nodes
-            parent_node = wait_list.pop(0)
-            start_idx = parent_node[0]
-            end_idx = parent_node[1]
-            parent_id = parent_node[2]
-
-            # decide split point
-            split_idx = random.randint(start_idx + 1, end_idx - 1)
-
-            # define left child node
-            left_node = [start_idx, split_idx, node_id]
-            node_list.append(left_node)
-            # when left node is not leaf node
-            if left_node[1] - left_node[0] > 1:
-                if left_node[:2] not in self.spans:
-                    negative_node_id.append(node_id)
-                wait_list.append(left_node)
-            # when left node is leaf node
-            else:
-                random_original_position.append([node_id, split_idx - 1])
-            node_id += 1
-
-            # define right child node
-            right_node = [split_idx, end_idx, node_id]
-            node_list.append(right_node)
-            # when right node is not leaf node
-            if right_node[1] - right_node[0] > 1:
-                if right_node[:2] not in self.spans:
-                    negative_node_id.append(node_id)
-                wait_list.append(right_node)
-            else:
-                random_original_position.append([node_id, end_idx - 1])
-            node_id += 1
-
-            random_composition_info.append([2, parent_id, node_id - 2, node_id - 1])
-        random_composition_info.reverse()
-        return len(node_list), random_composition_info, random_original_position, negative_node_id
+        return generate_random_tree(len(self.sentence), self.spans)
 
     def set_word_split(self, tokenizer: Union[RobertaTokenizer, BertTokenizer]) -> List[List[int]]:
         """Set word split information, where each word is split into several tokens.
@@ -208,26 +270,363 @@ class Tree:
         List[List[int]]
             List of word split information.
         """
-        sentence = " ".join(self.sentence)
-        tokens = tokenizer.tokenize(sentence)
-        tokenized_pos = 0
-        word_split = []
-        for original_position in range(len(self.sentence)):
-            word = self.sentence[original_position]
-            length = 1
-            while True:
-                temp = tokenizer.convert_tokens_to_string(
-                    tokens[tokenized_pos:tokenized_pos + length])
-                temp = temp.replace(" ", "")
-                temp = temp.replace("\"", "``")
-                if word == temp or word.lower() == temp:
-                    word_split.append([tokenized_pos, tokenized_pos + length])
-                    tokenized_pos += length
-                    break
-                else:
-                    length += 1
-        self.word_split = word_split
-        return word_split
+        self.word_split = split_word(tokenizer, self.sentence)
+        return self.word_split
+
+
+def span_key(tree_idx: np.ndarray, start_idx: np.ndarray, end_idx: np.ndarray, max_num_word: int) -> np.ndarray:
+    """Encode spans of trees into integer keys, which are compared instead of the pairs of indices
+
+    Parameters
+    ----------
+    tree_idx : np.ndarray
+        index of tree which each span belongs to
+    start_idx : np.ndarray
+        start index of each span
+    end_idx : np.ndarray
+        end index of each span
+    max_num_word : int
+        maximum number of words in the sentences of trees
+
+    Returns
+    -------
+    np.ndarray
+        key of each span
+    """
+    width = max_num_word + 1
+    return (np.asarray(tree_idx, dtype=np.int64) * width + start_idx) * width + end_idx
+
+
+def make_gold_span_key(num_word: np.ndarray, spans: List[List[List[int]]]) -> np.ndarray:
+    """Make the sorted keys of gold spans of trees
+
+    Parameters
+    ----------
+    num_word : np.ndarray
+        number of words in each sentence
+    spans : List[List[List[int]]]
+        start and end index of the phrases in each gold tree
+
+    Returns
+    -------
+    np.ndarray
+        sorted keys of all gold spans, which are made by span_key
+    """
+    num_span = [len(tree_spans) for tree_spans in spans]
+    flat_spans = np.concatenate([np.asarray(tree_spans, dtype=np.int64).reshape(-1, 2) for tree_spans in spans])
+    tree_idx = np.repeat(np.arange(len(spans)), num_span)
+    return np.sort(span_key(tree_idx, flat_spans[:, 0], flat_spans[:, 1], int(np.max(num_word))))
+
+
+def make_offset(tree_idx: np.ndarray, num_tree: int) -> np.ndarray:
+    """Make offsets of rows of each tree from the tree index of rows sorted by tree"""
+    return np.concatenate([[0], np.cumsum(np.bincount(tree_idx, minlength=num_tree))]).astype(np.int64)
+
+
+def flat_index(offset: np.ndarray, tree_id: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Gather the rows of trees from flat arrays, whose rows of each tree are given by offsets
+
+    Parameters
+    ----------
+    offset : np.ndarray
+        offsets of rows of each tree
+    tree_id : np.ndarray
+        id of trees to be gathered
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        index of the rows in flat arrays and number of rows of each tree
+    """
+    tree_id = np.asarray(tree_id, dtype=np.int64)
+    start = offset[tree_id]
+    count = offset[tree_id + 1] - start
+    row_start = np.cumsum(count) - count
+    index = np.arange(count.sum(), dtype=np.int64) + np.repeat(start - row_start, count)
+    return index, count
+
+
+def pad_flat(array: np.ndarray, offset: np.ndarray, tree_id: np.ndarray, padding_value: int = -1) -> np.ndarray:
+    """Gather the rows of trees from a flat array into a padded array
+
+    Parameters
+    ----------
+    array : np.ndarray
+        flat array of rows of all trees
+    offset : np.ndarray
+        offsets of rows of each tree
+    tree_id : np.ndarray
+        id of trees to be gathered
+    padding_value : int, optional
+        value of padded rows, by default -1
+
+    Returns
+    -------
+    np.ndarray
+        padded rows of shape (len(tree_id), max number of rows, ...)
+    """
+    index, count = flat_index(offset, tree_id)
+    padded = np.full((len(count), count.max(initial=0), *array.shape[1:]), padding_value, dtype=array.dtype)
+    padded[np.repeat(np.arange(len(count)), count), index - np.repeat(offset[tree_id], count)] = array[index]
+    return padded
+
+
+def to_device(array_list: List[np.ndarray], device: Union[str, torch.device]) -> List[torch.Tensor]:
+    """Move integer arrays to device by one transfer
+
+    The arrays are concatenated into one buffer, and the returned tensors are views of it on device.
+
+    Parameters
+    ----------
+    array_list : List[np.ndarray]
+        integer arrays
+    device : Union[str, torch.device]
+        device to move to, which may be given by its name as the device of command line arguments
+
+    Returns
+    -------
+    List[torch.Tensor]
+        long tensors of the same shapes as the arrays
+    """
+    device = torch.device(device)
+    buffer = torch.from_numpy(np.concatenate([np.asarray(array, dtype=np.int64).ravel() for array in array_list]))
+    if device.type == 'cuda':
+        buffer = buffer.pin_memory().to(device, non_blocking=True)
+    else:
+        buffer = buffer.to(device)
+    return [
+        tensor.view(array.shape)
+        for tensor, array in zip(buffer.split([np.size(array) for array in array_list]), array_list)]
+
+
+def set_vector_id(tree: Tree, node_start: int) -> None:
+    """Set the row of the vector of each node in node_vector of tree list
+
+    Parameters
+    ----------
+    tree : Tree
+        tree
+    node_start : int
+        row of the first node of the tree
+    """
+    for node in tree.node_list:
+        node.vector_id = node_start + node.self_id
+
+
+def composition_level(composition_info: np.ndarray, composition_offset: np.ndarray, node_offset: np.ndarray) -> np.ndarray:
+    """Compute the level of the parent node of each composition, where leaf nodes are at level 0
+
+    The compositions of each tree are in bottom-up order, so that the i-th compositions of all trees
+    are visited together.
+
+    Parameters
+    ----------
+    composition_info : np.ndarray
+        flat composition info of all trees, whose node ids are those in each tree
+    composition_offset : np.ndarray
+        offsets of composition info of each tree
+    node_offset : np.ndarray
+        offsets of nodes of each tree
+
+    Returns
+    -------
+    np.ndarray
+        level of each composition, which is 1 + the maximum level of its children
+    """
+    num_composition = np.diff(composition_offset)
+    node_level = np.zeros(node_offset[-1], dtype=np.int64)
+    level = np.zeros(len(composition_info), dtype=np.int64)
+    for idx in range(num_composition.max(initial=0)):
+        tree_id = np.flatnonzero(num_composition > idx)
+        row = composition_offset[tree_id] + idx
+        info = composition_info[row] + node_offset[tree_id, None]
+        child_level = node_level[info[:, 2]]
+        # the right child of one child composition is a dummy
+        is_pair = composition_info[row, 0] == 2
+        child_level[is_pair] = np.maximum(child_level[is_pair], node_level[info[is_pair, 3]])
+        level[row] = child_level + 1
+        node_level[info[:, 1]] = level[row]
+    return level
+
+
+def generate_random_trees(num_word: np.ndarray, gold_span_key: np.ndarray) -> dict:
+    """generate random binary trees of many sentences at once in order to obtain negative training samples
+    for span classification.
+
+    All nodes at the same depth of all trees are split at random points together. The node ids are given in
+    breadth-first order and the composition info of each tree is in bottom-up order.
+
+    Parameters
+    ----------
+    num_word : np.ndarray
+        number of words in each sentence
+    gold_span_key : np.ndarray
+        sorted keys of the spans of phrases in gold trees, which are made by make_gold_span_key
+
+    Returns
+    -------
+    dict
+        number of nodes of each tree, and composition info, original position of leaf nodes and id of
+        negative nodes of all trees as flat arrays with the offsets of each tree
+    """
+    num_word = np.asarray(num_word, dtype=np.int64)
+    num_tree = len(num_word)
+    max_num_word = int(num_word.max())
+    num_node = np.ones(num_tree, dtype=np.int64)
+    # nodes at current depth, which are sorted by tree
+    tree_idx = np.arange(num_tree)
+    start_idx = np.zeros(num_tree, dtype=np.int64)
+    end_idx = num_word
+    node_id = np.zeros(num_tree, dtype=np.int64)
+    leaf, negative, composition = [], [], []
+    depth = 0
+    while len(tree_idx) > 0:
+        is_leaf = end_idx - start_idx == 1
+        leaf.append(np.stack([tree_idx[is_leaf], node_id[is_leaf], start_idx[is_leaf]], axis=1))
+        tree_idx = tree_idx[~is_leaf]
+        start_idx = start_idx[~is_leaf]
+        end_idx = end_idx[~is_leaf]
+        node_id = node_id[~is_leaf]
+        # look up the spans of phrases in sorted gold span keys
+        key = span_key(tree_idx, start_idx, end_idx, max_num_word)
+        position = np.searchsorted(gold_span_key, key)
+        found = position < len(gold_span_key)
+        is_gold = np.zeros(len(key), dtype=bool)
+        is_gold[found] = gold_span_key[position[found]] == key[found]
+        negative.append(np.stack([tree_idx[~is_gold], node_id[~is_gold]], axis=1))
+
+        # split every phrase at random point, whose children are numbered in the order of parents
+        split_idx = np.random.randint(start_idx + 1, end_idx) if len(tree_idx) > 0 else start_idx
+        rank = np.arange(len(tree_idx)) - np.searchsorted(tree_idx, tree_idx)
+        left_node_id = num_node[tree_idx] + 2 * rank
+        num_node += 2 * np.bincount(tree_idx, minlength=num_tree)
+        composition.append(np.stack(
+            [tree_idx, np.full(len(tree_idx), depth), node_id, left_node_id, left_node_id + 1], axis=1))
+
+        # children of each parent are next to each other
+        tree_idx = np.repeat(tree_idx, 2)
+        children_start_idx = np.stack([start_idx, split_idx], axis=1).ravel()
+        end_idx = np.stack([split_idx, end_idx], axis=1).ravel()
+        start_idx = children_start_idx
+        node_id = np.stack([left_node_id, left_node_id + 1], axis=1).ravel()
+        depth += 1
+
+    # rows of each tree are in the order of node id, except composition info in bottom-up order
+    leaf = np.concatenate(leaf)
+    leaf = leaf[np.argsort(leaf[:, 0], kind='stable')]
+    negative = np.concatenate(negative)
+    negative = negative[np.argsort(negative[:, 0], kind='stable')]
+    composition = np.concatenate(composition)
+    composition = composition[np.lexsort((-composition[:, 2], -composition[:, 1], composition[:, 0]))]
+    composition_info = np.concatenate([np.full((len(composition), 1), 2), composition[:, 2:]], axis=1)
+    return {
+        'num_node': num_node,
+        'composition_info': composition_info,
+        'composition_offset': make_offset(composition[:, 0], num_tree),
+        'original_position': leaf[:, 1:],
+        'original_position_offset': make_offset(leaf[:, 0], num_tree),
+        'negative_node_id': negative[:, 1],
+        'negative_offset': make_offset(negative[:, 0], num_tree)}
+
+
+def generate_random_tree(num_word: int, spans: List[List[int]]) -> tuple:
+    """generate the random binary tree in order to obtain negative training sample for span classification.
+
+    Parameters
+    ----------
+    num_word : int
+        number of words in the sentence
+    spans : List[List[int]]
+        start and end index of the phrases in gold tree
+
+    Returns
+    -------
+    tuple
+        number of nodes, composition info, original position of leaf nodes and id of negative nodes
+    """
+    random_tree_info = generate_random_trees(np.array([num_word]), make_gold_span_key(np.array([num_word]), [spans]))
+    return (
+        int(random_tree_info['num_node'][0]),
+        random_tree_info['composition_info'].tolist(),
+        random_tree_info['original_position'].tolist(),
+        random_tree_info['negative_node_id'].tolist())
+
+
+def split_word(tokenizer: Union[RobertaTokenizer, BertTokenizer], sentence: List[str]) -> List[List[int]]:
+    """Split each word of sentence into several tokens.
+
+    Parameters
+    ----------
+    tokenizer : Union[RobertaTokenizer, BertTokenizer]
+        Tokenizer used to split words into tokens.
+    sentence : List[str]
+        words of sentence
+
+    Returns
+    -------
+    List[List[int]]
+        start and end index of tokens of each word.
+    """
+    tokens = tokenizer.tokenize(" ".join(sentence))
+    tokenized_pos = 0
+    word_split = []
+    for original_position in range(len(sentence)):
+        word = sentence[original_position]
+        length = 1
+        while True:
+            temp = tokenizer.convert_tokens_to_string(
+                tokens[tokenized_pos:tokenized_pos + length])
+            temp = temp.replace(" ", "")
+            temp = temp.replace("\"", "``")
+            if word == temp or word.lower() == temp:
+                word_split.append([tokenized_pos, tokenized_pos + length])
+                tokenized_pos += length
+                break
+            else:
+                length += 1
+    return word_split
+
+
+def tokenize_sentences(
+        tokenizer: Union[RobertaTokenizer, BertTokenizer],
+        sentence_list: List[List[str]]) -> Tuple[List[List[int]], List[List[List[int]]]]:
+    """Tokenize sentences into the token ids fed into encoder and split each word into tokens.
+
+    Fast tokenizers tokenize all sentences at once, and the tokens of each word are found by the
+    character offsets of tokens. Other tokenizers tokenize each sentence and split words by split_word.
+
+    Parameters
+    ----------
+    tokenizer : Union[RobertaTokenizer, BertTokenizer]
+        Tokenizer used to split words into tokens.
+    sentence_list : List[List[str]]
+        words of each sentence
+
+    Returns
+    -------
+    Tuple[List[List[int]], List[List[List[int]]]]
+        token ids of each sentence including special tokens, and start and end index of tokens
+        of each word, which do not count the special token at the beginning
+    """
+    if not getattr(tokenizer, 'is_fast', False):
+        input_ids = [tokenizer(" ".join(sentence))['input_ids'] for sentence in sentence_list]
+        return input_ids, [split_word(tokenizer, sentence) for sentence in sentence_list]
+    encoding = tokenizer(
+        [" ".join(sentence) for sentence in sentence_list],
+        return_offsets_mapping=True,
+        return_special_tokens_mask=True)
+    word_split_list = []
+    for sentence, offset_mapping, special_tokens_mask in zip(
+            sentence_list, encoding['offset_mapping'], encoding['special_tokens_mask']):
+        # words are joined by a space, and each token belongs to the word where its first character is
+        word_start = np.cumsum([0] + [len(word) + 1 for word in sentence[:-1]])
+        token_start = np.array([start for start, _ in offset_mapping])[np.array(special_tokens_mask) == 0]
+        token_word = np.searchsorted(word_start, token_start, side='right') - 1
+        word_idx = np.arange(len(sentence))
+        word_split_list.append(np.stack([
+            np.searchsorted(token_word, word_idx, side='left'),
+            np.searchsorted(token_word, word_idx, side='right')], axis=1).tolist())
+    return encoding['input_ids'], word_split_list
 
 
 class TreeList:
@@ -282,6 +681,47 @@ class TreeList:
         
         self.set_category_id()
 
+    def __setstate__(self, state: dict) -> None:
+        """Restore pickled tree list, whose nodes may keep their own word lists as content
+
+        Parameters
+        ----------
+        state : dict
+            attributes of the pickled tree list
+        """
+        self.__dict__.update(state)
+        for tree in self.tree_list:
+            for node in tree.node_list:
+                for legacy_node in [node, getattr(node, 'parent_node', None)]:
+                    if legacy_node is not None and getattr(legacy_node, 'sentence', None) is None:
+                        legacy_node.sentence = tree.sentence
+
+    @classmethod
+    def from_store(cls, store, device: torch.device = None) -> 'TreeList':
+        """Make tree list as a view over columnar tree store, whose trees are materialized on first access
+
+        Parameters
+        ----------
+        store : TreeStore
+            memory-mapped tree store written by TreeStore.build
+        device : torch.device, optional
+            device to use, by default None
+
+        Returns
+        -------
+        TreeList
+            tree list whose tree_list is the lazy view of the store
+        """
+        tree_list = cls.__new__(cls)
+        if device is None:
+            tree_list.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        else:
+            tree_list.device = device
+        for key, value in store.meta.items():
+            setattr(tree_list, key, value)
+        tree_list.tree_list = store.view()
+        return tree_list
+
     def set_tree_list(self, path_to_tree_list: str) -> None:
         """Construct the list of trees.
 
@@ -375,36 +815,66 @@ class TreeList:
     def set_info_for_training(self, tokenizer: Union[RobertaTokenizer, BertTokenizer]) -> None:
         """Set information for training.
 
+        The nodes, leaf nodes and composition info of all trees are concatenated into flat arrays,
+        whose rows of each tree are given by the offsets, so that batches are gathered by flat_index.
+        The sentences are tokenized once here, and the token ids are fed into the encoder as they are.
+
         Parameters
         ----------
         tokenizer : Union[RobertaTokenizer, BertTokenizer]
-            tokenizer to use for tokenization
+            tokenizer to use for tokenization, with which all sentences are tokenized at once when it is fast
         """
-        self.num_node = []
-        self.sentence_list = []
-        self.label_list = []
-        self.original_position = []
-        self.composition_info = []
-        self.word_split = []
-        for tree in self.tree_list:
-            self.num_node.append(len(tree.node_list))
-            self.sentence_list.append(" ".join(tree.sentence))
-            label_list = []
-            for node in tree.node_list:
-                label_list.append([node.category_id])
-            self.label_list.append(label_list)
-            self.original_position.append(
-                torch.tensor(
-                    tree.original_position,
-                    dtype=torch.long,
-                    device=self.device))
-            self.composition_info.append(
-                torch.tensor(
-                    tree.composition_info,
-                    dtype=torch.long,
-                    device=self.device))
-            self.word_split.append(tree.set_word_split(tokenizer))
+        sentence_list = []
+        category_id_list = []
+        original_position_list = []
+        composition_info_list = []
+        spans_list = []
+        # the view of tree store is read column-wise without materializing the trees
+        store = getattr(self.tree_list, 'store', None)
+        for idx in range(len(self.tree_list)):
+            if store is None:
+                tree = self.tree_list[idx]
+                sentence = tree.sentence
+                category_id = [node.category_id for node in tree.node_list]
+                original_position = tree.original_position
+                composition_info = tree.composition_info
+                spans = tree.spans
+            else:
+                tree_id = self.tree_list.tree_id[idx]
+                sentence = store.sentence(tree_id)
+                category_id = store.category_id(tree_id)
+                original_position = store.original_position(tree_id)
+                composition_info = store.composition_info(tree_id)
+                spans = store.spans(tree_id)
+            sentence_list.append(sentence)
+            category_id_list.append(np.asarray(category_id, dtype=np.int64))
+            original_position_list.append(np.asarray(original_position, dtype=np.int64).reshape(-1, 2))
+            composition_info_list.append(np.asarray(composition_info, dtype=np.int64).reshape(-1, 4))
+            spans_list.append(spans)
+        self.sentence_list = [" ".join(sentence) for sentence in sentence_list]
+        input_ids, self.word_split = tokenize_sentences(tokenizer, sentence_list)
+        if store is None:
+            for tree, word_split in zip(self.tree_list, self.word_split):
+                tree.word_split = word_split
+        num_tree = len(self.tree_list)
+        self.num_node = np.array([len(category_id) for category_id in category_id_list], dtype=np.int64)
+        self.num_word = np.array([len(original_position) for original_position in original_position_list])
+        num_composition = [len(composition_info) for composition_info in composition_info_list]
+        self.node_offset = make_offset(np.repeat(np.arange(num_tree), self.num_node), num_tree)
+        self.original_position_offset = make_offset(np.repeat(np.arange(num_tree), self.num_word), num_tree)
+        self.composition_offset = make_offset(np.repeat(np.arange(num_tree), num_composition), num_tree)
+        self.input_ids_offset = make_offset(np.repeat(np.arange(num_tree), [len(ids) for ids in input_ids]), num_tree)
+        self.input_ids = np.fromiter(
+            (token_id for ids in input_ids for token_id in ids), dtype=np.int64, count=self.input_ids_offset[-1])
+        # label of each node, and whether it is a word node rather than a phrase node
+        self.category_id = np.concatenate(category_id_list)
+        self.original_position = np.concatenate(original_position_list)
+        self.composition_info = np.concatenate(composition_info_list)
+        self.is_word = np.zeros(len(self.category_id), dtype=bool)
+        self.is_word[self.original_position[:, 0] + np.repeat(self.node_offset[:-1], self.num_word)] = True
         self.sorted_tree_id = np.argsort(self.num_node)
+        # gold spans are kept as sorted keys to find the negative spans of random trees of all sentences at once
+        self.gold_span_key = make_gold_span_key(self.num_word, spans_list)
 
     def make_shuffled_tree_id(self) -> np.ndarray:
         """Make shuffled tree id."""
@@ -415,202 +885,202 @@ class TreeList:
             shuffled_tree_id.append(id_list)
         return np.concatenate(shuffled_tree_id)
 
-    def make_batch(self, batch_size: int = None) -> None:
+    def make_batch(self, batch_size: int = None) -> list:
         """Make batch for training.
 
         Parameters
         ----------
         batch_size : int, optional
             batch size, by default None
+
+        Returns
+        -------
+        list
+            list of batch, each of which is the tuple of training info fed into HolCCG
         """
-        # make batch content id includes leaf node content id for each tree belongs to batch
-        batch_num_node = []
-        batch_sentence_list = []
-        batch_label_list = []
-        batch_original_position = []
-        batch_composition_info = []
-        batch_word_split = []
         num_tree = len(self.tree_list)
-
         # the series of "random" are information about randomly generated tree for
         # the scoring of span
-        random_num_node = []
-        random_original_position = []
-        random_composition_info = []
-        random_negative_node_id = []
-        batch_random_num_node = []
-        batch_random_composition_info = []
-        batch_random_original_pos = []
-        batch_random_negative_node_id = []
         # generate random binary tree for all sentence in training data each epoch
-        for tree in self.tree_list:
-            random_tree_info = tree.generate_random_tree()
-            random_num_node.append(random_tree_info[0])
-            random_composition_info.append(
-                torch.tensor(
-                    random_tree_info[1],
-                    dtype=torch.long,
-                    device=self.device))
-            random_original_position.append(
-                torch.tensor(
-                    random_tree_info[2],
-                    dtype=torch.long,
-                    device=self.device))
-            random_negative_node_id.append(
-                torch.tensor(
-                    random_tree_info[3],
-                    dtype=torch.long,
-                    device=self.device))
+        random_tree_info = self.generate_random_tree_info()
         if batch_size is None:
-            batch_tree_id_list = list(range(num_tree))
-            batch_num_node.append(
-                list(itemgetter(*batch_tree_id_list)(self.num_node)))
-            batch_sentence_list.append(list(itemgetter(*batch_tree_id_list)(self.sentence_list)))
-            batch_label_list.append(list(itemgetter(
-                *batch_tree_id_list)(self.label_list)))
-            batch_original_position.append(
-                list(
-                    itemgetter(
-                        *
-                        batch_tree_id_list)(
-                        self.original_position)))
-            batch_composition_info.append(list(itemgetter(
-                *batch_tree_id_list)(self.composition_info)))
-            batch_word_split.append(list(itemgetter(
-                *batch_tree_id_list)(self.word_split)))
-            batch_random_num_node.append(list(itemgetter(*batch_tree_id_list)(random_num_node)))
-            batch_random_composition_info.append(
-                list(itemgetter(*batch_tree_id_list)(random_composition_info)))
-            batch_random_original_pos.append(
-                list(itemgetter(*batch_tree_id_list)(random_original_position)))
-            batch_random_negative_node_id.append(
-                list(itemgetter(*batch_tree_id_list)(random_negative_node_id)))
+            batch_tree_id_list = [list(range(num_tree))]
         else:
             # shuffle the tree_id in tree_list
             shuffled_tree_id = self.make_shuffled_tree_id()
-            for idx in range(0, num_tree - batch_size, batch_size):
-                batch_tree_id_list = shuffled_tree_id[idx:idx + batch_size]
-                batch_num_node.append(
-                    list(itemgetter(*batch_tree_id_list)(self.num_node)))
-                batch_sentence_list.append(
-                    list(
-                        itemgetter(
-                            *
-                            batch_tree_id_list)(
-                            self.sentence_list)))
-                batch_label_list.append(list(itemgetter(
-                    *batch_tree_id_list)(self.label_list)))
-                batch_original_position.append(
-                    list(
-                        itemgetter(
-                            *
-                            batch_tree_id_list)(
-                            self.original_position)))
-                batch_composition_info.append(list(itemgetter(
-                    *batch_tree_id_list)(self.composition_info)))
-                batch_word_split.append(list(itemgetter(
-                    *batch_tree_id_list)(self.word_split)))
-                batch_random_num_node.append(list(itemgetter(*batch_tree_id_list)(random_num_node)))
-                batch_random_composition_info.append(
-                    list(itemgetter(*batch_tree_id_list)(random_composition_info)))
-                batch_random_original_pos.append(
-                    list(itemgetter(*batch_tree_id_list)(random_original_position)))
-                batch_random_negative_node_id.append(
-                    list(itemgetter(*batch_tree_id_list)(random_negative_node_id)))
-            # the part cannot devided by batch_size
-            batch_num_node.append(list(itemgetter(
-                *shuffled_tree_id[idx + batch_size:])(self.num_node)))
-            batch_sentence_list.append(
-                list(itemgetter(*shuffled_tree_id[idx + batch_size:])(self.sentence_list)))
-            batch_label_list.append(list(itemgetter(
-                *shuffled_tree_id[idx + batch_size:])(self.label_list)))
-            batch_original_position.append(
-                list(itemgetter(*shuffled_tree_id[idx + batch_size:])(self.original_position)))
-            batch_composition_info.append(list(itemgetter(
-                *shuffled_tree_id[idx + batch_size:])(self.composition_info)))
-            batch_word_split.append(
-                list(itemgetter(*shuffled_tree_id[idx + batch_size:])(self.word_split)))
-            batch_random_num_node.append(
-                list(itemgetter(*shuffled_tree_id[idx + batch_size:])(random_num_node)))
-            batch_random_composition_info.append(
-                list(itemgetter(*shuffled_tree_id[idx + batch_size:])(random_composition_info)))
-            batch_random_original_pos.append(
-                list(itemgetter(*shuffled_tree_id[idx + batch_size:])(random_original_position)))
-            batch_random_negative_node_id.append(
-                list(itemgetter(*shuffled_tree_id[idx + batch_size:])(random_negative_node_id)))
-
-        for idx in range(len(batch_composition_info)):
-            composition_list = batch_composition_info[idx]
-            # set mask for composition info in each batch
-            max_num_composition = max([len(i) for i in composition_list])
-            # make dummy compoisition info to fill blank in batch
-            dummy_compositin_info = [
-                torch.ones(
-                    max_num_composition - len(i),
-                    4,
-                    dtype=torch.long,
-                    device=self.device) * -1 for i in composition_list]
-            batch_composition_info[idx] = torch.stack(
-                [torch.cat((i, j)) for (i, j) in zip(composition_list, dummy_compositin_info)])
-
-        for idx in range(len(batch_random_composition_info)):
-            composition_list = batch_random_composition_info[idx]
-            # set mask for composition info in each batch
-            max_num_composition = max([len(i) for i in composition_list])
-            # make dummy compoisition info to fill blank in batch
-            dummy_compositin_info = [
-                torch.ones(
-                    max_num_composition - len(i),
-                    4,
-                    dtype=torch.long,
-                    device=self.device) * -1 for i in composition_list]
-            batch_random_composition_info[idx] = torch.stack(
-                [torch.cat((i, j)) for (i, j) in zip(composition_list, dummy_compositin_info)])
-        # return zipped batch information, when training, extract each batch from zip itteration
-        batch_list = list(zip(
+            batch_tree_id_list = [shuffled_tree_id[idx:idx + batch_size]
+                                  for idx in range(0, num_tree, batch_size)]
+        return [self.collate(tree_id_list, random_tree_info) for tree_id_list in batch_tree_id_list]
+
+    def generate_random_tree_info(self) -> dict:
+        """Generate random binary tree for every tree in tree list.
+
+        Returns
+        -------
+        dict
+            randomly generated trees of all trees, which is the output of generate_random_trees
+        """
+        return generate_random_trees(self.num_word, self.gold_span_key)
+
+    def collate(self, tree_id_list: List[int], random_tree_info: dict) -> tuple:
+        """Collect the training info of trees into one batch.
+
+        The rows of the trees are gathered from the flat arrays and moved to device by one transfer.
+
+        Parameters
+        ----------
+        tree_id_list : List[int]
+            id of trees which belong to the batch
+        random_tree_info : dict
+            randomly generated trees of all trees in tree list
+
+        Returns
+        -------
+        tuple
+            the batch fed into HolCCG, whose last item is the token ids of each sentence
+        """
+        tree_id_list = np.asarray(tree_id_list, dtype=np.int64)
+        batch_size = len(tree_id_list)
+        batch_num_node = self.num_node[tree_id_list].tolist()
+        batch_sentence_list = [self.sentence_list[tree_id] for tree_id in tree_id_list]
+        batch_word_split = [self.word_split[tree_id] for tree_id in tree_id_list]
+        input_ids_index, num_input_ids = flat_index(self.input_ids_offset, tree_id_list)
+        position_index, num_position = flat_index(self.original_position_offset, tree_id_list)
+        composition_info = pad_flat(self.composition_info, self.composition_offset, tree_id_list)
+
+        # flat index of word and phrase nodes in the node tensor of shape (batch * max_num_node, model_dim)
+        node_index, num_node = flat_index(self.node_offset, tree_id_list)
+        node_offset = self.node_offset[tree_id_list] - np.arange(batch_size) * max(batch_num_node)
+        node_id = node_index - np.repeat(node_offset, num_node)
+        is_word = self.is_word[node_index]
+        label = self.category_id[node_index]
+
+        # random trees of the batch are gathered from the flat arrays of all random trees
+        batch_random_num_node = random_tree_info['num_node'][tree_id_list].tolist()
+        random_composition_info = pad_flat(
+            random_tree_info['composition_info'], random_tree_info['composition_offset'], tree_id_list)
+        random_position_index, num_random_position = flat_index(
+            random_tree_info['original_position_offset'], tree_id_list)
+        # flat index of negative spans in the node tensor of randomly generated trees
+        negative_index, num_negative = flat_index(random_tree_info['negative_offset'], tree_id_list)
+        random_negative_node_id = random_tree_info['negative_node_id'][negative_index] + np.repeat(
+            np.arange(batch_size) * max(batch_random_num_node), num_negative)
+
+        (
+            input_ids,
+            original_position,
+            batch_composition_info,
+            word_index,
+            phrase_index,
+            word_label,
+            phrase_label,
+            batch_random_composition_info,
+            random_original_position,
+            batch_random_negative_node_id) = to_device([
+                self.input_ids[input_ids_index],
+                self.original_position[position_index],
+                composition_info,
+                node_id[is_word],
+                node_id[~is_word],
+                label[is_word],
+                label[~is_word],
+                random_composition_info,
+                random_tree_info['original_position'][random_position_index],
+                random_negative_node_id], self.device)
+        batch_input_ids = list(input_ids.split(num_input_ids.tolist()))
+        batch_original_position = list(original_position.split(num_position.tolist()))
+        batch_label = (word_index, phrase_index, word_label, phrase_label)
+        batch_random_original_pos = list(random_original_position.split(num_random_position.tolist()))
+
+        return (
             batch_num_node,
             batch_sentence_list,
             batch_original_position,
             batch_composition_info,
-            batch_label_list,
+            batch_label,
             batch_word_split,
             batch_random_num_node,
             batch_random_composition_info,
             batch_random_original_pos,
-            batch_random_negative_node_id))
-        return batch_list
+            batch_random_negative_node_id,
+            batch_input_ids)
+
+    def set_vector(self, holccg: HolCCG, batch_size: int = 32) -> None:
+        """set the vector for all node in tree list, whose info for training is set
 
-    def set_vector(self, holccg: HolCCG) -> None:
-        """set the vector for all node in tree list
+        The vectors of all nodes are kept in node_vector of shape (total number of nodes, model_dim), whose
+        rows of each tree are given by node_offset, and each node keeps the row of its vector as vector_id.
+        The trees of tree store are given vector_id when they are materialized, so that they are not loaded here.
+        The trees of a batch are encoded at once, and their nodes at the same level are composed together.
 
         Parameters
         ----------
         holccg
             HolCCG model
+        batch_size : int, optional
+            number of sentences encoded at once, by default 32.
+            The sentences are packed into sequences when pack_size of holccg is set
         """
-        with tqdm(total=len(self.tree_list)) as pbar:
+        num_tree = len(self.tree_list)
+        level = composition_level(self.composition_info, self.composition_offset, self.node_offset)
+        self.node_vector = None
+        with tqdm(total=num_tree) as pbar:
             pbar.set_description("setting vector...")
-            for tree in self.tree_list:
-                sentence = [" ".join(tree.sentence)]
-                word_split = [tree.word_split]
-                vector_list, _ = holccg.encode(sentence, word_split=word_split)
-                vector_list = vector_list[0]
-                for pos in tree.original_position:
-                    node_id = pos[0]
-                    original_position = pos[1]
-                    node = tree.node_list[node_id]
-                    node.vector = torch.squeeze(vector_list[original_position])
-                for composition_info in tree.composition_info:
-                    parent_node = tree.node_list[composition_info[1]]
-                    left_node = tree.node_list[composition_info[2]]
-                    right_node = tree.node_list[composition_info[3]]
-                    if holccg.composition == 'corr':
-                        parent_node.vector = circular_correlation(
-                            left_node.vector, right_node.vector, holccg.vector_norm)
-                    elif holccg.composition == 'conv':
-                        parent_node.vector = circular_convolution(
-                            left_node.vector, right_node.vector, holccg.vector_norm)
-                pbar.update(1)
+            for batch_start in range(0, num_tree, batch_size):
+                batch_end = min(batch_start + batch_size, num_tree)
+                tree_id = np.arange(batch_start, batch_end)
+                node_start = self.node_offset[batch_start]
+                node_end = self.node_offset[batch_end]
+                # rows of leaf nodes in the batch and the positions of their words
+                position = slice(self.original_position_offset[batch_start], self.original_position_offset[batch_end])
+                word_tree_idx = np.repeat(np.arange(len(tree_id)), self.num_word[tree_id])
+                leaf_row = self.node_offset[tree_id][word_tree_idx] - node_start + self.original_position[position, 0]
+                # compositions sorted by level, where those of two children and of one child are apart
+                composition = slice(self.composition_offset[batch_start], self.composition_offset[batch_end])
+                num_composition = np.diff(self.composition_offset[batch_start:batch_end + 1])
+                composition_tree_idx = np.repeat(np.arange(len(tree_id)), num_composition)
+                composition_info = self.composition_info[composition]
+                composition_key = 2 * level[composition] + (composition_info[:, 0] == 2)
+                order = np.argsort(composition_key, kind='stable')
+                composition_row = composition_info[order, 1:] + (
+                    self.node_offset[tree_id] - node_start)[composition_tree_idx[order], None]
+                step_key, step_start = np.unique(composition_key[order], return_index=True)
+                step_end = np.append(step_start[1:], len(order))
+
+                input_ids_index, num_input_ids = flat_index(self.input_ids_offset, tree_id)
+                (input_ids, leaf_row, word_tree_idx, word_position, composition_row) = to_device([
+                    self.input_ids[input_ids_index],
+                    leaf_row,
+                    word_tree_idx,
+                    self.original_position[position, 1],
+                    composition_row], holccg.device)
+                word_vector, _ = holccg.encode(
+                    self.sentence_list[batch_start:batch_end],
+                    word_split=self.word_split[batch_start:batch_end],
+                    input_ids=list(input_ids.split(num_input_ids.tolist())))
+                if holccg.spectral:
+                    # compose in Fourier domain and transform back once
+                    word_vector = to_spectrum(word_vector)
+                node_vector = word_vector.new_zeros((int(node_end - node_start), word_vector.shape[-1]))
+                node_vector[leaf_row] = word_vector[word_tree_idx, word_position]
+                for key, start, end in zip(step_key.tolist(), step_start.tolist(), step_end.tolist()):
+                    parent_row, left_row, right_row = composition_row[start:end].unbind(-1)
+                    if key % 2 == 1:
+                        node_vector[parent_row] = holccg.compose_pair(node_vector[left_row], node_vector[right_row])
+                    else:
+                        node_vector[parent_row] = node_vector[left_row]
+                if holccg.spectral:
+                    node_vector = from_spectrum(node_vector, holccg.model_dim)
+                if self.node_vector is None:
+                    self.node_vector = node_vector.new_zeros((int(self.node_offset[-1]), node_vector.shape[-1]))
+                self.node_vector[node_start:node_end] = node_vector
+                pbar.update(len(tree_id))
+        if hasattr(self.tree_list, 'set_vector_id'):
+            # the view of tree store sets the rows when the trees are materialized
+            self.tree_list.set_vector_id(self.node_offset)
+        else:
+            for tree, node_start in zip(self.tree_list, self.node_offset.tolist()):
+                set_vector_id(tree, node_start)
 
     def convert_to_binary(self, type: str) -> None:
         """convert tree to binary tree
@@ -631,7 +1101,7 @@ class TreeList:
                             child_node.parent_node = node
                         else:
                             child_node.parent_node = node.parent_node
-                        child_node.category += '-->' + node.category
+                        child_node.category = sys.intern(child_node.category + '-->' + node.category)
                     elif node.num_child == 2:
                         left_child_node = tree.node_list[node.left_child_node_id]
                         right_child_node = tree.node_list[node.right_child_node_id]
@@ -642,7 +1112,7 @@ class TreeList:
             for node in tree.node_list:
                 if node.is_leaf or node.num_child == 2:
                     node.self_id = node_id
-                    node.prime_category = node.category.split('-->')[0]
+                    node.prime_category = sys.intern(node.category.split('-->')[0])
                     if node.parent_node is not None:
                         parent_node = node.parent_node
                         if parent_node.start_idx == node.start_idx:
@@ -0,0 +1,330 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from tqdm import tqdm
+from utils import load, dump
+from tree import Node, Tree, TreeList, set_vector_id
+from typing import Dict, List, Union
+
+# columns of node table, word table and composition table
+NODE_COLUMNS = {
+    'is_leaf': np.bool_,
+    'category': np.int32,
+    'category_id': np.int32,
+    'pos': np.int32,
+    'left_child_node_id': np.int32,
+    'right_child_node_id': np.int32,
+    'parent_node_id': np.int32,
+    'head': np.int8,
+    'start_idx': np.int32,
+    'end_idx': np.int32}
+WORD_COLUMNS = {'word': np.int32, 'original_position': np.int32}
+COMPOSITION_COLUMNS = {'composition_info': np.int32}
+# attributes of TreeList other than trees, which are kept in meta.pickle
+META_KEYS = ['type', 'min_word_category', 'min_phrase_category', 'word_category_vocab', 'phrase_category_vocab',
+             'head_info']
+
+
+class TreeStore:
+    def __init__(self, path_to_store: str) -> None:
+        """class for binarized trees stored column-wise on disk
+
+        The nodes of all trees are concatenated into one table whose columns are numpy arrays,
+        and the rows of each tree are given by the offsets. Words, composition info and the
+        strings of words, categories and POS tags are stored in the same way, so that every
+        array is memory-mapped and shared across processes without unpickling.
+
+        Parameters
+        ----------
+        path_to_store : str
+            directory of the store made by TreeStore.build
+        """
+        with open(os.path.join(path_to_store, 'meta.json'), 'r') as f:
+            self.info = json.load(f)
+        self.meta = load(os.path.join(path_to_store, 'meta.pickle'))
+        self.array = {}
+        for name in self.info['array']:
+            self.array[name] = np.load(os.path.join(path_to_store, f'{name}.npy'), mmap_mode='r')
+        self.node_offset = self.array['node_offset']
+        self.word_offset = self.array['word_offset']
+        self.composition_offset = self.array['composition_offset']
+        self.string_offset = self.array['string_offset']
+
+    @staticmethod
+    def build(tree_list: TreeList, path_to_store: str) -> 'TreeStore':
+        """Write binarized trees of tree list into columnar store
+
+        Parameters
+        ----------
+        tree_list : TreeList
+            tree list converted to binary tree
+        path_to_store : str
+            directory to store the trees
+
+        Returns
+        -------
+        TreeStore
+            the store
+        """
+        os.makedirs(path_to_store, exist_ok=True)
+        string_id: Dict[str, int] = {}
+
+        def to_id(string: str) -> int:
+            if string not in string_id:
+                string_id[string] = len(string_id)
+            return string_id[string]
+
+        column = {name: [] for name in {**NODE_COLUMNS, **WORD_COLUMNS, **COMPOSITION_COLUMNS}}
+        num_node = []
+        num_word = []
+        num_composition = []
+        with tqdm(total=len(tree_list.tree_list), unit="tree") as pbar:
+            pbar.set_description("Writing tree store...")
+            for tree in tree_list.tree_list:
+                binary_node = set(id(node) for node in tree.node_list)
+                for node in tree.node_list:
+                    column['is_leaf'].append(node.is_leaf)
+                    column['category'].append(to_id(node.category))
+                    column['category_id'].append(node.category_id)
+                    # the unary root removed by binarization is not kept as parent
+                    parent_node = getattr(node, 'parent_node', None)
+                    if parent_node is None or id(parent_node) not in binary_node:
+                        column['parent_node_id'].append(-1)
+                    else:
+                        column['parent_node_id'].append(parent_node.self_id)
+                    if node.is_leaf:
+                        column['pos'].append(to_id(node.pos))
+                        column['left_child_node_id'].append(-1)
+                        column['right_child_node_id'].append(-1)
+                        column['head'].append(-1)
+                        column['start_idx'].append(node.original_position)
+                        column['end_idx'].append(node.original_position + 1)
+                    else:
+                        column['pos'].append(-1)
+                        column['left_child_node_id'].append(node.left_child_node_id)
+                        column['right_child_node_id'].append(node.right_child_node_id)
+                        column['head'].append(node.head)
+                        column['start_idx'].append(node.start_idx)
+                        column['end_idx'].append(node.end_idx)
+                column['word'].extend([to_id(word) for word in tree.sentence])
+                column['original_position'].extend(tree.original_position)
+                column['composition_info'].extend(tree.composition_info)
+                num_node.append(len(tree.node_list))
+                num_word.append(len(tree.sentence))
+                num_composition.append(len(tree.composition_info))
+                pbar.update(1)
+
+        array = {}
+        for name, dtype in {**NODE_COLUMNS, **WORD_COLUMNS, **COMPOSITION_COLUMNS}.items():
+            array[name] = np.array(column[name], dtype=dtype)
+        array['original_position'] = array['original_position'].reshape(-1, 2)
+        array['composition_info'] = array['composition_info'].reshape(-1, 4)
+        encoded = [string.encode('utf-8') for string in string_id]
+        array['string_data'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        for name, count in [
+                ('node_offset', num_node),
+                ('word_offset', num_word),
+                ('composition_offset', num_composition),
+                ('string_offset', [len(string) for string in encoded])]:
+            array[name] = np.concatenate([[0], np.cumsum(count, dtype=np.int64)]).astype(np.int64)
+        for name, value in array.items():
+            np.save(os.path.join(path_to_store, f'{name}.npy'), value)
+        dump({key: getattr(tree_list, key) for key in META_KEYS}, os.path.join(path_to_store, 'meta.pickle'))
+        with open(os.path.join(path_to_store, 'meta.json'), 'w') as f:
+            json.dump({'num_tree': len(tree_list.tree_list), 'array': list(array)}, f)
+        return TreeStore(path_to_store)
+
+    def __len__(self) -> int:
+        return self.info['num_tree']
+
+    def string(self, string_id: int) -> str:
+        """decode string in string table"""
+        start, end = self.string_offset[string_id], self.string_offset[string_id + 1]
+        return self.array['string_data'][start:end].tobytes().decode('utf-8')
+
+    def node_slice(self, tree_id: int) -> slice:
+        return slice(self.node_offset[tree_id], self.node_offset[tree_id + 1])
+
+    def word_slice(self, tree_id: int) -> slice:
+        return slice(self.word_offset[tree_id], self.word_offset[tree_id + 1])
+
+    def composition_slice(self, tree_id: int) -> slice:
+        return slice(self.composition_offset[tree_id], self.composition_offset[tree_id + 1])
+
+    def num_node(self, tree_id: int) -> int:
+        return int(self.node_offset[tree_id + 1] - self.node_offset[tree_id])
+
+    def sentence(self, tree_id: int) -> List[str]:
+        return [self.string(string_id) for string_id in self.array['word'][self.word_slice(tree_id)]]
+
+    def category_id(self, tree_id: int) -> np.ndarray:
+        return np.asarray(self.array['category_id'][self.node_slice(tree_id)])
+
+    def original_position(self, tree_id: int) -> np.ndarray:
+        return np.asarray(self.array['original_position'][self.word_slice(tree_id)])
+
+    def composition_info(self, tree_id: int) -> np.ndarray:
+        return np.asarray(self.array['composition_info'][self.composition_slice(tree_id)])
+
+    def spans(self, tree_id: int) -> List[List[int]]:
+        """start and end index of phrases in the order of Tree.spans, which is top-down"""
+        parent_node_id = self.composition_info(tree_id)[::-1, 1] + self.node_offset[tree_id]
+        return np.stack(
+            [self.array['start_idx'][parent_node_id], self.array['end_idx'][parent_node_id]], axis=1).tolist()
+
+    def tree(self, tree_id: int) -> Tree:
+        """Materialize a tree with the same attributes as the trees of pickled tree list
+
+        Parameters
+        ----------
+        tree_id : int
+            id of tree
+
+        Returns
+        -------
+        Tree
+            the tree
+        """
+        node_slice = self.node_slice(tree_id)
+        column = {name: self.array[name][node_slice].tolist() for name in NODE_COLUMNS}
+        sentence = self.sentence(tree_id)
+        node_list = []
+        for node_id in range(len(column['is_leaf'])):
+            category = self.string(column['category'][node_id])
+            start_idx = column['start_idx'][node_id]
+            end_idx = column['end_idx'][node_id]
+            if column['is_leaf'][node_id]:
+                node = Node(['True', node_id, sentence[start_idx], category, self.string(column['pos'][node_id])])
+                node.original_position = start_idx
+            else:
+                node = Node([
+                    'False',
+                    node_id,
+                    category,
+                    2,
+                    column['left_child_node_id'][node_id],
+                    column['right_child_node_id'][node_id],
+                    column['head'][node_id]])
+                node.ready = True
+            node.sentence = sentence
+            node.start_idx = start_idx
+            node.end_idx = end_idx
+            node.category_id = column['category_id'][node_id]
+            node.prime_category = sys.intern(category.split('-->')[0])
+            node_list.append(node)
+        for node, parent_node_id in zip(node_list, column['parent_node_id']):
+            node.parent_node = None if parent_node_id < 0 else node_list[parent_node_id]
+
+        tree = Tree(tree_id, node_list)
+        tree.sentence = sentence
+        tree.composition_info = self.composition_info(tree_id).tolist()
+        # composition info is in bottom-up order
+        for node in node_list:
+            node.level = 0
+        for _, parent_node_id, left_child_node_id, right_child_node_id in tree.composition_info:
+            node_list[parent_node_id].level = 1 + max(
+                node_list[left_child_node_id].level, node_list[right_child_node_id].level)
+        tree.original_position = self.original_position(tree_id).tolist()
+        tree.spans = self.spans(tree_id)
+        return tree
+
+    def view(self) -> 'TreeStoreView':
+        """list-like view of all trees in the store"""
+        return TreeStoreView(self, np.arange(len(self)), {})
+
+
+class TreeStoreView:
+    def __init__(self, store: TreeStore, tree_id: np.ndarray, cache: Dict[int, Tree]) -> None:
+        """list-like view of trees in tree store, which are materialized on first access and kept
+
+        Parameters
+        ----------
+        store : TreeStore
+            tree store
+        tree_id : np.ndarray
+            id of trees in the view
+        cache : Dict[int, Tree]
+            materialized trees shared by the views of the store
+        """
+        self.store = store
+        self.tree_id = tree_id
+        self.cache = cache
+        # rows of trees in node_vector of tree list, which are set by TreeList.set_vector
+        self.node_offset = None
+
+    def __len__(self) -> int:
+        return len(self.tree_id)
+
+    def __getitem__(self, idx: Union[int, slice]) -> Union[Tree, 'TreeStoreView']:
+        if isinstance(idx, slice):
+            return TreeStoreView(self.store, self.tree_id[idx], self.cache)
+        idx = range(len(self))[idx]
+        tree_id = int(self.tree_id[idx])
+        if tree_id not in self.cache:
+            tree = self.store.tree(tree_id)
+            if self.node_offset is not None:
+                set_vector_id(tree, int(self.node_offset[idx]))
+            self.cache[tree_id] = tree
+        return self.cache[tree_id]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def set_vector_id(self, node_offset: np.ndarray) -> None:
+        """Set the rows of node vectors of the materialized trees, and of the other trees when they are materialized
+
+        Parameters
+        ----------
+        node_offset : np.ndarray
+            offset of the rows of each tree in node_vector of tree list
+        """
+        self.node_offset = node_offset
+        for idx, tree_id in enumerate(self.tree_id.tolist()):
+            if tree_id in self.cache:
+                set_vector_id(self.cache[tree_id], int(node_offset[idx]))
+
+
+def open_tree_list(path_to_tree_list: str, split: str) -> TreeList:
+    """Load tree list of a split, preferring the tree store to the pickled tree list
+
+    Parameters
+    ----------
+    path_to_tree_list : str
+        path to tree list directory
+    split : str
+        'train' or 'dev' or 'test'
+
+    Returns
+    -------
+    TreeList
+        tree list
+    """
+    path_to_store = os.path.join(path_to_tree_list, f'{split}_tree_store')
+    if os.path.exists(os.path.join(path_to_store, 'meta.json')):
+        return TreeList.from_store(TreeStore(path_to_store))
+    return load(os.path.join(path_to_tree_list, f'{split}_tree_list.pickle'))
+
+
+def arg_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--path_to_tree_list', type=str, default='../dataset/tree_list/', help='path to tree list directory')
+    parser.add_argument(
+        '--split', type=str, nargs='+', default=['train', 'dev', 'test'], help='splits to be converted')
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    # convert pickled tree lists made by older preprocessing into tree stores
+    args = arg_parse()
+    for split in args.split:
+        tree_list = load(os.path.join(args.path_to_tree_list, f'{split}_tree_list.pickle'))
+        TreeStore.build(tree_list, os.path.join(args.path_to_tree_list, f'{split}_tree_store'))
+
+
+if __name__ == "__main__":
+    main()
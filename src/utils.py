@@ -1,14 +1,34 @@
-from torch.nn.functional import normalize
+import math
 import pickle
 import random
 import numpy as np
 import torch
 from torch import conj
-from torch.fft import fft, ifft
-from typing import Any
+from torch.fft import rfft, irfft
+from typing import Any, Optional, Tuple
 
 
-def circular_correlation(a: torch.Tensor, b: torch.Tensor, vector_norm: float) -> torch.Tensor:
+def scale_to_norm(v: torch.Tensor, vector_norm: Optional[float]) -> torch.Tensor:
+    """Scale the vector to have the given norm, which is the same as vector_norm * normalize(v).
+
+    Parameters
+    ----------
+    v : torch.Tensor
+        vector to be scaled
+    vector_norm : float
+        max norm of vector. the vector is returned as it is when None
+
+    Returns
+    -------
+    torch.Tensor
+        scaled vector
+    """
+    if vector_norm is None:
+        return v
+    return v * (vector_norm / torch.linalg.vector_norm(v, dim=-1, keepdim=True).clamp_min(1e-12))
+
+
+def circular_correlation(a: torch.Tensor, b: torch.Tensor, vector_norm: Optional[float]) -> torch.Tensor:
     """Compute circular correlation between two vectors.
 
     Parameters
@@ -25,13 +45,11 @@ def circular_correlation(a: torch.Tensor, b: torch.Tensor, vector_norm: float) -
     torch.Tensor
         circular correlation between two vectors
     """
-    a_ = fft(a)
-    b_ = fft(b)
+    a_ = rfft(a)
+    b_ = rfft(b)
     c_ = conj(a_) * b_
-    c = ifft(c_).real
-    if vector_norm is not None:
-        c = vector_norm * normalize(c, dim=-1)
-    return c
+    c = irfft(c_, n=a.shape[-1])
+    return scale_to_norm(c, vector_norm)
 
 
 def inverse_circular_correlation(
@@ -57,19 +75,17 @@ def inverse_circular_correlation(
     torch.Tensor
         inverse circular correlation between two vectors
     """
-    p_ = fft(p)
-    c1_ = fft(c1)
+    p_ = rfft(p)
+    c1_ = rfft(c1)
     if child_is_left:
         c2_ = p_ / (conj(c1_) + 1e-12)
     else:
         c2_ = conj(p_ / (c1_ + 1e-12))
-    c2 = ifft(c2_).real
-    if vector_norm is not None:
-        c2 = vector_norm * normalize(c2, dim=-1)
-    return c2
+    c2 = irfft(c2_, n=p.shape[-1])
+    return scale_to_norm(c2, vector_norm)
 
 
-def circular_convolution(a: torch.Tensor, b: torch.Tensor, vector_norm: float) -> torch.Tensor:
+def circular_convolution(a: torch.Tensor, b: torch.Tensor, vector_norm: Optional[float]) -> torch.Tensor:
     """Compute circular convolution between two vectors.
 
     Parameters
@@ -86,13 +102,11 @@ def circular_convolution(a: torch.Tensor, b: torch.Tensor, vector_norm: float) -
     torch.Tensor
         circular convolution between two vectors
     """
-    a_ = fft(a)
-    b_ = fft(b)
+    a_ = rfft(a)
+    b_ = rfft(b)
     c_ = a_ * b_
-    c = ifft(c_).real
-    if vector_norm is not None:
-        c = vector_norm * normalize(c, dim=-1)
-    return c
+    c = irfft(c_, n=a.shape[-1])
+    return scale_to_norm(c, vector_norm)
 
 
 def inverse_circular_convolution(p: torch.Tensor, c1: torch.Tensor) -> torch.Tensor:
@@ -110,10 +124,10 @@ def inverse_circular_convolution(p: torch.Tensor, c1: torch.Tensor) -> torch.Ten
     torch.Tensor
         inverse circular convolution between two vectors
     """
-    p_ = fft(p)
-    c1_ = conj(fft(c1))
+    p_ = rfft(p)
+    c1_ = conj(rfft(c1))
     c2_ = p_ / (c1_ + 1e-6)
-    c2 = ifft(c2_).real
+    c2 = irfft(c2_, n=p.shape[-1])
     return c2
 
 
@@ -121,7 +135,7 @@ def shuffled_circular_convolution(
     a: torch.Tensor,
     b: torch.Tensor,
     P: torch.Tensor,
-        vector_norm: float) -> torch.Tensor:
+        vector_norm: Optional[float]) -> torch.Tensor:
     """Compute circular convolution between two vectors.
 
     Parameters
@@ -140,13 +154,183 @@ def shuffled_circular_convolution(
     torch.Tensor
         circular convolution between two vectors
     """
-    a_ = fft(a)
-    b_ = fft(torch.index_select(b, -1, P))
+    a_ = rfft(a)
+    b_ = rfft(torch.index_select(b, -1, P))
     c_ = a_ * b_
-    c = ifft(c_).real
+    c = irfft(c_, n=a.shape[-1])
+    return scale_to_norm(c, vector_norm)
+
+
+def compose_pair(
+        left: torch.Tensor,
+        right: torch.Tensor,
+        composition: str,
+        P: Optional[torch.Tensor],
+        vector_norm: Optional[float]) -> torch.Tensor:
+    """Compose the vectors of left and right child into the vector of parent.
+
+    This function is kept compilable by TorchScript, since it is used in exported models.
+
+    Parameters
+    ----------
+    left : torch.Tensor
+        vector of left child
+    right : torch.Tensor
+        vector of right child
+    composition : str
+        type of composition, 'corr', 'conv' or 's_conv'
+    P : torch.Tensor
+        permutation used for 's_conv'
+    vector_norm : float
+        max norm of vector
+
+    Returns
+    -------
+    torch.Tensor
+        vector of parent
+    """
+    if composition == 'corr':
+        return circular_correlation(left, right, vector_norm)
+    elif composition == 'conv':
+        return circular_convolution(left, right, vector_norm)
+    elif composition == 's_conv':
+        assert P is not None
+        return shuffled_circular_convolution(left, right, P, vector_norm)
+    else:
+        raise ValueError(f'composition {composition} is not supported')
+
+
+def compose_pair_backward(
+        grad: torch.Tensor,
+        left: torch.Tensor,
+        right: torch.Tensor,
+        composition: str,
+        P: torch.Tensor,
+        vector_norm: float) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Compute the gradient of compose_pair with respect to left and right child.
+
+    Parameters
+    ----------
+    grad : torch.Tensor
+        gradient with respect to the vector of parent
+    left : torch.Tensor
+        vector of left child
+    right : torch.Tensor
+        vector of right child
+    composition : str
+        type of composition, 'corr', 'conv' or 's_conv'
+    P : torch.Tensor
+        permutation used for 's_conv'
+    vector_norm : float
+        max norm of vector
+
+    Returns
+    -------
+    Tuple[torch.Tensor, torch.Tensor]
+        gradient with respect to left and right child
+    """
     if vector_norm is not None:
-        c = vector_norm * normalize(c, dim=-1)
-    return c
+        # backward of vector_norm * c / |c|
+        c = compose_pair(left, right, composition, P, None)
+        c_norm = torch.linalg.vector_norm(c, dim=-1, keepdim=True).clamp_min(1e-12)
+        u = c / c_norm
+        grad = vector_norm / c_norm * (grad - u * torch.sum(u * grad, dim=-1, keepdim=True))
+    if composition == 'corr':
+        # c[k] = sum_i a[i] b[i + k]
+        grad_left = circular_correlation(grad, right, None)
+        grad_right = circular_convolution(grad, left, None)
+    elif composition == 'conv':
+        # c[k] = sum_i a[i] b[k - i]
+        grad_left = circular_correlation(right, grad, None)
+        grad_right = circular_correlation(left, grad, None)
+    elif composition == 's_conv':
+        grad_left = circular_correlation(torch.index_select(right, -1, P), grad, None)
+        grad_right = torch.empty_like(grad_left)
+        grad_right[..., P] = circular_correlation(left, grad, None)
+    return grad_left, grad_right
+
+
+def to_spectrum(v: torch.Tensor) -> torch.Tensor:
+    """Transform the vector into Fourier domain.
+
+    Only the non-negative frequencies are kept, since the vector is real.
+
+    Parameters
+    ----------
+    v : torch.Tensor
+        vector in real domain
+
+    Returns
+    -------
+    torch.Tensor
+        spectrum of the vector
+    """
+    return rfft(v)
+
+
+def from_spectrum(v_: torch.Tensor, dim: int) -> torch.Tensor:
+    """Materialize the vector in real domain from its spectrum.
+
+    Parameters
+    ----------
+    v_ : torch.Tensor
+        spectrum of the vector
+    dim : int
+        dimension of the vector in real domain
+
+    Returns
+    -------
+    torch.Tensor
+        vector in real domain
+    """
+    return irfft(v_, n=dim)
+
+
+def spectral_compose_pair(
+        left_: torch.Tensor,
+        right_: torch.Tensor,
+        composition: str,
+        vector_norm: float,
+        dim: int) -> torch.Tensor:
+    """Compose the spectra of left and right child into the spectrum of parent.
+
+    The norm of the composed vector is computed from its spectrum by Parseval's identity,
+    so that the result equals the spectrum of compose_pair without any transform.
+
+    Parameters
+    ----------
+    left_ : torch.Tensor
+        spectrum of left child
+    right_ : torch.Tensor
+        spectrum of right child
+    composition : str
+        type of composition, 'corr' or 'conv'
+    vector_norm : float
+        max norm of vector
+    dim : int
+        dimension of the vector in real domain
+
+    Returns
+    -------
+    torch.Tensor
+        spectrum of parent
+    """
+    if composition == 'corr':
+        c_ = conj(left_) * right_
+    elif composition == 'conv':
+        c_ = left_ * right_
+    else:
+        raise ValueError(f'composition {composition} is not supported in Fourier domain')
+    if vector_norm is not None:
+        # |c|^2 = sum(|c_|^2) / dim over all frequencies, where every frequency except
+        # the zero (and the Nyquist frequency for even dim) appears twice in the full spectrum
+        power = c_.real ** 2 + c_.imag ** 2
+        power = 2 * torch.sum(power, dim=-1, keepdim=True) - power[..., :1]
+        if dim % 2 == 0:
+            power = power - c_[..., -1:].real ** 2 - c_[..., -1:].imag ** 2
+        c_norm = torch.sqrt(power / dim)
+        c_ = c_ * (vector_norm / c_norm.clamp_min(1e-12))
+    return c_
 
 
 def complex_normalize(v: torch.Tensor) -> torch.Tensor:
@@ -162,12 +346,53 @@ def complex_normalize(v: torch.Tensor) -> torch.Tensor:
     torch.Tensor
         normalized vector
     """
-    v_ = fft(v)
+    v_ = rfft(v)
     v_ = v_ / (torch.abs(v_) + 1e-12)
-    v = ifft(v_).real
+    v = irfft(v_, n=v.shape[-1])
     return v
 
 
+def num_candidate(num_class: int, threshold: float) -> int:
+    """Compute the number of top classes which contain all classes above threshold
+
+    At most 1 / threshold classes have probability above threshold. Two more classes are kept
+    for the top class, which is always used, and for <unk>, which is removed after prediction.
+
+    Parameters
+    ----------
+    num_class : int
+        number of classes
+    threshold : float
+        threshold of probability
+
+    Returns
+    -------
+    int
+        number of top classes to be predicted
+    """
+    if threshold <= 0.0:
+        return num_class
+    return min(num_class, int(1 / threshold) + 2)
+
+
+def log_threshold(threshold: float) -> float:
+    """Convert the threshold of probability into that of log likelihood
+
+    Parameters
+    ----------
+    threshold : float
+        threshold of probability
+
+    Returns
+    -------
+    float
+        threshold of log likelihood, which is -inf when every probability passes the threshold
+    """
+    if threshold <= 0.0:
+        return -math.inf
+    return math.log(threshold)
+
+
 def set_random_seed(seed: int) -> None:
     """Set random seed.
 
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import torch
+from transformers import BertTokenizerFast
+from tree import TreeList, to_device
+
+TREE_LIST = """True 0 the NP/N POS
+True 1 cat N POS
+False 2 NP 2 0 1 1
+True 3 ran S\\NP POS
+False 4 S 2 2 3 1
+
+True 0 dog N POS
+False 1 NP 1 0 0
+True 2 ran S\\NP POS
+True 3 fast (S\\NP)\\(S\\NP) POS
+False 4 S\\NP 2 2 3 0
+False 5 S 2 1 4 1
+
+"""
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'the', 'cat', 'ran', 'dog', 'fast']
+
+
+@pytest.fixture
+def tree_list(tmp_path):
+    path_to_tree_list = tmp_path / 'tree_list.txt'
+    path_to_tree_list.write_text(TREE_LIST)
+    path_to_vocab = tmp_path / 'vocab.txt'
+    path_to_vocab.write_text('\n'.join(VOCAB) + '\n')
+    tree_list = TreeList(str(path_to_tree_list), 'train', device=torch.device('cpu'))
+    tree_list.convert_to_binary('train')
+    tree_list.set_info_for_training(BertTokenizerFast(str(path_to_vocab), do_lower_case=True))
+    return tree_list
+
+
+def test_to_device_with_str_device():
+    array_list = [np.arange(3), np.arange(6).reshape(2, 3)]
+    tensor_list = to_device(array_list, 'cpu')
+    for tensor, array in zip(tensor_list, array_list):
+        assert tensor.device == torch.device('cpu')
+        assert tensor.tolist() == array.tolist()
+
+
+def test_collate_with_str_device(tree_list):
+    # device of command line arguments is given by its name
+    tree_list.device = 'cpu'
+    batch = tree_list.collate([0, 1], tree_list.generate_random_tree_info())
+    tensor_list = [item for item in batch if isinstance(item, torch.Tensor)]
+    assert len(tensor_list) > 0
+    assert all(tensor.device == torch.device('cpu') for tensor in tensor_list)
@@ -0,0 +1,82 @@
+import pytest
+import torch
+from torch.fft import fft, ifft
+from utils import (compose_pair, compose_pair_backward, from_spectrum, spectral_compose_pair,
+                   to_spectrum)
+
+DIM_LIST = [7, 8]
+VECTOR_NORM_LIST = [None, 3.0]
+COMPOSITION_LIST = ['corr', 'conv', 's_conv']
+
+
+def reference_compose_pair(left, right, composition, P, vector_norm):
+    # compose by the full complex fft, independent of the rfft kernels
+    if composition == 's_conv':
+        right = right[..., P]
+    if composition == 'corr':
+        c_ = torch.conj(fft(left)) * fft(right)
+    else:
+        c_ = fft(left) * fft(right)
+    c = ifft(c_).real
+    if vector_norm is not None:
+        c = vector_norm * c / torch.linalg.vector_norm(c, dim=-1, keepdim=True)
+    return c
+
+
+def make_input(dim, requires_grad=False):
+    generator = torch.Generator().manual_seed(dim)
+    left = torch.randn(5, dim, dtype=torch.float64, generator=generator, requires_grad=requires_grad)
+    right = torch.randn(5, dim, dtype=torch.float64, generator=generator, requires_grad=requires_grad)
+    P = torch.randperm(dim, generator=generator)
+    return left, right, P
+
+
+@pytest.mark.parametrize('dim', DIM_LIST)
+@pytest.mark.parametrize('vector_norm', VECTOR_NORM_LIST)
+@pytest.mark.parametrize('composition', COMPOSITION_LIST)
+def test_compose_pair(dim, vector_norm, composition):
+    left, right, P = make_input(dim)
+    expected = reference_compose_pair(left, right, composition, P, vector_norm)
+    actual = compose_pair(left, right, composition, P, vector_norm)
+    torch.testing.assert_close(actual, expected)
+
+
+@pytest.mark.parametrize('dim', DIM_LIST)
+@pytest.mark.parametrize('vector_norm', VECTOR_NORM_LIST)
+@pytest.mark.parametrize('composition', ['corr', 'conv'])
+def test_spectral_compose_pair(dim, vector_norm, composition):
+    left, right, P = make_input(dim)
+    expected = reference_compose_pair(left, right, composition, P, vector_norm)
+    c_ = spectral_compose_pair(to_spectrum(left), to_spectrum(right), composition, vector_norm, dim)
+    torch.testing.assert_close(from_spectrum(c_, dim), expected)
+
+
+def test_spectral_compose_pair_rejects_s_conv():
+    left, right, _ = make_input(8)
+    with pytest.raises(ValueError):
+        spectral_compose_pair(to_spectrum(left), to_spectrum(right), 's_conv', None, 8)
+
+
+class ComposePair(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, left, right, composition, P, vector_norm):
+        ctx.save_for_backward(left, right)
+        ctx.composition = composition
+        ctx.P = P
+        ctx.vector_norm = vector_norm
+        return compose_pair(left, right, composition, P, vector_norm)
+
+    @staticmethod
+    def backward(ctx, grad):
+        left, right = ctx.saved_tensors
+        grad_left, grad_right = compose_pair_backward(grad, left, right, ctx.composition, ctx.P, ctx.vector_norm)
+        return grad_left, grad_right, None, None, None
+
+
+@pytest.mark.parametrize('dim', DIM_LIST)
+@pytest.mark.parametrize('vector_norm', VECTOR_NORM_LIST)
+@pytest.mark.parametrize('composition', COMPOSITION_LIST)
+def test_compose_pair_backward(dim, vector_norm, composition):
+    left, right, P = make_input(dim, requires_grad=True)
+    assert torch.autograd.gradcheck(
+        lambda left, right: ComposePair.apply(left, right, composition, P, vector_norm), (left, right))